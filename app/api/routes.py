@@ -1,83 +1,197 @@
-from fastapi import APIRouter, Depends, HTTPException
-from starlette.responses import FileResponse
+from fastapi import APIRouter, Depends, HTTPException, Request
+from botocore.exceptions import ClientError
+from starlette.responses import FileResponse, JSONResponse, RedirectResponse, StreamingResponse
 import os
-from app.dependencies import get_match_downloader, get_sqs_client
-from app.queue.sqs_client import SqsClient
+from app.dependencies import get_enqueuer, get_data, get_job_manager, get_match_downloader, get_s3_client
+from app.data.data import Data, is_known_unavailable
+from app.data.schema import VideoStatus
+from app.queue.enqueuer import Enqueuer
+from app.service.jobs import JobManager, JobKind, JobStatus
 from app.service.matchdownloader import MatchDownloader
+from app.s3_client import S3client
 from app.queue.messages import MatchUploadMessage, MergeVideosMessage, MergeRequest, DownloadVideoMessage
+from app.metrics import metrics
 import json
 
 router = APIRouter()
 
-@router.get("/matches/{match_id}/download", description="Downloads the video for a specific match.")
+PRESIGNED_URL_EXPIRY = 3600
+
+def job_response(job: dict):
+    job_id = job["_id"]
+    return {
+        "job_id": job_id,
+        "status": job["status"],
+        "status_url": f"/api/jobs/{job_id}",
+        "events_url": f"/api/jobs/{job_id}/events",
+    }
+
+@router.get("/matches/{match_id}/download", description="Serves an already ingested match video, otherwise starts a job that downloads it.")
 async def download_match_video_route(
     match_id: str,
-    match_downloader: MatchDownloader = Depends(get_match_downloader)
+    request: Request,
+    mode: str = "redirect",
+    force: bool = False,
+    match_downloader: MatchDownloader = Depends(get_match_downloader),
+    s3_client: S3client = Depends(get_s3_client),
+    job_manager: JobManager = Depends(get_job_manager)
 ):
-    try:
-        video_path = await match_downloader.download_match_video(match_id)
-        if not os.path.exists(video_path):
-            raise HTTPException(status_code=404, detail="Match video not found.")
+    object_key = await match_downloader.find_ingested_object(match_id)
+    if not object_key:
+        job = await job_manager.submit(JobKind.DOWNLOAD, match_id, force=force)
+        return JSONResponse(status_code=202, content=job_response(job))
 
-        return FileResponse(
-            path=video_path,
-            media_type="video/mp4",
-            filename=f"match_{match_id}.mp4"
+    filename = f"match_{match_id}.mp4"
+    if mode != "proxy":
+        return RedirectResponse(
+            s3_client.generate_presigned_url(object_key, expires_in=PRESIGNED_URL_EXPIRY, filename=filename),
+            status_code=307
         )
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        print(f"An error occurred: {e}")
-        raise HTTPException(status_code=500, detail="Internal server error while processing the download.")
+
+    byte_range = request.headers.get("range")
+    try:
+        s3_object = await s3_client.get_object(object_key, byte_range=byte_range)
+    except ClientError as e:
+        if e.response["Error"]["Code"] == "InvalidRange":
+            raise HTTPException(status_code=416, detail="Requested range not satisfiable.")
+        raise HTTPException(status_code=502, detail="Failed to read match video from storage.")
+
+    headers = {
+        "Accept-Ranges": "bytes",
+        "Content-Length": str(s3_object["ContentLength"]),
+        "Content-Disposition": f'attachment; filename="{filename}"',
+    }
+    if s3_object.get("ContentRange"):
+        headers["Content-Range"] = s3_object["ContentRange"]
+    if s3_object.get("ETag"):
+        headers["ETag"] = s3_object["ETag"]
+
+    return StreamingResponse(
+        s3_client.iter_object_body(s3_object["Body"]),
+        status_code=206 if s3_object.get("ContentRange") else 200,
+        media_type=s3_object.get("ContentType") or "video/mp4",
+        headers=headers
+    )
     
-@router.post("/matches/{match_id}/upload", description="Uploads the video for a specific match.")
+@router.post("/matches/{match_id}/upload", status_code=202, description="Starts a job that downloads and uploads the video for a specific match.")
 async def upload_match_video_route(
     match_id: str,
-    match_downloader: MatchDownloader = Depends(get_match_downloader)
+    force: bool = False,
+    job_manager: JobManager = Depends(get_job_manager)
 ):
-    try:
-        video_path = await match_downloader.download_match_video(match_id)
-        if not os.path.exists(video_path):
+    job = await job_manager.submit(JobKind.UPLOAD, match_id, force=force)
+    return job_response(job)
+
+@router.get("/jobs/{job_id}", description="Returns the status and progress of a job.")
+async def get_job_route(
+    job_id: str,
+    job_manager: JobManager = Depends(get_job_manager)
+):
+    job = await job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    return job
+
+@router.get("/jobs/{job_id}/events", description="Streams job stage and progress events as Server-Sent Events.")
+async def job_events_route(
+    job_id: str,
+    job_manager: JobManager = Depends(get_job_manager)
+):
+    if not await job_manager.get(job_id):
+        raise HTTPException(status_code=404, detail="Job not found.")
+
+    async def event_stream():
+        async for event in job_manager.events(job_id):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                yield f"event: {event['status']}\ndata: {json.dumps(event, default=str)}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@router.get("/jobs/{job_id}/file", description="Serves the file produced by a finished download job.")
+async def job_file_route(
+    job_id: str,
+    s3_client: S3client = Depends(get_s3_client),
+    job_manager: JobManager = Depends(get_job_manager)
+):
+    job = await job_manager.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found.")
+    result = job.get("result") or {}
+    if job["status"] != JobStatus.SUCCEEDED.value or result.get("expired") or not result.get("path"):
+        raise HTTPException(status_code=409, detail="Job has no downloadable file.")
+
+    filename = f"match_{job['match_id']}.mp4"
+    video_path = result["path"]
+    if not os.path.exists(video_path):
+        # the job ran on another replica, serve the copy staged in the bucket
+        if not result.get("object_key"):
             raise HTTPException(status_code=404, detail="Match video not found.")
-        
-        result = await match_downloader.upload_match_video(video_path, os.path.basename(video_path))
-        if not result:
-            raise HTTPException(status_code=500, detail="Failed to upload match video.")
-        return {"message": "Match video uploaded successfully.", "url": result}
-    except HTTPException as e:
-        raise e
-    except Exception as e:
-        print(f"An error occurred: {e}")
+        return RedirectResponse(
+            s3_client.generate_presigned_url(result["object_key"], expires_in=PRESIGNED_URL_EXPIRY, filename=filename),
+            status_code=307
+        )
+
+    return FileResponse(
+        path=video_path,
+        media_type="video/mp4",
+        filename=filename
+    )
 
 @router.post('/match/{matchId}/upload')
-async def upload_match_video(matchId: str, sqsClient: SqsClient = Depends(get_sqs_client) ):
+async def upload_match_video(
+        matchId: str,
+        force: bool = False,
+        enqueuer: Enqueuer = Depends(get_enqueuer),
+        data: Data = Depends(get_data)
+):
+    if not force:
+        match = await data.get_match_video_info(matchId, fresh=True)
+        if match and is_known_unavailable(match.video_ingest, match.match_video):
+            raise HTTPException(
+                status_code=409,
+                detail=f"Match video is unavailable ({match.video_ingest.get('unavailable_reason')}), "
+                       f"pass force=true to retry it."
+            )
+
     message = MatchUploadMessage(matchId=matchId)
     message.set_post_date()
-    message_body_json = json.dumps(message.to_dict())
-    response = sqsClient.send_message(message_body_json)
-    return response.get('MessageId')
+    if force:
+        # the message that found the video unavailable is usually still inside the dedup window
+        await enqueuer.release(message)
+    message_id, duplicate = await enqueuer.enqueue(message)
+    if not duplicate:
+        await data.set_video_status(matchId, VideoStatus.QUEUED)
+    return message_id
 
 
 @router.post('/merge_videos')
 async def merge_videos(
         request: MergeRequest,
-        sqsClient: SqsClient = Depends(get_sqs_client)
+        enqueuer: Enqueuer = Depends(get_enqueuer)
 ):
     message = MergeVideosMessage(video1=request.video1, video2=request.video2, output_name=request.output_name)
     message.set_post_date()
 
-    message_body_json = json.dumps(message.to_dict())
-    response = sqsClient.send_message(message_body_json)
+    message_id, _ = await enqueuer.enqueue(message)
 
-    return response.get('MessageId')
+    return message_id
 
 @router.post("/download_video")
 async def download_video(
         request: DownloadVideoMessage,
-        sqsClient: SqsClient = Depends(get_sqs_client)
+        enqueuer: Enqueuer = Depends(get_enqueuer)
 ):
     message = DownloadVideoMessage(link=request.link, output_name=request.output_name)
     message.set_post_date()
-    message_body_json = json.dumps(message.to_dict())
-    response = sqsClient.send_message(message_body_json)
-    return response.get('MessageId')
+    message_id, _ = await enqueuer.enqueue(message)
+    return message_id
+
+@router.get("/metrics", description="Returns in-process pipeline metrics.")
+async def get_metrics():
+    return metrics.snapshot()
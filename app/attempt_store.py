@@ -0,0 +1,124 @@
+import logging
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Tuple
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# a strategy is only demoted once it has failed often enough to be sure
+MIN_SAMPLES = 3
+MIN_SUCCESS_RATE = 0.25
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS attempts (
+    at REAL NOT NULL,
+    platform TEXT NOT NULL,
+    host TEXT NOT NULL,
+    strategy TEXT NOT NULL,
+    format_spec TEXT NOT NULL,
+    tor INTEGER NOT NULL,
+    success INTEGER NOT NULL,
+    seconds REAL NOT NULL,
+    bytes INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS attempts_host_strategy ON attempts (host, strategy, at);
+"""
+
+
+class StrategyStats:
+    def __init__(self, attempts: int = 0, successes: int = 0, success_seconds: float = None,
+                 failure_seconds: float = None, success_bytes: float = None):
+        self.attempts = attempts
+        self.successes = successes
+        self.success_seconds = success_seconds
+        self.failure_seconds = failure_seconds
+        self.success_bytes = success_bytes
+
+    @property
+    def success_rate(self):
+        # laplace smoothing keeps a single early failure from burying a strategy
+        return (self.successes + 1) / (self.attempts + 2)
+
+    @property
+    def expected_seconds(self):
+        """Expected time to a successful download when retrying this strategy until it works."""
+        if self.success_seconds is None:
+            return float("inf")
+        failures = (1 - self.success_rate) / self.success_rate
+        return self.success_seconds + failures * (self.failure_seconds or 0)
+
+
+class AttemptStore:
+    """Per-node log of yt-dlp attempt outcomes in a small SQLite file."""
+
+    def __init__(self, path: str, retention_days: int = 30):
+        self.path = path
+        self.retention = retention_days * 24 * 3600
+        self._lock = threading.Lock()
+        # calls arrive from asyncio.to_thread workers
+        self._connection = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript(SCHEMA)
+            self._connection.execute("DELETE FROM attempts WHERE at < ?", (time.time() - self.retention,))
+
+    def record(self, platform: str, host: str, strategy: str, format_spec: str, tor: bool, success: bool,
+               seconds: float, nbytes: int = 0):
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT INTO attempts VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (time.time(), platform, host, strategy, format_spec, int(tor), int(success), seconds, nbytes)
+            )
+
+    def stats(self, host: str) -> Dict[str, StrategyStats]:
+        with self._lock:
+            rows = self._connection.execute(
+                """
+                SELECT strategy,
+                       COUNT(*),
+                       SUM(success),
+                       AVG(CASE WHEN success THEN seconds END),
+                       AVG(CASE WHEN NOT success THEN seconds END),
+                       AVG(CASE WHEN success THEN bytes END)
+                FROM attempts
+                WHERE host = ? AND at >= ?
+                GROUP BY strategy
+                """,
+                (host, time.time() - self.retention)
+            ).fetchall()
+        return {row[0]: StrategyStats(*row[1:]) for row in rows}
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def order_strategies(strategies: List[str], stats: Dict[str, StrategyStats]) -> Tuple[List[str], List[str]]:
+    """Keeps the preferred order for strategies that work on this host and demotes the ones that keep failing.
+
+    Demoted strategies are ordered by expected time to success. Returns the order and a line of reasoning per strategy.
+    """
+    viable = []
+    demoted = []
+    trace = []
+    for strategy in strategies:
+        s = stats.get(strategy)
+        if s is None or s.attempts < MIN_SAMPLES:
+            viable.append(strategy)
+            trace.append(f"{strategy}: kept in place, {s.attempts if s else 0} attempts recorded")
+        elif s.success_rate >= MIN_SUCCESS_RATE:
+            viable.append(strategy)
+            trace.append(
+                f"{strategy}: kept in place, success {s.success_rate:.0%} over {s.attempts} attempts, "
+                f"~{s.expected_seconds:.0f}s expected"
+            )
+        else:
+            demoted.append(strategy)
+            trace.append(
+                f"{strategy}: demoted, success {s.success_rate:.0%} over {s.attempts} attempts "
+                f"(failures take ~{s.failure_seconds or 0:.0f}s)"
+            )
+
+    demoted.sort(key=lambda strategy: stats[strategy].expected_seconds)
+    return viable + demoted, trace
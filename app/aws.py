@@ -0,0 +1,68 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+from botocore.config import Config
+
+from app.metrics import metrics
+
+_clients = {}
+_executors = {}
+_lock = threading.Lock()
+
+
+def get_boto_client(service: str, aws_access_key, aws_secret_key, aws_region, max_pool_connections: int):
+    key = (service, aws_access_key, aws_region, max_pool_connections)
+    with _lock:
+        if key not in _clients:
+            _clients[key] = boto3.client(
+                service,
+                aws_access_key_id=aws_access_key,
+                aws_secret_access_key=aws_secret_key,
+                region_name=aws_region,
+                config=Config(
+                    max_pool_connections=max_pool_connections,
+                    retries={"mode": "standard"},
+                ),
+            )
+        return _clients[key]
+
+
+class IoExecutor:
+    def __init__(self, name: str, max_workers: int):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{name}-io")
+        self.queue_wait = metrics.histogram(f"{name}.queue_wait_seconds")
+        self.call_time = metrics.histogram(f"{name}.call_seconds")
+
+    async def run(self, fn, *args, **kwargs):
+        submitted = time.monotonic()
+
+        def call():
+            started = time.monotonic()
+            self.queue_wait.observe(started - submitted)
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                self.call_time.observe(time.monotonic() - started)
+
+        return await asyncio.get_running_loop().run_in_executor(self.executor, call)
+
+    def shutdown(self, wait: bool = True):
+        self.executor.shutdown(wait=wait)
+
+
+def get_executor(name: str, max_workers: int) -> IoExecutor:
+    with _lock:
+        if name not in _executors:
+            _executors[name] = IoExecutor(name, max_workers)
+        executor = _executors[name]
+    # the pool is shared by name, a caller asking for another size would silently not get it
+    if executor.max_workers != max_workers:
+        raise ValueError(
+            f"Executor '{name}' already runs {executor.max_workers} workers, cannot share it with {max_workers}"
+        )
+    return executor
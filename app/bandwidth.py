@@ -0,0 +1,112 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from enum import Enum
+from typing import Dict
+from app.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# how far ahead of its rate a transfer may run before it is made to sleep
+BURST_SECONDS = 0.5
+# a transfer started on a fully committed pool still gets this share of the budget rather than no limit at all
+MIN_SHARE = 0.05
+
+
+class TransferClass(str, Enum):
+    DOWNLOAD = "download"
+    UPLOAD = "upload"
+
+
+class Allocation:
+    def __init__(self, governor, transfer_class: TransferClass, pool: str, weight: float, fixed: bool = False):
+        self.governor = governor
+        self.transfer_class = transfer_class
+        self.pool = pool
+        self.weight = weight
+        # the rate of a fixed allocation is committed once, for transfers that cannot change it while running
+        self.fixed = fixed
+        # bytes per second, 0 while the pool is unlimited; rewritten whenever the pool rebalances unless fixed
+        self.rate = 0.0
+        self._next_at = 0.0
+        self._lock = threading.Lock()
+
+    def throttle(self, nbytes: int):
+        """Blocks the calling transfer thread long enough to keep this allocation at its rate."""
+        rate = self.rate
+        if not rate or nbytes <= 0:
+            return
+        with self._lock:
+            now = time.monotonic()
+            self._next_at = max(self._next_at, now) + nbytes / rate
+            delay = self._next_at - now - BURST_SECONDS
+        if delay > 0:
+            self.governor.throttled_seconds.observe(delay)
+            time.sleep(delay)
+
+
+class BandwidthGovernor:
+    """Splits node ingress/egress budgets across active transfers by the weight of their class."""
+
+    def __init__(self, ingress_bps: int = 0, egress_bps: int = 0, shared_link: bool = False,
+                 weights: Dict[TransferClass, float] = None, fixed_slots: int = 0):
+        # a shared link puts uploads in the ingress pool so download and upload weights compete
+        self.budgets = {"ingress": ingress_bps, "egress": 0 if shared_link else egress_bps}
+        self.pools = {
+            TransferClass.DOWNLOAD: "ingress",
+            TransferClass.UPLOAD: "ingress" if shared_link else "egress",
+        }
+        self.weights = {TransferClass.DOWNLOAD: 1.0, TransferClass.UPLOAD: 1.0, **(weights or {})}
+        self._active = {pool: set() for pool in self.budgets}
+        # how many fixed transfers can run at once; a fixed one never commits more than its slot of the budget,
+        # otherwise the first of them takes everything and those started next to it are pinned to the minimum
+        self.fixed_slots = fixed_slots
+        self._lock = threading.Lock()
+        self.throttled_seconds = metrics.histogram("bandwidth.throttled_seconds")
+
+    def _commit(self, allocation: Allocation, max_rate: float = 0):
+        # fair share, but never more than running fixed transfers left uncommitted or the transfer can use
+        budget = self.budgets[allocation.pool]
+        if not budget:
+            allocation.rate = float(max_rate)
+            return
+        allocations = self._active[allocation.pool]
+        total_weight = sum(other.weight for other in allocations) + allocation.weight
+        committed = sum(other.rate for other in allocations if other.fixed)
+        share = budget * allocation.weight / total_weight
+        if self.fixed_slots:
+            share = min(share, budget / self.fixed_slots)
+        if max_rate:
+            share = min(share, max_rate)
+        allocation.rate = max(min(share, budget - committed), min(budget * MIN_SHARE, share))
+
+    def _rebalance(self, pool: str):
+        budget = self.budgets[pool]
+        allocations = self._active[pool]
+        # adaptive transfers split whatever the fixed ones have not committed
+        committed = sum(allocation.rate for allocation in allocations if allocation.fixed)
+        remaining = max(budget - committed, budget * MIN_SHARE)
+        adaptive = [allocation for allocation in allocations if not allocation.fixed]
+        total_weight = sum(allocation.weight for allocation in adaptive)
+        for allocation in adaptive:
+            allocation.rate = remaining * allocation.weight / total_weight if budget else 0.0
+
+    @contextmanager
+    def allocate(self, transfer_class: TransferClass, weight: float = None, fixed: bool = False, max_rate: float = 0):
+        """max_rate caps what a fixed allocation commits, for transfers limited below any share of the budget."""
+        pool = self.pools[transfer_class]
+        allocation = Allocation(self, transfer_class, pool, weight or self.weights[transfer_class], fixed=fixed)
+        with self._lock:
+            if fixed:
+                self._commit(allocation, max_rate)
+            self._active[pool].add(allocation)
+            self._rebalance(pool)
+        try:
+            yield allocation
+        finally:
+            with self._lock:
+                self._active[pool].discard(allocation)
+                self._rebalance(pool)
+
@@ -0,0 +1,16 @@
+import hashlib
+
+CHUNK_SIZE = 8 * 1024 * 1024
+
+
+def sha256_file(file_path: str, chunk_size: int = CHUNK_SIZE):
+    digest = hashlib.sha256()
+    size = 0
+    with open(file_path, "rb") as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            digest.update(chunk)
+            size += len(chunk)
+    return digest.hexdigest(), size
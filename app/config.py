@@ -1,3 +1,4 @@
+from typing import Dict, Optional
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
@@ -8,10 +9,96 @@ class Settings(BaseSettings):
     aws_region: str
     aws_bucket: str
     sqs_queue_url: str
+    enqueue_dedup_window_seconds: int = 3600
+    # JSON map of lane -> queue url ("fast", "slow", "transcode"); lanes left out use sqs_queue_url
+    sqs_lane_queue_urls: Dict[str, str] = {}
+    # messages that failed retry_max_attempts times land here; without one they are dropped
+    sqs_dead_letter_queue_url: Optional[str] = None
+    retry_base_delay_seconds: int = 60
+    retry_max_delay_seconds: int = 6 * 3600
+    retry_max_attempts: int = 5
+
+    # AWS I/O pools
+    s3_max_workers: int = 8
+    s3_max_pool_connections: int = 64
+    s3_transfer_concurrency: int = 8
+    # uploads and downloads run on their own threads so they never queue short calls behind them
+    s3_transfer_workers: int = 4
+    # smaller uploads are sent as they are, hashing them for dedup costs more than it can save
+    upload_dedup_min_bytes: int = 64 * 1024 ** 2
+    sqs_max_workers: int = 4
+    sqs_max_pool_connections: int = 10
+
+    # local working directory for downloads
+    download_dir: str = "downloads"
+
+    # S3 object key layout
+    s3_key_scheme: str = "sharded"
+    s3_key_prefix: str = "matches"
+    s3_key_shard_chars: int = 2
+
+    # S3 bucket inventory
+    s3_inventory_enabled: bool = False
+    s3_inventory_prefix: str = ""
+    s3_inventory_cache_path: str = "s3_inventory.json.gz"
+    s3_inventory_refresh_seconds: int = 3600
 
     # mongo configs
     database_connection_string: str
     database_name: str
+    mongo_write_batching: bool = True
+    mongo_write_batch_size: int = 100
+    mongo_write_batch_delay: float = 0.2
+    match_cache_size: int = 2048
+    match_cache_ttl: float = 30
+    # queued or downloading matches older than this count as backlog again, their message was lost
+    backlog_stuck_after_seconds: int = 24 * 3600
+
+    # worker scheduling
+    # JSON map of lane -> concurrency this worker consumes, e.g. {"fast": 4, "slow": 1}; empty polls sqs_queue_url only
+    worker_lanes: Dict[str, int] = {}
+    worker_concurrency: int = 1
+    # worker processes started by supervisor.py, and how long a draining worker lets running jobs finish
+    worker_processes: int = 1
+    worker_drain_timeout_seconds: int = 600
+    scheduler_buffer_size: int = 10
+    scheduler_aging_rate: float = 1.0
+    scheduler_probe: bool = True
+    # prefetched info json of buffered jobs is reused for this long
+    prefetch_ttl_seconds: int = 1800
+    # downloads are admitted while free space minus reservations stays above the margin
+    disk_reserve_margin_bytes: int = 5 * 1024 ** 3
+    # directory where processes sharing the download volume publish their reservations, set by supervisor.py
+    disk_ledger_dir: str = ""
+    disk_default_job_bytes: int = 4 * 1024 ** 3
+
+    # node bandwidth budget in bytes/s shared by concurrent transfers, 0 for unlimited
+    bandwidth_ingress_bps: int = 0
+    bandwidth_egress_bps: int = 0
+    # uploads and downloads draw from the ingress budget, e.g. on a metered link
+    bandwidth_shared_link: bool = False
+    bandwidth_download_weight: float = 1.0
+    bandwidth_upload_weight: float = 1.0
+
+    # per-host yt-dlp fragment concurrency, learned and forgotten after the ttl
+    fragment_tuning_ttl_seconds: int = 24 * 3600
+    fragment_max_concurrency: int = 16
+    fragment_max_tor_concurrency: int = 4
+
+    # local log of download attempts used to order the quality ladder per host
+    attempt_store_path: str = "download_attempts.sqlite3"
+    attempt_retention_days: int = 30
+    # permanently failing source URLs are not retried until this expires or a retry is forced
+    unavailable_ttl_seconds: int = 7 * 24 * 3600
+
+    # opt-in event-loop lag monitor, logs the stack of callbacks that block longer than the threshold
+    loop_monitor_enabled: bool = False
+    loop_monitor_interval_seconds: float = 0.1
+    loop_monitor_threshold_seconds: float = 0.5
+
+    # cross-worker job leases
+    lease_ttl_seconds: int = 300
+    lease_heartbeat_seconds: int = 60
 
     model_config = SettingsConfigDict(env_file=".env", env_file_encoding="utf-8")
 
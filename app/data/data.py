@@ -1,18 +1,243 @@
-from .schema import Match
+from .write_batcher import MatchWriteBatcher
+from .match_cache import MatchCache
+from .schema import Match, MatchVideoInfo, MATCH_VIDEO_INFO_PROJECTION, VideoStatus, BACKLOG_VIDEO_STATUSES
 from bson import ObjectId
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
 from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING, DESCENDING
+import re
+
+INGESTED_VIDEO_PATTERN = "(media\\.naemoapp\\.com|s3\\.amazonaws\\.com)"
+_ingested_video_regex = re.compile(INGESTED_VIDEO_PATTERN)
+# queued or downloading for longer than any retry backoff plus a download lasts: the message was lost
+BACKLOG_STUCK_AFTER_SECONDS = 24 * 3600
+
+STATUS_TIMESTAMPS = {
+    VideoStatus.QUEUED: "queued_at",
+    VideoStatus.DOWNLOADING: "started_at",
+    VideoStatus.UPLOADED: "completed_at",
+    VideoStatus.FAILED: "failed_at",
+    VideoStatus.UNAVAILABLE: "failed_at",
+}
+
+
+def is_ingested_video_url(url: Optional[str]) -> bool:
+    return bool(url) and bool(_ingested_video_regex.search(url))
+
+
+def is_known_unavailable(video_ingest: Optional[dict], video_url: Optional[str]) -> bool:
+    """True while a permanent failure recorded for this exact source URL has not expired."""
+    video_ingest = video_ingest or {}
+    if video_ingest.get("status") != VideoStatus.UNAVAILABLE.value:
+        return False
+    # a new URL on the match deserves a fresh attempt
+    if video_ingest.get("unavailable_url") != video_url:
+        return False
+    until = video_ingest.get("unavailable_until")
+    return until is not None and until.replace(tzinfo=timezone.utc) > datetime.now(timezone.utc)
+
+
+def backlog_query(include_unavailable: bool = False, stuck_after: int = BACKLOG_STUCK_AFTER_SECONDS) -> dict:
+    statuses = BACKLOG_VIDEO_STATUSES + ([VideoStatus.UNAVAILABLE.value] if include_unavailable else [])
+    branches = [
+        {"video_ingest.status": {"$in": statuses}},
+        # matches written after the status migration by other services have no status yet and count as pending
+        {
+            "video_ingest.status": None,
+            "match_video": {"$nin": [None, ""], "$not": _ingested_video_regex}
+        },
+    ]
+    if stuck_after:
+        # a message that aged out, was dropped or never sent leaves its match queued or downloading for good
+        stuck_before = datetime.now(timezone.utc) - timedelta(seconds=stuck_after)
+        branches.append({
+            "video_ingest.status": VideoStatus.QUEUED.value,
+            "video_ingest.queued_at": {"$lt": stuck_before}
+        })
+        branches.append({
+            "video_ingest.status": VideoStatus.DOWNLOADING.value,
+            "video_ingest.started_at": {"$lt": stuck_before}
+        })
+    if not include_unavailable:
+        # permanent failures come back once their negative result expires
+        branches.append({
+            "video_ingest.status": VideoStatus.UNAVAILABLE.value,
+            "video_ingest.unavailable_until": {"$lte": datetime.now(timezone.utc)}
+        })
+    return {"$or": branches}
+
 
 class Data:
-    def __init__(self, database: AsyncIOMotorDatabase):
+    def __init__(self, database: AsyncIOMotorDatabase, backlog_stuck_after: int = BACKLOG_STUCK_AFTER_SECONDS):
         self.database = database
+        self.backlog_stuck_after = backlog_stuck_after
+        self.write_batcher = None
+        self.match_cache = None
+
+    def enable_match_cache(self, max_size: int = 2048, ttl: float = 30):
+        self.match_cache = MatchCache(max_size=max_size, ttl=ttl)
+        return self.match_cache
+
+    def _invalidate_match(self, matchId: str):
+        if self.match_cache:
+            self.match_cache.invalidate(("full", matchId))
+            self.match_cache.invalidate(("video", matchId))
+
+    def enable_write_batching(self, max_batch_size: int = 100, max_delay: float = 0.2):
+        self.write_batcher = MatchWriteBatcher(
+            self.database.get_collection('mergedmatches'),
+            max_batch_size=max_batch_size,
+            max_delay=max_delay
+        )
+        return self.write_batcher
+
+    async def close(self):
+        if self.write_batcher:
+            await self.write_batcher.close()
+
+    async def _update_match(self, matchId: str, update: dict):
+        query = {"_id": ObjectId(matchId)}
+        self._invalidate_match(matchId)
+        try:
+            if self.write_batcher:
+                return await self.write_batcher.update_one(query, update)
+            await self.database.get_collection('mergedmatches').update_one(query, update)
+            return True
+        finally:
+            self._invalidate_match(matchId)
+
+    async def ensure_indexes(self):
+        await self.database.get_collection('mergedmatches').create_index(
+            [("video_ingest.status", ASCENDING), ("_id", DESCENDING)],
+            name="video_ingest_status_id"
+        )
 
     async def get_match(self, matchId: str) -> Match:
+        if self.match_cache:
+            return await self.match_cache.get_or_load(("full", matchId), lambda: self._load_match(matchId))
+        return await self._load_match(matchId)
+
+    async def _load_match(self, matchId: str) -> Match:
         match = await self.database.get_collection('mergedmatches').find_one({"_id": ObjectId(matchId)})
         match = Match(**match)
         return match
 
-    async def update_match_video(self, matchId: str, videoUrl: str):
-        await self.database.get_collection('mergedmatches').update_one({"_id": ObjectId(matchId)}, {"$set": {"match_video": videoUrl}})
+    async def get_match_video_info(self, matchId: str, fresh: bool = False) -> Optional[MatchVideoInfo]:
+        if self.match_cache and fresh:
+            self._invalidate_match(matchId)
+        if self.match_cache:
+            return await self.match_cache.get_or_load(("video", matchId), lambda: self._load_match_video_info(matchId))
+        return await self._load_match_video_info(matchId)
+
+    async def _load_match_video_info(self, matchId: str) -> Optional[MatchVideoInfo]:
+        match = await self.database.get_collection('mergedmatches').find_one(
+            {"_id": ObjectId(matchId)},
+            MATCH_VIDEO_INFO_PROJECTION
+        )
+        if not match:
+            return None
+        return MatchVideoInfo(**match)
+
+    async def get_matches_by_ids(self, matchIds: List[str], batch_size: int = 1000) -> Dict[str, MatchVideoInfo]:
+        matches = {}
+        object_ids = [ObjectId(matchId) for matchId in matchIds]
+        for start in range(0, len(object_ids), batch_size):
+            cursor = self.database.get_collection('mergedmatches').find(
+                {"_id": {"$in": object_ids[start:start + batch_size]}},
+                MATCH_VIDEO_INFO_PROJECTION
+            )
+            async for match in cursor:
+                info = MatchVideoInfo(**match)
+                matches[info.id] = info
+        return matches
+
+    async def update_match_video(self, matchId: str, videoUrl: str, objectKey: str = None):
+        fields = {"match_video": videoUrl, **self._video_status_fields(VideoStatus.UPLOADED)}
+        fields["video_ingest.last_error"] = None
+        if objectKey:
+            fields["match_video_key"] = objectKey
+        return await self._update_match(matchId, {"$set": fields})
+
+    def _video_status_fields(self, status: VideoStatus):
+        now = datetime.now(timezone.utc)
+        fields = {
+            "video_ingest.status": status.value,
+            "video_ingest.updated_at": now,
+        }
+        if status in STATUS_TIMESTAMPS:
+            fields[f"video_ingest.{STATUS_TIMESTAMPS[status]}"] = now
+        return fields
+
+    async def set_video_status(self, matchId: str, status: VideoStatus, error: str = None):
+        update = {"$set": self._video_status_fields(status)}
+        if status == VideoStatus.FAILED or error is not None:
+            update["$set"]["video_ingest.last_error"] = error
+        if status == VideoStatus.DOWNLOADING:
+            update["$inc"] = {"video_ingest.attempts": 1}
+        return await self._update_match(matchId, update)
+
+    async def mark_video_unavailable(self, matchId: str, videoUrl: str, reason: str, ttl: int):
+        fields = self._video_status_fields(VideoStatus.UNAVAILABLE)
+        fields.update({
+            "video_ingest.last_error": f"unavailable: {reason}",
+            "video_ingest.unavailable_reason": reason,
+            "video_ingest.unavailable_url": videoUrl,
+            "video_ingest.unavailable_until": datetime.now(timezone.utc) + timedelta(seconds=ttl),
+        })
+        return await self._update_match(matchId, {"$set": fields})
+
+    async def set_video_status_many(self, matchIds: List[str], status: VideoStatus):
+        if not matchIds:
+            return 0
+        for matchId in matchIds:
+            self._invalidate_match(matchId)
+        result = await self.database.get_collection('mergedmatches').update_many(
+            {"_id": {"$in": [ObjectId(matchId) for matchId in matchIds]}},
+            {"$set": self._video_status_fields(status)}
+        )
+        for matchId in matchIds:
+            self._invalidate_match(matchId)
+        return result.modified_count
+
+    async def backfill_video_status(self):
+        collection = self.database.get_collection('mergedmatches')
+        unset = {"video_ingest.status": {"$exists": False}}
+        counts = {}
+        # order matters: each pass only touches documents the previous ones left without a status
+        passes = [
+            (VideoStatus.UPLOADED, {**unset, "match_video": {"$regex": INGESTED_VIDEO_PATTERN}}),
+            (VideoStatus.MISSING, {**unset, "match_video": {"$in": [None, ""]}}),
+            (VideoStatus.PENDING, unset),
+        ]
+        for status, query in passes:
+            result = await collection.update_many(query, {"$set": {
+                "video_ingest.status": status.value,
+                "video_ingest.attempts": 0,
+                "video_ingest.updated_at": datetime.now(timezone.utc),
+            }})
+            counts[status.value] = result.modified_count
+        if self.match_cache:
+            self.match_cache.clear()
+        return counts
+
+    async def iter_ingested_matches(self, batch_size: int = 500):
+        cursor = self.database.get_collection("mergedmatches").find(
+            {"match_video": {"$regex": INGESTED_VIDEO_PATTERN}},
+            {"_id": 1, "match_video": 1, "match_video_key": 1}
+        ).batch_size(batch_size)
+        async for match in cursor:
+            yield match
+
+    async def get_video_by_checksum(self, checksum: str):
+        return await self.database.get_collection('videochecksums').find_one({"_id": checksum})
+
+    async def save_video_checksum(self, checksum: str, objectKey: str, size: int):
+        await self.database.get_collection('videochecksums').update_one(
+            {"_id": checksum},
+            {"$set": {"object_key": objectKey, "size": size}},
+            upsert=True
+        )
         return True
 
     async def get_matches(self):
@@ -43,13 +268,7 @@ class Data:
         cursor = (
             self.database.get_collection("mergedmatches")
             .find(
-                {
-                    "match_video": {
-                        "$not": {
-                            "$regex": "(media\\.naemoapp\\.com|s3\\.amazonaws\\.com)"
-                        }
-                    }
-                },
+                backlog_query(stuck_after=self.backlog_stuck_after),
                 {
                     "_id": 1,
                     "match_video": 1
@@ -73,14 +292,31 @@ class Data:
         return results
 
 
-    async def matches_count(self):
-        count = await self.database.get_collection("mergedmatches").count_documents({
-            "match_video": {
-                "$not": {
-                    "$regex": "(media\\.naemoapp\\.com|s3\\.amazonaws\\.com)"
-                }
-            }
-        })
+    async def iter_backlog_pages(self, after_id: str = None, page_size: int = 500, include_unavailable: bool = False):
+        query = backlog_query(include_unavailable, self.backlog_stuck_after)
+        while True:
+            if after_id:
+                query["_id"] = {"$lt": ObjectId(after_id)}
+            cursor = (
+                self.database.get_collection("mergedmatches")
+                .find(query, {"_id": 1, "match_video": 1})
+                .sort("_id", -1)
+                .limit(page_size)
+            )
+            page = await cursor.to_list(length=page_size)
+            if not page:
+                return
+            yield [
+                {"_id": str(match["_id"]), "match_video": match.get("match_video", "")}
+                for match in page
+            ]
+            after_id = str(page[-1]["_id"])
+
+    async def matches_count(self, include_unavailable: bool = False, before_id: str = None):
+        query = backlog_query(include_unavailable, self.backlog_stuck_after)
+        if before_id:
+            query["_id"] = {"$lt": ObjectId(before_id)}
+        count = await self.database.get_collection("mergedmatches").count_documents(query)
         return count
 
 
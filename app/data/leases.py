@@ -0,0 +1,115 @@
+import asyncio
+import logging
+import os
+import socket
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+from app.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class Lease:
+    def __init__(self, key: str, owner: str, generation: int, token: str):
+        self.key = key
+        self.owner = owner
+        self.generation = generation
+        # unique per acquisition: two holders in one process are still different holders
+        self.token = token
+        # set when a heartbeat finds the lease taken over; the holder must not commit results after that
+        self.lost = False
+
+
+class LeaseManager:
+    def __init__(self, database: AsyncIOMotorDatabase, owner: str = None, ttl: int = 300, heartbeat_interval: int = 60):
+        self.collection = database.get_collection("job_leases")
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat_interval
+        self.acquired = metrics.counter("leases.acquired")
+        self.takeovers = metrics.counter("leases.takeovers")
+        self.contended = metrics.counter("leases.contended")
+        self.lost = metrics.counter("leases.lost")
+
+    async def ensure_indexes(self):
+        # expired leases are only garbage; acquisition already treats them as free
+        await self.collection.create_index("expires_at", expireAfterSeconds=24 * 3600)
+
+    async def acquire(self, key: str) -> Optional[Lease]:
+        now = datetime.now(timezone.utc)
+        token = uuid.uuid4().hex
+        try:
+            # a live lease is refused whoever holds it, this process included
+            previous = await self.collection.find_one_and_update(
+                {"_id": key, "expires_at": {"$lt": now}},
+                {
+                    "$set": {
+                        "owner": self.owner,
+                        "token": token,
+                        "acquired_at": now,
+                        "heartbeat_at": now,
+                        "expires_at": now + timedelta(seconds=self.ttl),
+                    },
+                    "$inc": {"generation": 1},
+                },
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        except DuplicateKeyError:
+            # the upsert raced a live lease
+            self.contended.inc()
+            return None
+
+        if previous:
+            self.takeovers.inc()
+            logger.info(f"Took over expired lease {key} from {previous.get('owner')}")
+        self.acquired.inc()
+        generation = (previous or {}).get("generation", 0) + 1
+        return Lease(key, self.owner, generation, token)
+
+    async def renew(self, lease: Lease) -> bool:
+        now = datetime.now(timezone.utc)
+        result = await self.collection.update_one(
+            {"_id": lease.key, "token": lease.token},
+            {"$set": {"heartbeat_at": now, "expires_at": now + timedelta(seconds=self.ttl)}}
+        )
+        if result.matched_count == 0:
+            lease.lost = True
+            self.lost.inc()
+            logger.warning(f"Lease {lease.key} was taken over by another worker")
+            return False
+        return True
+
+    async def release(self, lease: Lease):
+        await self.collection.delete_one({"_id": lease.key, "token": lease.token})
+
+    async def _heartbeat(self, lease: Lease):
+        while not lease.lost:
+            await asyncio.sleep(self.heartbeat_interval)
+            try:
+                await self.renew(lease)
+            except Exception as e:
+                logger.warning(f"Lease heartbeat for {lease.key} failed: {e}")
+
+    @asynccontextmanager
+    async def hold(self, key: str):
+        lease = await self.acquire(key)
+        if lease is None:
+            yield None
+            return
+
+        heartbeat = asyncio.create_task(self._heartbeat(lease))
+        try:
+            yield lease
+        finally:
+            heartbeat.cancel()
+            try:
+                await self.release(lease)
+            except Exception as e:
+                logger.warning(f"Could not release lease {lease.key}: {e}")
@@ -0,0 +1,80 @@
+import asyncio
+import time
+from collections import OrderedDict
+from app.metrics import metrics
+
+
+class MatchCache:
+    def __init__(self, max_size: int = 2048, ttl: float = 30, name: str = "match_cache"):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        # loads that raced a write; their result must not repopulate the cache
+        self._stale_loads = set()
+        self.hits = metrics.counter(f"{name}.hits")
+        self.misses = metrics.counter(f"{name}.misses")
+        self.coalesced = metrics.counter(f"{name}.coalesced")
+        self.evictions = metrics.counter(f"{name}.evictions")
+
+    async def get_or_load(self, key, loader):
+        entry = self._entries.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._entries.move_to_end(key)
+                self.hits.inc()
+                return value
+            del self._entries[key]
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced.inc()
+            return await asyncio.shield(inflight)
+
+        self.misses.inc()
+        future = asyncio.get_running_loop().create_future()
+        # followers may all have gone away; retrieve the exception so it is not reported as unhandled
+        future.add_done_callback(lambda f: f.cancelled() or f.exception())
+        self._inflight[key] = future
+        try:
+            value = await loader()
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(key, None)
+            stale = key in self._stale_loads
+            self._stale_loads.discard(key)
+
+        if value is not None and not stale:
+            self._store(key, value)
+        future.set_result(value)
+        return value
+
+    def _store(self, key, value):
+        self._entries[key] = (time.monotonic() + self.ttl, value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+            self.evictions.inc()
+
+    def invalidate(self, key):
+        self._entries.pop(key, None)
+        if key in self._inflight:
+            self._stale_loads.add(key)
+
+    def clear(self):
+        for key in list(self._entries) + list(self._inflight):
+            self.invalidate(key)
+
+    def stats(self):
+        lookups = self.hits.value + self.misses.value + self.coalesced.value
+        return {
+            "size": len(self._entries),
+            "hits": self.hits.value,
+            "misses": self.misses.value,
+            "coalesced": self.coalesced.value,
+            "evictions": self.evictions.value,
+            "hit_ratio": self.hits.value / lookups if lookups else 0.0,
+        }
@@ -1,4 +1,5 @@
 from datetime import datetime
+from enum import Enum
 from typing import Optional, List, Dict, Any, Annotated
 from pydantic import BaseModel, Field, BeforeValidator
 from bson import ObjectId
@@ -22,6 +23,15 @@ class MatchBase(BaseModel):
         "json_encoders": {ObjectId: str},
     }
 
+def validate_id_string(v: Any) -> str:
+    if isinstance(v, ObjectId):
+        return str(v)
+    if isinstance(v, str) and ObjectId.is_valid(v):
+        return v
+    raise ValueError("Invalid ObjectId")
+
+IdString = Annotated[str, BeforeValidator(validate_id_string)]
+
 class Match(MatchBase):
     id: PyObjectId = Field(default_factory=ObjectId, alias="_id")
     old_away_match_id: Optional[PyObjectId] = Field(None, alias="oldAwayMatchId")
@@ -146,3 +156,44 @@ class Match(MatchBase):
             }
         }
     }
+
+class VideoStatus(str, Enum):
+    PENDING = "pending"
+    QUEUED = "queued"
+    DOWNLOADING = "downloading"
+    UPLOADED = "uploaded"
+    FAILED = "failed"
+    MISSING = "missing"
+    # the source URL failed permanently (private, removed, geo-blocked...), retried once video_ingest.unavailable_until passes
+    UNAVAILABLE = "unavailable"
+
+BACKLOG_VIDEO_STATUSES = [VideoStatus.PENDING.value, VideoStatus.FAILED.value]
+
+# slim read model holding only what the download pipeline needs
+class MatchVideoInfo(BaseModel):
+    id: IdString = Field(..., alias="_id")
+    date: Optional[str] = None
+    home_team_string: Optional[str] = Field(None, alias="homeTeamString")
+    away_team_string: Optional[str] = Field(None, alias="awayTeamString")
+    match_video: Optional[str] = Field(None, alias="matchVideo")
+    match_video_key: Optional[str] = Field(None, alias="matchVideoKey")
+    video_ingest: Optional[Dict[str, Any]] = None
+
+    model_config = {
+        "validate_by_name": True,
+    }
+
+# stored documents mix camelCase and snake_case keys, so the projection asks for both spellings
+MATCH_VIDEO_INFO_PROJECTION = {
+    "_id": 1,
+    "date": 1,
+    "homeTeamString": 1,
+    "home_team_string": 1,
+    "awayTeamString": 1,
+    "away_team_string": 1,
+    "matchVideo": 1,
+    "match_video": 1,
+    "matchVideoKey": 1,
+    "match_video_key": 1,
+    "video_ingest": 1,
+}
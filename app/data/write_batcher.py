@@ -0,0 +1,89 @@
+import asyncio
+import logging
+import time
+from pymongo import UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError
+from motor.motor_asyncio import AsyncIOMotorCollection
+from app.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BATCH_SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+
+
+class MatchWriteBatcher:
+    def __init__(self, collection: AsyncIOMotorCollection, max_batch_size: int = 100, max_delay: float = 0.2):
+        # callers wait for the flush, so majority+journal is what makes it safe to delete the SQS message after
+        self.collection = collection.with_options(write_concern=WriteConcern(w="majority", j=True))
+        self.max_batch_size = max_batch_size
+        self.max_delay = max_delay
+        self._pending = []
+        self._timer = None
+        self._flushes = set()
+        self.flush_latency = metrics.histogram("match_writes.flush_seconds")
+        self.batch_size = metrics.histogram("match_writes.batch_size", BATCH_SIZE_BUCKETS)
+
+    async def submit(self, operation: UpdateOne):
+        future = asyncio.get_running_loop().create_future()
+        self._pending.append((operation, future))
+
+        if len(self._pending) >= self.max_batch_size:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = asyncio.create_task(self._flush_after_delay())
+
+        return await future
+
+    async def update_one(self, query: dict, update: dict):
+        return await self.submit(UpdateOne(query, update))
+
+    async def _flush_after_delay(self):
+        await asyncio.sleep(self.max_delay)
+        self._timer = None
+        self._start_flush()
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        task = asyncio.create_task(self._flush(batch))
+        self._flushes.add(task)
+        task.add_done_callback(self._flushes.discard)
+
+    async def _flush(self, batch):
+        started = time.monotonic()
+        # unordered lets the server apply independent match updates in one pass;
+        # a pipeline only has one write per match outstanding at a time
+        try:
+            await self.collection.bulk_write([operation for operation, _ in batch], ordered=False)
+            failed = {}
+        except BulkWriteError as e:
+            failed = {error["index"]: error for error in e.details.get("writeErrors", [])}
+            if e.details.get("writeConcernErrors"):
+                failed = {index: e.details for index in range(len(batch))}
+        except Exception as e:
+            logger.error(f"Batched match write of {len(batch)} operations failed: {e}", exc_info=True)
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        finally:
+            self.flush_latency.observe(time.monotonic() - started)
+            self.batch_size.observe(len(batch))
+
+        for index, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if index in failed:
+                future.set_exception(RuntimeError(f"Match write failed: {failed[index]}"))
+            else:
+                future.set_result(True)
+
+    async def close(self):
+        self._start_flush()
+        if self._flushes:
+            await asyncio.gather(*self._flushes, return_exceptions=True)
@@ -4,8 +4,10 @@ from motor.motor_asyncio import AsyncIOMotorDatabase
 from app.data.data import Data
 from app.downloader import YoutubeDownloader
 from app.queue.sqs_client import SqsClient
+from app.queue.enqueuer import Enqueuer
 from app.s3_client import S3client
 from app.service.matchdownloader import MatchDownloader
+from app.service.jobs import JobManager
 
 def get_db(request: Request) -> AsyncIOMotorDatabase:
     return request.app.state.mongodb
@@ -23,4 +25,10 @@ async def get_sqs_client(request: Request) -> SqsClient:
     return request.app.state.sqs_client
 
 async def get_match_downloader(request: Request) -> MatchDownloader:
-    return request.app.state.match_downloader
\ No newline at end of file
+    return request.app.state.match_downloader
+
+async def get_job_manager(request: Request) -> JobManager:
+    return request.app.state.job_manager
+
+async def get_enqueuer(request: Request) -> Enqueuer:
+    return request.app.state.enqueuer
@@ -1,10 +1,20 @@
+import asyncio
+import hashlib
+import json
 import subprocess
+import time
+import uuid
+from contextlib import ExitStack
 from pathlib import Path
-from typing import Optional
+from typing import Callable, Optional
 import os
 import logging
 import re
 import requests
+from urllib.parse import urlparse, parse_qs, urlencode
+from app.attempt_store import AttemptStore, order_strategies
+from app.bandwidth import BandwidthGovernor, TransferClass
+from app.fragment_tuning import FragmentTuner
 
 logging.basicConfig(
     level=logging.INFO,
@@ -13,6 +23,68 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
+TRACKING_PARAMS = {"si", "feature", "fbclid", "igshid", "t"}
+
+TOR_RATE_LIMIT = 8 * 1024 * 1024
+
+PROGRESS_PATTERN = re.compile(r"\[download\]\s+(\d+(?:\.\d+)?)%")
+
+# yt-dlp errors that no retry or other quality will fix, checked in order
+UNAVAILABLE_PATTERNS = [
+    ("private", re.compile(r"private video|video is private", re.IGNORECASE)),
+    ("members_only", re.compile(r"members.only|join this channel", re.IGNORECASE)),
+    ("age_restricted", re.compile(r"confirm your age|age.restricted|inappropriate for some users", re.IGNORECASE)),
+    ("geo_blocked", re.compile(r"not available in your country|geo.?restrict|blocked it in your country", re.IGNORECASE)),
+    ("removed", re.compile(
+        r"has been removed|account .*terminated|video unavailable|no longer available|does not exist"
+        r"|Unable to download webpage: HTTP Error (?:404|410)",
+        re.IGNORECASE
+    )),
+]
+
+# decided by where the request comes from, which under tor is whatever exit node the circuit picked
+EXIT_DEPENDENT_REASONS = {"geo_blocked"}
+
+# anything that looks like throttling or a network problem stays retryable, even next to a permanent-looking line
+TRANSIENT_PATTERN = re.compile(
+    r"try again later|not a bot|timed out|connection (?:reset|refused|aborted)|temporary failure"
+    r"|HTTP Error (?:429|5\d\d)",
+    re.IGNORECASE
+)
+
+
+class PermanentDownloadError(Exception):
+    """The source refuses this URL for good, so retrying it only burns worker time."""
+
+    def __init__(self, reason: str, detail: str = None):
+        super().__init__(f"Video unavailable ({reason}): {detail}" if detail else f"Video unavailable ({reason})")
+        self.reason = reason
+        self.detail = detail
+
+
+def classify_failure(output: str, via_tor: bool = False):
+    """Returns (reason, error line) when yt-dlp output shows a permanent failure, otherwise None.
+
+    Through tor, failures that depend on the exit node are not permanent: another circuit may pass.
+    """
+    errors = [
+        line.strip() for line in output.splitlines()
+        if line.strip().startswith("ERROR:")
+    ]
+    if not errors or any(TRANSIENT_PATTERN.search(line) for line in errors):
+        return None
+    for reason, pattern in UNAVAILABLE_PATTERNS:
+        if via_tor and reason in EXIT_DEPENDENT_REASONS:
+            continue
+        for line in errors:
+            if pattern.search(line):
+                return reason, line
+    return None
+
+
+# progress(stage, percent) - percent is None for stages without measurable progress
+ProgressCallback = Callable[[str, Optional[float]], None]
+
 
 class YoutubeDownloader:
 
@@ -21,6 +93,11 @@ class YoutubeDownloader:
         preferred_quality: str = "1080",
         cookies_path: Optional[str] = "/home/ubuntu/cookies.txt",
         facebook_cookies_path: Optional[str] = "/home/ubuntu/facebookcookies.txt",
+        prefetch_dir: Optional[str] = None,
+        prefetch_ttl: int = 1800,
+        governor: Optional[BandwidthGovernor] = None,
+        tuner: Optional[FragmentTuner] = None,
+        attempt_store: Optional[AttemptStore] = None,
     ):
         self.preferred_quality = preferred_quality
         self.fallback_quality = "720"
@@ -28,6 +105,15 @@ class YoutubeDownloader:
         self.cookies_path = cookies_path
         self.facebook_cookies_path = facebook_cookies_path
 
+        # resolved streams and probed info json of upcoming jobs, (kind, url) -> (expires_at, value)
+        self.prefetch_dir = prefetch_dir
+        self.prefetch_ttl = prefetch_ttl
+        self._prefetched = {}
+
+        self.governor = governor
+        self.tuner = tuner
+        self.attempt_store = attempt_store
+
     # --------------------------------------------------------
     # Platform detection
     # --------------------------------------------------------
@@ -44,6 +130,84 @@ class YoutubeDownloader:
     def _is_pixellot(self, url: str) -> bool:
         return "pixellot" in url
 
+    def platform(self, url: str) -> str:
+
+        if self._is_youtube(url):
+            return "youtube"
+
+        if self._is_veo(url):
+            return "veo"
+
+        if self._is_pixellot(url):
+            return "pixellot"
+
+        if self._is_facebook(url):
+            return "facebook"
+
+        return "other"
+
+    # --------------------------------------------------------
+    # Source identity
+    # --------------------------------------------------------
+
+    def normalize_url(
+        self,
+        url: str
+    ) -> str:
+
+        parsed = urlparse(url.strip())
+
+        host = parsed.netloc.lower()
+
+        if host.startswith("www."):
+            host = host[4:]
+
+        if host.startswith("m."):
+            host = host[2:]
+
+        query = parse_qs(parsed.query)
+
+        # youtube ids are the identity whatever the url shape
+        if self._is_youtube(host):
+
+            video_id = None
+
+            if host == "youtu.be":
+                video_id = parsed.path.strip("/")
+
+            elif "v" in query:
+                video_id = query["v"][0]
+
+            else:
+
+                parts = parsed.path.strip("/").split("/")
+
+                if (
+                    len(parts) == 2
+                    and parts[0] in ["live", "shorts", "embed"]
+                ):
+                    video_id = parts[1]
+
+            if video_id:
+                return f"youtube:{video_id}"
+
+        kept = sorted(
+            (key, value)
+            for key, values in query.items()
+            for value in values
+            if key not in TRACKING_PARAMS
+            and not key.startswith("utm_")
+        )
+
+        path = parsed.path.rstrip("/") or "/"
+
+        normalized = f"{host}{path}"
+
+        if kept:
+            normalized += f"?{urlencode(kept)}"
+
+        return normalized
+
     # --------------------------------------------------------
     # Pixellot extraction
     # --------------------------------------------------------
@@ -229,13 +393,16 @@ class YoutubeDownloader:
 
         try:
 
+            target = Path(filename)
+
             patterns = [
-                f"{filename}*"
+                f"{target.name}*"
             ]
 
             for pattern in patterns:
 
-                for file in Path(".").glob(pattern):
+                # glob from the parent, absolute patterns are not supported
+                for file in target.parent.glob(pattern):
 
                     if (
                         file.suffix in [
@@ -265,7 +432,10 @@ class YoutubeDownloader:
     def _build_base_command(
         self,
         use_tor=False,
-        is_facebook=False
+        is_facebook=False,
+        rate_limit: float = 0,
+        fragments: Optional[int] = None,
+        tor_circuit: Optional[str] = None
     ):
 
         cmd = [
@@ -337,13 +507,18 @@ class YoutubeDownloader:
             cmd.extend([
 
                 "--proxy",
-                "socks5://127.0.0.1:9050",
+                # tor isolates streams by socks credentials, so new credentials get a new circuit and exit
+                f"socks5://{tor_circuit}:x@127.0.0.1:9050"
+                if tor_circuit
+                else "socks5://127.0.0.1:9050",
 
                 "--concurrent-fragments",
-                "1",
+                str(fragments or 1),
 
                 "--limit-rate",
-                "8M",
+                str(int(min(rate_limit, TOR_RATE_LIMIT)))
+                if rate_limit
+                else str(TOR_RATE_LIMIT),
 
                 "--force-ipv4",
             ])
@@ -352,11 +527,361 @@ class YoutubeDownloader:
 
             cmd.extend([
                 "--concurrent-fragments",
-                "5"
+                str(fragments or 5)
             ])
 
+            if rate_limit:
+
+                cmd.extend([
+                    "--limit-rate",
+                    str(int(rate_limit))
+                ])
+
         return cmd
 
+    # --------------------------------------------------------
+    # Run yt-dlp with streamed output
+    # --------------------------------------------------------
+
+    async def _run_command(
+        self,
+        cmd,
+        timeout: int,
+        progress: Optional[ProgressCallback] = None
+    ):
+
+        process = await asyncio.create_subprocess_exec(
+            *cmd,
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE
+        )
+
+        stdout_lines = []
+
+        async def read_stdout():
+
+            async for raw_line in process.stdout:
+
+                line = raw_line.decode(
+                    errors="replace"
+                )
+
+                stdout_lines.append(line)
+
+                if progress:
+
+                    match = PROGRESS_PATTERN.search(line)
+
+                    if match:
+                        progress(
+                            "download",
+                            float(match.group(1))
+                        )
+
+        try:
+
+            _, stderr, _ = await asyncio.wait_for(
+                asyncio.gather(
+                    read_stdout(),
+                    process.stderr.read(),
+                    process.wait()
+                ),
+                timeout=timeout
+            )
+
+        except (
+            asyncio.TimeoutError,
+            asyncio.CancelledError
+        ):
+
+            # a cancelled job (worker drain) must not leave yt-dlp running
+            process.kill()
+            await process.wait()
+            raise
+
+        return (
+            "".join(stdout_lines),
+            stderr.decode(errors="replace"),
+            process.returncode
+        )
+
+    # --------------------------------------------------------
+    # Prefetch (stream resolution / info json) for upcoming jobs
+    # --------------------------------------------------------
+
+    def _remember(
+        self,
+        key: tuple,
+        value: str
+    ):
+
+        now = time.monotonic()
+
+        # entries of jobs that never ran are swept here
+        for stale in [
+            k for k, (expires_at, _) in self._prefetched.items()
+            if expires_at < now or k == key
+        ]:
+            self._forget(stale)
+
+        self._prefetched[key] = (
+            now + self.prefetch_ttl,
+            value
+        )
+
+    def _recall(
+        self,
+        key: tuple
+    ) -> Optional[str]:
+
+        entry = self._prefetched.get(key)
+
+        if not entry:
+            return None
+
+        if entry[0] < time.monotonic():
+
+            self._forget(key)
+
+            return None
+
+        return entry[1]
+
+    def _forget(
+        self,
+        key: tuple
+    ):
+
+        entry = self._prefetched.pop(key, None)
+
+        if entry and key[0] == "info":
+            Path(entry[1]).unlink(missing_ok=True)
+
+    async def resolve(
+        self,
+        url: str
+    ) -> Optional[str]:
+
+        if not self._is_pixellot(url):
+            return url
+
+        stream_url = self._recall(("stream", url))
+
+        if not stream_url:
+
+            # page scraping uses blocking requests
+            stream_url = await asyncio.to_thread(
+                self._extract_pixellot_m3u8,
+                url
+            )
+
+            if stream_url:
+                self._remember(("stream", url), stream_url)
+
+        return stream_url
+
+    async def prefetch(
+        self,
+        url: str,
+        probe: bool = True
+    ) -> Optional[dict]:
+
+        if not await self.resolve(url):
+            return None
+
+        if not probe:
+            return None
+
+        return await self.probe(url)
+
+    # --------------------------------------------------------
+    # Metadata probe (duration / size) without downloading
+    # --------------------------------------------------------
+
+    async def probe(
+        self,
+        url: str,
+        timeout: int = 60
+    ) -> Optional[dict]:
+
+        target = await self.resolve(url)
+
+        if not target:
+            return None
+
+        cmd = self._build_base_command(
+            use_tor=self._is_youtube(url),
+            is_facebook=self._is_facebook(url)
+        )
+
+        cmd.extend([
+
+            "--dump-single-json",
+            "--skip-download",
+
+            "-f",
+            f"bestvideo[height<={self.preferred_quality}]"
+            f"+bestaudio/best",
+
+            target
+        ])
+
+        try:
+
+            stdout, _, returncode = await self._run_command(
+                cmd,
+                timeout=timeout
+            )
+
+            if returncode != 0:
+                return None
+
+            info = json.loads(stdout)
+
+        except Exception as e:
+
+            logger.info(
+                f"Probe failed for {url}: {e}"
+            )
+
+            return None
+
+        # youtube format urls are bound to the Tor exit that extracted them, only reuse other platforms
+        if self.prefetch_dir and not self._is_youtube(url):
+
+            info_path = os.path.join(
+                self.prefetch_dir,
+                f"{hashlib.sha1(url.encode()).hexdigest()}.info.json"
+            )
+
+            try:
+
+                os.makedirs(self.prefetch_dir, exist_ok=True)
+
+                await asyncio.to_thread(
+                    Path(info_path).write_text,
+                    stdout
+                )
+
+                self._remember(("info", url), info_path)
+
+            except OSError as e:
+
+                logger.info(
+                    f"Could not keep info json for {url}: {e}"
+                )
+
+        formats = info.get("requested_formats") or [info]
+
+        filesize = sum(
+            f.get("filesize")
+            or f.get("filesize_approx")
+            or 0
+            for f in formats
+        )
+
+        return {
+            "duration": info.get("duration"),
+            "filesize": filesize or None,
+        }
+
+    # --------------------------------------------------------
+    # Strategy ladder learned from past attempts
+    # --------------------------------------------------------
+
+    def _strategy_name(
+        self,
+        quality: Optional[str]
+    ) -> str:
+
+        return f"{quality}p" if quality else "best"
+
+    async def _order_qualities(
+        self,
+        url: str,
+        qualities: list
+    ) -> list:
+
+        host = urlparse(url).netloc.lower()
+
+        by_name = {
+            self._strategy_name(quality): quality
+            for quality in qualities
+        }
+
+        try:
+
+            stats = await asyncio.to_thread(
+                self.attempt_store.stats,
+                host
+            )
+
+        except Exception as e:
+
+            logger.warning(
+                f"[STRATEGY] Could not read attempt history: {e}"
+            )
+
+            return qualities
+
+        ordered, trace = order_strategies(
+            list(by_name),
+            stats
+        )
+
+        for line in trace:
+
+            logger.info(
+                f"[STRATEGY] {host} {line}"
+            )
+
+        return [
+            by_name[name]
+            for name in ordered
+        ]
+
+    async def _record_attempt(
+        self,
+        platform: str,
+        url: str,
+        quality: Optional[str],
+        format_spec: str,
+        use_tor: bool,
+        prefetched: bool,
+        success: bool,
+        seconds: float,
+        nbytes: int = 0
+    ):
+
+        if not self.attempt_store:
+            return
+
+        # prefetched attempts can fail on stale urls, keep them out of the ladder's statistics
+        strategy = self._strategy_name(quality)
+
+        if prefetched:
+            strategy += "+prefetched"
+
+        try:
+
+            await asyncio.to_thread(
+                self.attempt_store.record,
+                platform,
+                urlparse(url).netloc.lower(),
+                strategy,
+                format_spec,
+                use_tor,
+                success,
+                seconds,
+                nbytes
+            )
+
+        except Exception as e:
+
+            logger.warning(
+                f"[STRATEGY] Could not record attempt: {e}"
+            )
+
     # --------------------------------------------------------
     # Main download
     # --------------------------------------------------------
@@ -364,19 +889,25 @@ class YoutubeDownloader:
     async def download(
         self,
         url: str,
-        filename: str
+        filename: str,
+        progress: Optional[ProgressCallback] = None
     ):
 
+        # url is swapped for the resolved stream on pixellot; prefetched entries stay keyed by the original
+        source_url = url
+
+        allocations = ExitStack()
+
         try:
 
+            if progress:
+                progress("resolve", None)
+
             is_youtube = self._is_youtube(url)
             is_veo = self._is_veo(url)
             is_facebook = self._is_facebook(url)
             is_pixellot = self._is_pixellot(url)
 
-            # cleanup old partial files
-            self._cleanup_partial_files(filename)
-
             # --------------------------------------------------------
             # Logging
             # --------------------------------------------------------
@@ -418,7 +949,7 @@ class YoutubeDownloader:
             if is_pixellot:
 
                 stream_url = (
-                    self._extract_pixellot_m3u8(url)
+                    await self.resolve(url)
                 )
 
                 if not stream_url:
@@ -451,12 +982,36 @@ class YoutubeDownloader:
                     None
                 ]
 
+            if self.attempt_store:
+
+                qualities_to_try = await self._order_qualities(
+                    url,
+                    qualities_to_try
+                )
+
+            attempts = [
+                (quality, None)
+                for quality in qualities_to_try
+            ]
+
+            # a prefetched info json skips extraction; plain attempts follow in case its urls went stale
+            info_path = self._recall(("info", source_url))
+
+            if info_path:
+
+                attempts.insert(
+                    0,
+                    (qualities_to_try[0], info_path)
+                )
+
             # --------------------------------------------------------
             # Download loop
             # --------------------------------------------------------
 
-            for idx, quality in enumerate(
-                qualities_to_try
+            tor_circuit = None
+
+            for idx, (quality, info_path) in enumerate(
+                attempts
             ):
 
                 use_tor = True if is_youtube else False
@@ -468,9 +1023,42 @@ class YoutubeDownloader:
                 ):
                     use_tor = True
 
+                # learned per host, tor circuits are tuned apart from direct connections
+                tuning_key = (
+                    f"{'tor:' if use_tor else ''}"
+                    f"{urlparse(url).netloc.lower()}"
+                )
+
+                # yt-dlp cannot change its rate once running, so each attempt commits the share of the moment
+                # and later transfers share the rest; tor caps its own rate, committing more would waste it
+                allocations.close()
+                allocation = (
+                    allocations.enter_context(
+                        self.governor.allocate(
+                            TransferClass.DOWNLOAD,
+                            fixed=True,
+                            max_rate=TOR_RATE_LIMIT if use_tor else 0
+                        )
+                    )
+                    if self.governor
+                    else None
+                )
+
+                fragments = (
+                    self.tuner.concurrency(
+                        tuning_key,
+                        1 if use_tor else 5
+                    )
+                    if self.tuner
+                    else None
+                )
+
                 cmd = self._build_base_command(
                     use_tor=use_tor,
-                    is_facebook=is_facebook
+                    is_facebook=is_facebook,
+                    rate_limit=allocation.rate if allocation else 0,
+                    fragments=fragments,
+                    tor_circuit=tor_circuit
                 )
 
                 # --------------------------------------------------------
@@ -537,36 +1125,55 @@ class YoutubeDownloader:
 
                     "-o",
                     output_pattern,
-
-                    url
                 ])
 
+                if info_path:
+
+                    cmd.extend([
+                        "--load-info-json",
+                        info_path
+                    ])
+
+                else:
+
+                    cmd.append(url)
+
                 logger.info(
                     f"RUNNING CMD (attempt {idx + 1}):\n"
                     f"{' '.join(cmd)}"
                 )
 
-                result = subprocess.run(
+                attempt_started = time.monotonic()
+
+                stdout, stderr, _ = await self._run_command(
                     cmd,
-                    capture_output=True,
-                    text=True,
-                    timeout=7200 if use_tor else 1800
+                    timeout=7200 if use_tor else 1800,
+                    progress=progress
                 )
 
-                logger.info(result.stdout)
+                logger.info(stdout)
 
-                if result.stderr:
-                    logger.warning(result.stderr)
+                if stderr:
+                    logger.warning(stderr)
 
                 # --------------------------------------------------------
                 # Detect outputs
                 # --------------------------------------------------------
 
                 output_text = (
-                    result.stdout +
-                    result.stderr
+                    stdout +
+                    stderr
                 )
 
+                if self.tuner:
+
+                    await self.tuner.observe(
+                        tuning_key,
+                        fragments,
+                        output_text,
+                        tor=use_tor
+                    )
+
                 actual_output = (
                     self._find_output_file(
                         filename,
@@ -597,6 +1204,9 @@ class YoutubeDownloader:
                 )
 
                 # validate files
+                if progress:
+                    progress("validation", None)
+
                 for file_path in possible_files:
 
                     if self._is_valid_video_file(
@@ -607,10 +1217,67 @@ class YoutubeDownloader:
                             f"Download success: {file_path}"
                         )
 
+                        await self._record_attempt(
+                            self.platform(source_url),
+                            url,
+                            quality,
+                            format_spec,
+                            use_tor,
+                            bool(info_path),
+                            True,
+                            time.monotonic() - attempt_started,
+                            os.path.getsize(file_path)
+                        )
+
                         return str(
                             Path(file_path).absolute()
                         )
 
+                await self._record_attempt(
+                    self.platform(source_url),
+                    url,
+                    quality,
+                    format_spec,
+                    use_tor,
+                    bool(info_path),
+                    False,
+                    time.monotonic() - attempt_started
+                )
+
+                # stale prefetched info can fail with errors the live page would not give
+                failure = (
+                    classify_failure(output_text, via_tor=use_tor)
+                    if not info_path
+                    else None
+                )
+
+                if use_tor and not failure:
+
+                    blocked = classify_failure(output_text)
+
+                    if blocked and blocked[0] in EXIT_DEPENDENT_REASONS:
+
+                        tor_circuit = uuid.uuid4().hex
+
+                        logger.warning(
+                            f"Download of {source_url} was refused at the tor exit "
+                            f"({blocked[0]}), retrying on a fresh circuit"
+                        )
+
+                if failure:
+
+                    reason, detail = failure
+
+                    logger.warning(
+                        f"Download of {source_url} failed permanently "
+                        f"({reason}), not trying other qualities: {detail}"
+                    )
+
+                    raise PermanentDownloadError(
+                        reason,
+                        detail
+                    )
+
                 logger.warning(
                     f"Download failed for quality "
                     f"{quality}, trying next..."
@@ -620,8 +1287,16 @@ class YoutubeDownloader:
                 "All download attempts failed"
             )
 
+            # partials of an interrupted run (worker drain) are kept
+            # for --continue, those of a failed one are not worth resuming
+            self._cleanup_partial_files(filename)
+
             return None
 
+        except PermanentDownloadError:
+
+            raise
+
         except Exception as e:
 
             logger.exception(
@@ -630,6 +1305,13 @@ class YoutubeDownloader:
 
             return None
 
+        finally:
+
+            allocations.close()
+
+            self._forget(("info", source_url))
+            self._forget(("stream", source_url))
+
     # --------------------------------------------------------
     # Detect output file
     # --------------------------------------------------------
@@ -0,0 +1,145 @@
+import logging
+import re
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from app.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# "[download] 100% of  812.44MiB in 00:02:11 at 6.19MiB/s"
+COMPLETED_PATTERN = re.compile(r"\[download\]\s+100(?:\.0)?% of\s+~?\s*([\d.]+)\s*([KMGT]?i?B)\s+in\s+([\d:]+)")
+THROTTLE_PATTERN = re.compile(r"HTTP Error (?:429|503)|Too Many Requests|rate.?limit", re.IGNORECASE)
+FRAGMENT_ERROR_PATTERN = re.compile(r"(?:Retrying|Got error).*fragment|fragment.*(?:not found|skipping)", re.IGNORECASE)
+UNITS = {"B": 1, "KiB": 1024, "MiB": 1024 ** 2, "GiB": 1024 ** 3, "TiB": 1024 ** 4,
+         "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4}
+
+# a step up must pay at least this much to be kept
+MIN_GAIN = 1.05
+FRAGMENT_ERROR_LIMIT = 10
+SMOOTHING = 0.5
+
+
+def parse_transfer(output: str):
+    """Total bytes and seconds of every completed stream in yt-dlp output."""
+    total_bytes = 0.0
+    total_seconds = 0
+    for size, unit, elapsed in COMPLETED_PATTERN.findall(output):
+        total_bytes += float(size) * UNITS.get(unit, 1)
+        seconds = 0
+        for part in elapsed.split(":"):
+            seconds = seconds * 60 + int(part)
+        total_seconds += seconds
+    return total_bytes, total_seconds
+
+
+class HostTuning:
+    def __init__(self, concurrency: int, rates: dict = None, expires_at: float = None):
+        self.concurrency = concurrency
+        # concurrency -> smoothed bytes per second measured at that setting
+        self.rates = rates or {}
+        self.expires_at = expires_at
+
+
+class FragmentTuner:
+    def __init__(self, database: AsyncIOMotorDatabase = None, ttl: int = 24 * 3600, max_concurrency: int = 16,
+                 max_tor_concurrency: int = 4):
+        self.collection = database.get_collection("fragment_tuning") if database is not None else None
+        self.ttl = ttl
+        self.max_concurrency = max_concurrency
+        self.max_tor_concurrency = max_tor_concurrency
+        self._hosts = {}
+        self.backoffs = metrics.counter("fragments.backoffs")
+        self.increases = metrics.counter("fragments.increases")
+
+    async def ensure_indexes(self):
+        if self.collection is not None:
+            await self.collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def load(self):
+        if self.collection is None:
+            return
+        now = datetime.now(timezone.utc)
+        async for doc in self.collection.find({"expires_at": {"$gt": now}}):
+            remaining = (doc["expires_at"].replace(tzinfo=timezone.utc) - now).total_seconds()
+            self._hosts[doc["_id"]] = HostTuning(
+                doc["concurrency"],
+                {int(c): rate for c, rate in doc.get("rates", {}).items()},
+                time.monotonic() + remaining
+            )
+        logger.info(f"Loaded fragment concurrency for {len(self._hosts)} hosts")
+
+    def _get(self, key: str) -> Optional[HostTuning]:
+        tuning = self._hosts.get(key)
+        if tuning and tuning.expires_at < time.monotonic():
+            del self._hosts[key]
+            return None
+        return tuning
+
+    def concurrency(self, key: str, default: int) -> int:
+        tuning = self._get(key)
+        return tuning.concurrency if tuning else default
+
+    def _next_concurrency(self, tuning: HostTuning, ceiling: int, throttled: bool, fragment_errors: int):
+        current = tuning.concurrency
+        if throttled:
+            return max(1, current // 2)
+        if fragment_errors >= FRAGMENT_ERROR_LIMIT:
+            return max(1, current - 1)
+
+        here = tuning.rates.get(current)
+        below = tuning.rates.get(current - 1)
+        above = tuning.rates.get(current + 1)
+        if here is None:
+            return current
+        if below and here < below * MIN_GAIN:
+            # the last step up did not pay off, settle one lower
+            return current - 1
+        if above is None or above >= here * MIN_GAIN:
+            return min(ceiling, current + 1)
+        return current
+
+    async def observe(self, key: str, concurrency: int, output: str, tor: bool = False):
+        tuning = self._get(key) or HostTuning(concurrency)
+        tuning.concurrency = concurrency
+
+        throttled = bool(THROTTLE_PATTERN.search(output))
+        fragment_errors = len(FRAGMENT_ERROR_PATTERN.findall(output))
+        transferred, seconds = parse_transfer(output)
+        if transferred and seconds and not throttled:
+            rate = transferred / seconds
+            previous = tuning.rates.get(concurrency)
+            tuning.rates[concurrency] = rate if previous is None else previous + SMOOTHING * (rate - previous)
+
+        ceiling = self.max_tor_concurrency if tor else self.max_concurrency
+        next_concurrency = self._next_concurrency(tuning, ceiling, throttled, fragment_errors)
+        if next_concurrency < concurrency:
+            self.backoffs.inc()
+        elif next_concurrency > concurrency:
+            self.increases.inc()
+        if next_concurrency != concurrency:
+            logger.info(
+                f"Fragment concurrency for {key}: {concurrency} -> {next_concurrency} "
+                f"(throttled={throttled}, fragment errors={fragment_errors})"
+            )
+
+        tuning.concurrency = next_concurrency
+        tuning.expires_at = time.monotonic() + self.ttl
+        self._hosts[key] = tuning
+
+        if self.collection is None:
+            return
+        try:
+            await self.collection.update_one(
+                {"_id": key},
+                {"$set": {
+                    "concurrency": tuning.concurrency,
+                    "rates": {str(c): rate for c, rate in tuning.rates.items()},
+                    "expires_at": datetime.now(timezone.utc) + timedelta(seconds=self.ttl),
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Could not persist fragment tuning for {key}: {e}")
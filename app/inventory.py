@@ -0,0 +1,138 @@
+import asyncio
+import gzip
+import json
+import logging
+import os
+import time
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class BucketInventory:
+    def __init__(self, client, executor, bucket: str, prefix: str = "", cache_path: str = None,
+                 refresh_interval: int = 3600):
+        self.client = client
+        self.executor = executor
+        self.bucket = bucket
+        self.prefix = prefix
+        self.cache_path = cache_path
+        self.refresh_interval = refresh_interval
+        # key -> (size, etag); tuples keep the per-key footprint small for large buckets
+        self._objects = {}
+        self._directories = set()
+        # changes recorded while a refresh lists the bucket, the listing may predate them
+        self._changed = None
+        self.refreshed_at = None
+
+    @property
+    def is_loaded(self):
+        return self.refreshed_at is not None
+
+    @property
+    def is_stale(self):
+        return not self.is_loaded or time.time() - self.refreshed_at > self.refresh_interval
+
+    def covers(self, object_key: str):
+        return self.is_loaded and object_key.startswith(self.prefix)
+
+    def get(self, object_key: str):
+        return self._objects.get(object_key)
+
+    def contains(self, object_key: str):
+        return object_key in self._objects
+
+    def has_directory(self, directory: str):
+        return directory.rstrip("/") in self._directories
+
+    def record(self, object_key: str, size: int, etag: str = None):
+        self._objects[object_key] = (size, etag)
+        self._directories.add(object_key.rpartition("/")[0])
+        if self._changed is not None:
+            self._changed[object_key] = (size, etag)
+
+    def discard(self, object_key: str):
+        self._objects.pop(object_key, None)
+        if self._changed is not None:
+            self._changed[object_key] = None
+
+    def __len__(self):
+        return len(self._objects)
+
+    async def refresh(self):
+        started = time.monotonic()
+        paginator = self.client.get_paginator("list_objects_v2")
+        pages = iter(paginator.paginate(Bucket=self.bucket, Prefix=self.prefix, PaginationConfig={"PageSize": 1000}))
+
+        objects = {}
+        self._changed = {}
+        try:
+            while True:
+                page = await self.executor.run(next, pages, None)
+                if page is None:
+                    break
+                for item in page.get("Contents", []):
+                    objects[item["Key"]] = (item["Size"], item.get("ETag", "").strip('"'))
+            for key, value in self._changed.items():
+                if value is None:
+                    objects.pop(key, None)
+                else:
+                    objects[key] = value
+        finally:
+            self._changed = None
+
+        self._objects = objects
+        self._directories = {key.rpartition("/")[0] for key in objects}
+        self.refreshed_at = time.time()
+        logger.info(
+            f"Inventory of s3://{self.bucket}/{self.prefix} refreshed: "
+            f"{len(objects)} objects in {time.monotonic() - started:.1f}s"
+        )
+        if self.cache_path:
+            # record() and discard() keep changing the live dict on the loop while the thread encodes
+            await asyncio.to_thread(self.save, dict(self._objects))
+        return len(objects)
+
+    def save(self, objects: dict = None):
+        tmp_path = f"{self.cache_path}.{os.getpid()}.tmp"
+        try:
+            with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+                json.dump({
+                    "bucket": self.bucket,
+                    "prefix": self.prefix,
+                    "refreshed_at": self.refreshed_at,
+                    "objects": self._objects if objects is None else objects,
+                }, f, separators=(",", ":"))
+            os.replace(tmp_path, self.cache_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def load(self):
+        if not self.cache_path or not os.path.exists(self.cache_path):
+            return False
+        try:
+            with gzip.open(self.cache_path, "rt", encoding="utf-8") as f:
+                snapshot = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read inventory cache {self.cache_path}: {e}")
+            return False
+
+        if snapshot.get("bucket") != self.bucket or snapshot.get("prefix") != self.prefix:
+            return False
+
+        self._objects = {key: tuple(value) for key, value in snapshot["objects"].items()}
+        self._directories = {key.rpartition("/")[0] for key in self._objects}
+        self.refreshed_at = snapshot["refreshed_at"]
+        logger.info(f"Loaded {len(self._objects)} inventory entries from {self.cache_path}")
+        return True
+
+    async def run_refresh_loop(self):
+        while True:
+            if self.is_stale:
+                try:
+                    await self.refresh()
+                except Exception as e:
+                    logger.error(f"Inventory refresh failed: {e}", exc_info=True)
+            await asyncio.sleep(min(self.refresh_interval, 300))
@@ -0,0 +1,83 @@
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from app.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class LoopMonitor:
+    """Measures event-loop lag and logs the stack of whatever blocks the loop past a threshold.
+
+    A ticker task on the loop records how late each of its wakeups is. A watchdog thread
+    notices when the ticker stops running and captures the loop thread's stack while it is
+    still stuck, which points at the blocking call itself rather than at its victims.
+    """
+
+    def __init__(self, interval: float = 0.1, threshold: float = 0.5, report_interval: float = 0,
+                 name: str = "event_loop"):
+        self.interval = interval
+        self.threshold = threshold
+        self.report_interval = report_interval
+        self.name = name
+        self.lag = metrics.histogram(f"{name}.lag_seconds", LAG_BUCKETS)
+        self.stall_seconds = metrics.histogram(f"{name}.stall_seconds", LAG_BUCKETS)
+        self.stalls = metrics.counter(f"{name}.stalls")
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._tasks = []
+        self._stopped = threading.Event()
+
+    def start(self):
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._tasks.append(asyncio.create_task(self._tick()))
+        if self.report_interval:
+            self._tasks.append(asyncio.create_task(self._report()))
+        threading.Thread(target=self._watch, name=f"{self.name}-watchdog", daemon=True).start()
+        logger.info(f"Monitoring {self.name} lag every {self.interval}s, reporting stalls over {self.threshold}s")
+
+    def stop(self):
+        self._stopped.set()
+        for task in self._tasks:
+            task.cancel()
+
+    async def _tick(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0.0, loop.time() - expected)
+            self.lag.observe(lag)
+            if lag >= self.threshold:
+                self.stall_seconds.observe(lag)
+            self._beat = time.monotonic()
+
+    async def _report(self):
+        while True:
+            await asyncio.sleep(self.report_interval)
+            lag = self.lag.snapshot()
+            logger.info(
+                f"{self.name} lag: mean {lag['mean'] * 1000:.1f}ms, max {lag['max'] * 1000:.0f}ms "
+                f"over {lag['count']} ticks, {self.stalls.value} stalls"
+            )
+
+    def _watch(self):
+        reported = None
+        while not self._stopped.wait(self.interval):
+            beat = self._beat
+            blocked = time.monotonic() - beat - self.interval
+            # one report per stall: the beat only moves once the loop runs again
+            if blocked < self.threshold or beat == reported:
+                continue
+            reported = beat
+            self.stalls.inc()
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame else "  (stack unavailable)\n"
+            logger.warning(f"{self.name} blocked for {blocked:.2f}s so far, loop thread is at:\n{stack}")
@@ -5,11 +5,20 @@ from app.config import Settings
 from app.data.data import Data
 from app.downloader import YoutubeDownloader
 from app.queue.sqs_client import SqsClient
+from app.queue.enqueuer import Enqueuer
+from app.queue.lanes import LaneRouter, lane_queue_clients
 from app.s3_client import S3client
+from app.bandwidth import BandwidthGovernor, TransferClass
+from app.fragment_tuning import FragmentTuner
+from app.attempt_store import AttemptStore
+from app.loop_monitor import LoopMonitor
+from app.data.leases import LeaseManager
 from contextlib import asynccontextmanager
 import logging
 from app.api.routes import router as match_router
 from app.service.matchdownloader import MatchDownloader
+from app.service.jobs import JobManager, JobStore
+from app.storage_keys import KeyLayout
 import asyncio
 from app.queue.message_queue_processor import MessageProcessor
 
@@ -21,24 +30,74 @@ settings = Settings()
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    loop_monitor = None
+    if settings.loop_monitor_enabled:
+        loop_monitor = LoopMonitor(
+            interval=settings.loop_monitor_interval_seconds,
+            threshold=settings.loop_monitor_threshold_seconds
+        )
+        loop_monitor.start()
+
+    governor = BandwidthGovernor(
+        ingress_bps=settings.bandwidth_ingress_bps,
+        egress_bps=settings.bandwidth_egress_bps,
+        shared_link=settings.bandwidth_shared_link,
+        weights={
+            TransferClass.DOWNLOAD: settings.bandwidth_download_weight,
+            TransferClass.UPLOAD: settings.bandwidth_upload_weight,
+        }
+    )
+
     s3_client = S3client(
         aws_access_key=settings.aws_access_key,
         aws_secret_key=settings.aws_secret_key,
         aws_region=settings.aws_region,
-        aws_bucket=settings.aws_bucket
+        aws_bucket=settings.aws_bucket,
+        max_workers=settings.s3_max_workers,
+        max_pool_connections=settings.s3_max_pool_connections,
+        transfer_concurrency=settings.s3_transfer_concurrency,
+        transfer_workers=settings.s3_transfer_workers,
+        governor=governor
     )
 
     sqs_client = SqsClient(
         aws_access_key=settings.aws_access_key,
         aws_region=settings.aws_region,
         aws_secret_key=settings.aws_secret_key,
-        aws_queue_url=settings.sqs_queue_url
+        aws_queue_url=settings.sqs_queue_url,
+        max_workers=settings.sqs_max_workers,
+        max_pool_connections=settings.sqs_max_pool_connections
     )
 
+    inventory_task = None
+    if settings.s3_inventory_enabled:
+        inventory = s3_client.enable_inventory(
+            prefix=settings.s3_inventory_prefix,
+            cache_path=settings.s3_inventory_cache_path,
+            refresh_interval=settings.s3_inventory_refresh_seconds
+        )
+        inventory_task = asyncio.create_task(inventory.run_refresh_loop())
+
     mongodb_client = AsyncIOMotorClient(settings.database_connection_string)
     mongodb = mongodb_client[settings.database_name]
-    data_service = Data(database=mongodb)
-    youtube_downloader = YoutubeDownloader()
+    data_service = Data(database=mongodb, backlog_stuck_after=settings.backlog_stuck_after_seconds)
+    await data_service.ensure_indexes()
+    data_service.enable_match_cache(max_size=settings.match_cache_size, ttl=settings.match_cache_ttl)
+    if settings.mongo_write_batching:
+        data_service.enable_write_batching(
+            max_batch_size=settings.mongo_write_batch_size,
+            max_delay=settings.mongo_write_batch_delay
+        )
+    fragment_tuner = FragmentTuner(
+        database=mongodb,
+        ttl=settings.fragment_tuning_ttl_seconds,
+        max_concurrency=settings.fragment_max_concurrency,
+        max_tor_concurrency=settings.fragment_max_tor_concurrency
+    )
+    await fragment_tuner.ensure_indexes()
+    await fragment_tuner.load()
+    attempt_store = AttemptStore(settings.attempt_store_path, retention_days=settings.attempt_retention_days)
+    youtube_downloader = YoutubeDownloader(governor=governor, tuner=fragment_tuner, attempt_store=attempt_store)
     
     app.state.mongodb_client = mongodb_client
     app.state.mongodb = mongodb
@@ -46,20 +105,62 @@ async def lifespan(app: FastAPI):
     app.state.logger = logger
     app.state.youtube_downloader = youtube_downloader
     app.state.sqs_client = sqs_client
+
+    router = LaneRouter(
+        data=data_service,
+        youtube_downloader=youtube_downloader,
+        default_client=sqs_client,
+        clients=lane_queue_clients(settings)
+    )
+    enqueuer = Enqueuer(
+        sqs_client=sqs_client,
+        database=mongodb,
+        dedup_window=settings.enqueue_dedup_window_seconds,
+        router=router
+    )
+    await enqueuer.ensure_indexes()
+    app.state.enqueuer = enqueuer
     app.state.data = data_service
 
     match_downloader = MatchDownloader(
         youtube_downloader=youtube_downloader,
         data=data_service,
-        s3_client=s3_client)
+        s3_client=s3_client,
+        key_layout=KeyLayout(
+            scheme=settings.s3_key_scheme,
+            prefix=settings.s3_key_prefix,
+            shard_chars=settings.s3_key_shard_chars
+        ),
+        download_dir=settings.download_dir,
+        unavailable_ttl=settings.unavailable_ttl_seconds,
+        dedup_min_bytes=settings.upload_dedup_min_bytes)
     
     app.state.match_downloader = match_downloader
 
+    job_store = JobStore(database=mongodb)
+    await job_store.ensure_indexes()
+    lease_manager = LeaseManager(
+        database=mongodb,
+        ttl=settings.lease_ttl_seconds,
+        heartbeat_interval=settings.lease_heartbeat_seconds
+    )
+    await lease_manager.ensure_indexes()
+    job_manager = JobManager(store=job_store, match_downloader=match_downloader, lease_manager=lease_manager)
+    await job_manager.start()
+    app.state.job_manager = job_manager
+
     # processor = MessageProcessor(sqs_client=sqs_client, match_downloader=match_downloader)
     # asyncio.create_task(processor.poll_messages())
     
     yield
-    
+
+    await job_manager.stop()
+    if loop_monitor:
+        loop_monitor.stop()
+    if inventory_task:
+        inventory_task.cancel()
+    await data_service.close()
+    attempt_store.close()
     mongodb_client.close()
 
 app = FastAPI(
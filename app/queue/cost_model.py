@@ -0,0 +1,91 @@
+import logging
+from typing import Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# starting points until a platform has history; youtube goes through Tor and is an order of magnitude slower
+DEFAULT_BYTES_PER_SECOND = {
+    "youtube": 1 * 1024 * 1024,
+    "veo": 12 * 1024 * 1024,
+    "pixellot": 8 * 1024 * 1024,
+    "facebook": 6 * 1024 * 1024,
+    "other": 6 * 1024 * 1024,
+}
+DEFAULT_JOB_SECONDS = {
+    "youtube": 3600,
+    "veo": 300,
+    "pixellot": 600,
+    "facebook": 900,
+    "other": 900,
+}
+# 1080p match footage averages roughly 5 Mbit/s
+DEFAULT_BYTES_PER_MEDIA_SECOND = 625 * 1024
+SMOOTHING = 0.3
+
+
+class CostEstimate:
+    def __init__(self, platform: Optional[str], seconds: float, duration: float = None, filesize: int = None):
+        self.platform = platform
+        self.seconds = seconds
+        self.duration = duration
+        self.filesize = filesize
+
+    def __repr__(self):
+        return (f"CostEstimate(platform={self.platform}, seconds={self.seconds:.0f}, "
+                f"duration={self.duration}, filesize={self.filesize})")
+
+
+class ThroughputModel:
+    def __init__(self, database: AsyncIOMotorDatabase = None):
+        self.collection = database.get_collection("platform_throughput") if database is not None else None
+        self.bytes_per_second = dict(DEFAULT_BYTES_PER_SECOND)
+        self.job_seconds = dict(DEFAULT_JOB_SECONDS)
+        self.samples = {}
+
+    async def load(self):
+        if self.collection is None:
+            return
+        async for stats in self.collection.find({}):
+            platform = stats["_id"]
+            self.bytes_per_second[platform] = stats["bytes_per_second"]
+            self.job_seconds[platform] = stats["job_seconds"]
+            self.samples[platform] = stats.get("samples", 0)
+        logger.info(f"Loaded download throughput history for {len(self.samples)} platforms")
+
+    def estimate(self, platform: str, duration: float = None, filesize: int = None) -> CostEstimate:
+        if platform not in self.job_seconds:
+            platform = "other"
+        if not filesize and duration:
+            filesize = int(duration * DEFAULT_BYTES_PER_MEDIA_SECOND)
+        if filesize:
+            seconds = filesize / self.bytes_per_second[platform]
+        else:
+            seconds = self.job_seconds[platform]
+        return CostEstimate(platform, seconds, duration=duration, filesize=filesize)
+
+    async def record(self, platform: str, elapsed: float, filesize: int):
+        if elapsed <= 0 or not filesize:
+            return
+        if platform not in self.job_seconds:
+            platform = "other"
+        # exponential moving average so a change in network conditions shows up within a few jobs
+        self.bytes_per_second[platform] += SMOOTHING * (filesize / elapsed - self.bytes_per_second[platform])
+        self.job_seconds[platform] += SMOOTHING * (elapsed - self.job_seconds[platform])
+        self.samples[platform] = self.samples.get(platform, 0) + 1
+
+        if self.collection is None:
+            return
+        try:
+            await self.collection.update_one(
+                {"_id": platform},
+                {"$set": {
+                    "bytes_per_second": self.bytes_per_second[platform],
+                    "job_seconds": self.job_seconds[platform],
+                    "samples": self.samples[platform],
+                }},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Could not persist throughput for {platform}: {e}")
@@ -0,0 +1,187 @@
+import asyncio
+import json
+import logging
+from datetime import datetime, timedelta, timezone
+from collections import defaultdict
+from typing import List
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from app.metrics import metrics
+from app.queue.lanes import Lane, LaneRouter
+from app.queue.messages import Message
+from app.queue.sqs_client import SqsClient
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SQS_BATCH_SIZE = 10
+PENDING_CLAIM_WAIT = 5.0
+# returned for a duplicate whose first enqueue has not been confirmed yet, it may still fail
+PENDING = "pending"
+
+
+class Enqueuer:
+    def __init__(self, sqs_client: SqsClient, database: AsyncIOMotorDatabase, dedup_window: int = 3600,
+                 router: LaneRouter = None):
+        self.sqs_client = sqs_client
+        self.router = router
+        self.claims = database.get_collection("enqueue_idempotency")
+        self.dedup_window = dedup_window
+        self.enqueued = metrics.counter("enqueue.sent")
+        self.duplicates = metrics.counter("enqueue.duplicates")
+
+    async def ensure_indexes(self):
+        await self.claims.create_index("expires_at", expireAfterSeconds=0)
+
+    def _claim(self, key: str, now: datetime):
+        return {
+            "_id": key,
+            "message_id": None,
+            "created_at": now,
+            "expires_at": now + timedelta(seconds=self.dedup_window),
+        }
+
+    async def _lane(self, message: Message):
+        if not self.router:
+            return None
+        try:
+            return await self.router.lane_for(message)
+        except Exception as e:
+            logger.warning(f"Could not classify {message.command}, using the fast lane: {e}")
+            return Lane.FAST
+
+    def _client_for(self, lane):
+        if not self.router:
+            return self.sqs_client
+        metrics.counter(f"enqueue.lane.{lane.value}").inc()
+        return self.router.client_for(lane)
+
+    def _send_params(self, client: SqsClient, message: Message, key: str):
+        # SQS FIFO deduplicates for 5 minutes on its own; the Mongo claim covers the longer window
+        if not client.is_fifo:
+            return {}
+        return {"deduplication_id": key, "group_id": message.group_id()}
+
+    def _is_live(self, claim: dict, now: datetime):
+        return claim["expires_at"].replace(tzinfo=timezone.utc) > now
+
+    async def _live_claim(self, key: str, now: datetime):
+        # another request may still be between claiming and sending
+        deadline = asyncio.get_running_loop().time() + PENDING_CLAIM_WAIT
+        while True:
+            claim = await self.claims.find_one({"_id": key})
+            if claim is None or not self._is_live(claim, now):
+                return None
+            if claim.get("message_id") or asyncio.get_running_loop().time() >= deadline:
+                return claim
+            await asyncio.sleep(0.2)
+
+    async def enqueue(self, message: Message):
+        if message.postDate is None:
+            message.set_post_date()
+        key = message.idempotency_key()
+        now = datetime.now(timezone.utc)
+
+        try:
+            await self.claims.insert_one(self._claim(key, now))
+        except DuplicateKeyError:
+            claim = await self._live_claim(key, now)
+            if claim is not None:
+                self.duplicates.inc()
+                message_id = claim.get("message_id") or PENDING
+                logger.info(f"Duplicate {message.command} within dedup window, returning message {message_id}")
+                return message_id, True
+            # the claim expired but the TTL monitor has not removed it yet
+            await self.claims.replace_one({"_id": key}, self._claim(key, now), upsert=True)
+
+        client = self._client_for(await self._lane(message))
+        try:
+            response = await client.send_message(
+                json.dumps(message.to_dict()),
+                **self._send_params(client, message, key)
+            )
+        except Exception:
+            await self.claims.delete_one({"_id": key})
+            raise
+
+        message_id = response.get("MessageId")
+        await self.claims.update_one({"_id": key}, {"$set": {"message_id": message_id}})
+        self.enqueued.inc()
+        return message_id, False
+
+    async def release(self, message: Message):
+        """Drops the dedup claim of a message so the next enqueue of it is sent again."""
+        await self.release_key(message.idempotency_key())
+
+    async def release_key(self, key: str):
+        await self.claims.delete_one({"_id": key})
+
+    async def enqueue_batch(self, messages: List[Message], lanes: List[Lane] = None):
+        now = datetime.now(timezone.utc)
+        for message in messages:
+            if message.postDate is None:
+                message.set_post_date()
+        keys = [message.idempotency_key() for message in messages]
+        results = [(None, False)] * len(messages)
+
+        duplicate_indexes = set()
+        try:
+            await self.claims.insert_many([self._claim(key, now) for key in keys], ordered=False)
+        except BulkWriteError as e:
+            duplicate_indexes = {error["index"] for error in e.details.get("writeErrors", []) if error.get("code") == 11000}
+
+        if duplicate_indexes:
+            existing = {
+                claim["_id"]: claim
+                async for claim in self.claims.find({"_id": {"$in": [keys[i] for i in duplicate_indexes]}})
+            }
+            for index in list(duplicate_indexes):
+                claim = existing.get(keys[index])
+                if claim is None or not self._is_live(claim, now):
+                    await self.claims.replace_one({"_id": keys[index]}, self._claim(keys[index], now), upsert=True)
+                    duplicate_indexes.discard(index)
+                    continue
+                results[index] = (claim.get("message_id") or PENDING, True)
+            self.duplicates.inc(len(duplicate_indexes))
+
+        fresh = [i for i in range(len(messages)) if i not in duplicate_indexes]
+        if self.router and lanes is None:
+            lanes = await asyncio.gather(*(self._lane(messages[i]) for i in fresh))
+            lanes = dict(zip(fresh, lanes))
+        by_client = defaultdict(list)
+        for index in fresh:
+            by_client[self._client_for(lanes[index] if lanes else None)].append(index)
+
+        confirmed = []
+        failed_keys = []
+        for client, indexes in by_client.items():
+            for start in range(0, len(indexes), SQS_BATCH_SIZE):
+                chunk = indexes[start:start + SQS_BATCH_SIZE]
+                entries = []
+                for index in chunk:
+                    entry = {"Id": str(index), "MessageBody": json.dumps(messages[index].to_dict())}
+                    if client.is_fifo:
+                        entry["MessageDeduplicationId"] = keys[index]
+                        entry["MessageGroupId"] = messages[index].group_id()
+                    entries.append(entry)
+
+                try:
+                    response = await client.send_message_batch(entries)
+                except Exception as e:
+                    logger.error(f"SendMessageBatch failed: {e}")
+                    response = {"Failed": [{"Id": entry["Id"]} for entry in entries]}
+
+                for entry in response.get("Successful", []):
+                    index = int(entry["Id"])
+                    results[index] = (entry["MessageId"], False)
+                    confirmed.append(UpdateOne({"_id": keys[index]}, {"$set": {"message_id": entry["MessageId"]}}))
+                for entry in response.get("Failed", []):
+                    failed_keys.append(keys[int(entry["Id"])])
+
+        if confirmed:
+            await self.claims.bulk_write(confirmed, ordered=False)
+            self.enqueued.inc(len(confirmed))
+        if failed_keys:
+            await self.claims.delete_many({"_id": {"$in": failed_keys}})
+        return results
@@ -0,0 +1,69 @@
+import logging
+from enum import Enum
+from typing import Dict, Optional
+from app.config import Settings
+from app.data.data import Data
+from app.downloader import YoutubeDownloader
+from app.queue.messages import Message
+from app.queue.sqs_client import SqsClient
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class Lane(str, Enum):
+    # direct downloads from Veo, Pixellot, Facebook and other hosts, bandwidth heavy
+    FAST = "fast"
+    # YouTube through Tor, hours per match
+    SLOW = "slow"
+    # merges and re-encodes, CPU heavy
+    TRANSCODE = "transcode"
+
+
+TOR_PLATFORMS = {"youtube"}
+
+
+def lane_queue_clients(settings: Settings, max_workers: int = None) -> Dict[Lane, SqsClient]:
+    """One SQS client per lane that has its own queue configured in SQS_LANE_QUEUE_URLS."""
+    clients = {}
+    for lane in Lane:
+        queue_url = settings.sqs_lane_queue_urls.get(lane.value)
+        if not queue_url:
+            continue
+        clients[lane] = SqsClient(
+            aws_access_key=settings.aws_access_key,
+            aws_region=settings.aws_region,
+            aws_secret_key=settings.aws_secret_key,
+            aws_queue_url=queue_url,
+            max_workers=max_workers or settings.sqs_max_workers,
+            max_pool_connections=settings.sqs_max_pool_connections
+        )
+    return clients
+
+
+class LaneRouter:
+    def __init__(self, data: Data, youtube_downloader: YoutubeDownloader, default_client: SqsClient,
+                 clients: Dict[Lane, SqsClient] = None):
+        self.data = data
+        self.youtube_downloader = youtube_downloader
+        self.default_client = default_client
+        self.clients = clients or {}
+
+    def lane_for_url(self, url: Optional[str]) -> Lane:
+        if url and self.youtube_downloader.platform(url) in TOR_PLATFORMS:
+            return Lane.SLOW
+        return Lane.FAST
+
+    async def lane_for(self, message: Message) -> Lane:
+        if message.command == "Merge_Video":
+            return Lane.TRANSCODE
+        if message.command == "Download_Video":
+            return self.lane_for_url(message.link)
+        if message.command == "Match_Upload":
+            match = await self.data.get_match_video_info(message.matchId)
+            return self.lane_for_url(match.match_video if match else None)
+        return Lane.FAST
+
+    def client_for(self, lane: Optional[Lane]) -> SqsClient:
+        # lanes without a dedicated queue share the default one
+        return self.clients.get(lane, self.default_client)
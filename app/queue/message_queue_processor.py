@@ -1,20 +1,334 @@
 
 
 import os
-from pathlib import Path
+import json
+import time
 from app.queue.sqs_client import SqsClient
+from app.queue.cost_model import CostEstimate, ThroughputModel
+from app.queue.scheduler import JobScheduler, ScheduledJob
+from app.queue.retry import RetryPolicy, MAX_VISIBILITY_TIMEOUT
+from app.queue.enqueuer import Enqueuer
+from app.queue.messages import idempotency_key, parse_message
 from app.service.matchdownloader import MatchDownloader
+from app.service.disk_admission import DiskAdmission
+from app.downloader import PermanentDownloadError
+from app.data.data import is_known_unavailable
+from app.data.schema import VideoStatus
+from app.data.leases import LeaseManager
+from app.metrics import metrics
 import logging
 import asyncio
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+VISIBILITY_TIMEOUT = 900
+VISIBILITY_REFRESH_SECONDS = 300
+
 
 class MessageProcessor:
-    def __init__(self, sqs_client:  SqsClient, match_downloader: MatchDownloader):
+    def __init__(self, sqs_client:  SqsClient, match_downloader: MatchDownloader, lease_manager: LeaseManager = None,
+                 scheduler: JobScheduler = None, cost_model: ThroughputModel = None, probe: bool = True,
+                 disk: DiskAdmission = None, default_job_bytes: int = 4 * 1024 ** 3,
+                 retry_policy: RetryPolicy = None, dead_letter_client: SqsClient = None, drain_timeout: float = 600,
+                 enqueuer: Enqueuer = None):
         self.sqs_client = sqs_client
         self.match_downloader = match_downloader
+        self.lease_manager = lease_manager
+        self.scheduler = scheduler or JobScheduler()
+        self.cost_model = cost_model or ThroughputModel()
+        self.probe = probe
+        self.disk = disk
+        self.default_job_bytes = default_job_bytes
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.dead_letter_client = dead_letter_client
+        self.drain_timeout = drain_timeout
+        self.enqueuer = enqueuer
+        self._stopping = asyncio.Event()
+        # receipt handle -> received SQS message for everything buffered or running on this worker
+        self._held = {}
+        self.duplicates_completed = metrics.counter("worker.duplicates_avoided.completed")
+        self.duplicates_leased = metrics.counter("worker.duplicates_avoided.leased")
+        self.skipped_unavailable = metrics.counter("worker.skipped_unavailable")
+        self.retries = metrics.counter("worker.retries")
+        self.dead_lettered = metrics.counter("worker.dead_lettered")
+
+    async def process_match_upload(self, match_id: str, receipt_handle: str):
+        if await self._already_uploaded(match_id, receipt_handle):
+            return
+        if await self._known_unavailable(match_id, receipt_handle):
+            return
+
+        if not self.lease_manager:
+            await self._run_match_upload(match_id, receipt_handle, None)
+            return
+
+        async with self.lease_manager.hold(f"match:{match_id}") as lease:
+            if lease is None:
+                logger.info(f"Match {match_id} is being processed by another worker, deferring message.")
+                self.duplicates_leased.inc()
+                # keep it hidden until the other lease would have expired, then re-check
+                await self.sqs_client.change_message_visibility(receipt_handle, self.lease_manager.ttl)
+                return
+            # the previous holder may have finished between the first check and our acquisition
+            if await self._already_uploaded(match_id, receipt_handle, fresh=True):
+                return
+            await self._run_match_upload(match_id, receipt_handle, lease)
+
+    async def _already_uploaded(self, match_id: str, receipt_handle: str, fresh: bool = False):
+        match = await self.match_downloader.data.get_match_video_info(match_id, fresh=fresh)
+        if match and (match.video_ingest or {}).get("status") == VideoStatus.UPLOADED.value:
+            logger.info(f"Match {match_id} is already uploaded, skipping duplicate message.")
+            self.duplicates_completed.inc()
+            await self.sqs_client.delete_message(receipt_handle)
+            return True
+        return False
+
+    async def _known_unavailable(self, match_id: str, receipt_handle: str):
+        data = self.match_downloader.data
+        match = await data.get_match_video_info(match_id)
+        if not match or not is_known_unavailable(match.video_ingest, match.match_video):
+            return False
+        # a forced retry clears the record, so do not trust a cached copy before dropping the message
+        match = await data.get_match_video_info(match_id, fresh=True)
+        if not match or not is_known_unavailable(match.video_ingest, match.match_video):
+            return False
+        logger.info(
+            f"Match {match_id} video is known to be unavailable "
+            f"({match.video_ingest.get('unavailable_reason')}), skipping message."
+        )
+        self.skipped_unavailable.inc()
+        await self.sqs_client.delete_message(receipt_handle)
+        return True
+
+    async def _run_match_upload(self, match_id: str, receipt_handle: str, lease):
+        data = self.match_downloader.data
+        try:
+            await data.set_video_status(match_id, VideoStatus.DOWNLOADING)
+            started = time.monotonic()
+            video_path = await self.match_downloader.download_match_video(match_id)
+            if video_path:
+                await self._record_throughput(match_id, video_path, time.monotonic() - started)
+                object_key = self.match_downloader.match_object_key(match_id, video_path)
+                upload_url = await self.match_downloader.upload_match_video(str(video_path), object_key)
+                if lease and lease.lost:
+                    logger.info(f"Lease for match {match_id} was lost, leaving the result to the new owner.")
+                    self.match_downloader.release_video(video_path)
+                    return
+                if upload_url:
+                    await data.update_match_video(match_id, upload_url, object_key)
+                    logger.info(f"Successfully processed and uploaded match {match_id}. URL: {upload_url}")
+                    await self.sqs_client.delete_message(receipt_handle)
+                    self.match_downloader.release_video(video_path)
+                else:
+                    logger.info(f"Failed to upload video for match {match_id}")
+                    self.match_downloader.release_video(video_path)
+                    await self._match_failed(match_id, receipt_handle, "upload failed")
+            else:
+                logger.info(f"Failed to download video for match {match_id}")
+                await self._match_failed(match_id, receipt_handle, "download failed")
+        except PermanentDownloadError as e:
+            # the match downloader already recorded it as unavailable, keep that status
+            logger.info(f"Match {match_id} video is unavailable, not retrying: {e}")
+            await self.sqs_client.delete_message(receipt_handle)
+        except Exception as e:
+            logger.info(f"Error processing Match_Upload for {match_id}: {e}")
+            await self._match_failed(match_id, receipt_handle, str(e))
+
+    async def _match_failed(self, match_id: str, receipt_handle: str, error: str):
+        retrying = await self._retry_or_dead_letter(receipt_handle, error)
+        # a match waiting for its retry stays queued so the watcher and backfill leave it alone
+        status = VideoStatus.QUEUED if retrying else VideoStatus.FAILED
+        await self.match_downloader.data.set_video_status(match_id, status, error=error)
+
+    @staticmethod
+    def _attribute(msg: dict, name: str):
+        return ((msg.get("MessageAttributes") or {}).get(name) or {}).get("StringValue")
+
+    def _attempt(self, receipt_handle: str) -> int:
+        # counted in the message itself: receives caused by lease deferrals, drains or expiry are not failures
+        msg = self._held.get(receipt_handle) or {}
+        return int(self._attribute(msg, "attempt") or 1)
+
+    async def _resend_for_retry(self, msg: dict, attempt: int, delay: int):
+        body = msg.get("Body", "{}")
+        try:
+            # the enqueuer's group, per match for uploads: one group per command would hold every retry behind the one in flight
+            group_id = parse_message(json.loads(body)).group_id()
+        except Exception:
+            group_id = None
+        await self.sqs_client.send_message(
+            body,
+            deduplication_id=f"{msg.get('MessageId')}-retry-{attempt}",
+            group_id=group_id,
+            attributes={"attempt": attempt + 1, "not_before": int(time.time() + delay)},
+            delay_seconds=delay
+        )
+
+    async def _retry_or_dead_letter(self, receipt_handle: str, error: str) -> bool:
+        """Re-sends a failed message with its attempt count and a backoff delay, or dead-letters it once out of attempts.
+
+        Returns True when the message will be retried, or was already handed off by an earlier call.
+        """
+        if receipt_handle not in self._held:
+            # a handler that gave up on the message raised afterwards, resending now would send an empty copy
+            logger.info(f"Message already retried or dead-lettered, ignoring the later failure ({error})")
+            return True
+        attempt = self._attempt(receipt_handle)
+        if self.retry_policy.should_retry(attempt):
+            # stop extending its visibility, the retry is a new message
+            msg = self._held.pop(receipt_handle)
+            delay = self.retry_policy.delay(attempt)
+            logger.info(f"Attempt {attempt}/{self.retry_policy.max_attempts} failed ({error}), retrying in {delay}s")
+            self.retries.inc()
+            try:
+                await self._resend_for_retry(msg, attempt, delay)
+            except Exception as e:
+                # the original still comes back when its current visibility runs out
+                logger.info(f"Could not schedule message retry: {e}")
+                return True
+            await self.sqs_client.delete_message(receipt_handle)
+            return True
+
+        await self._dead_letter(receipt_handle, error)
+        return False
+
+    async def _dead_letter(self, receipt_handle: str, error: str):
+        attempt = self._attempt(receipt_handle)
+        msg = self._held.pop(receipt_handle, None) or {}
+        self.dead_lettered.inc()
+        if self.dead_letter_client:
+            await self.dead_letter_client.send_message(
+                msg.get("Body", "{}"),
+                deduplication_id=msg.get("MessageId"),
+                attributes={
+                    "error": error[:256],
+                    "attempts": attempt,
+                    "source_queue": self.sqs_client.queue_url,
+                }
+            )
+            logger.warning(f"Giving up after {attempt} attempts ({error}), moved message to the dead-letter queue")
+        else:
+            logger.error(f"Giving up after {attempt} attempts ({error}), no dead-letter queue configured")
+        await self.sqs_client.delete_message(receipt_handle)
+        await self._release_claim(msg)
+
+    async def _release_claim(self, msg: dict):
+        # the dedup claim would otherwise turn away a new request for the failed command until its window ends
+        if not self.enqueuer:
+            return
+        try:
+            await self.enqueuer.release_key(idempotency_key(json.loads(msg.get("Body", "{}"))))
+        except Exception as e:
+            logger.info(f"Could not release the enqueue claim of a dead-lettered message: {e}")
+
+    async def _record_throughput(self, match_id: str, video_path: str, elapsed: float):
+        try:
+            match = await self.match_downloader.data.get_match_video_info(match_id)
+            platform = self.match_downloader.youtube_downloader.platform(match.match_video)
+            await self.cost_model.record(platform, elapsed, os.path.getsize(video_path))
+        except Exception as e:
+            logger.info(f"Could not record download throughput for {match_id}: {e}")
+
+    async def _video_urls(self, message_body: dict):
+        command = message_body.get("command")
+        if command == "Match_Upload":
+            match = await self.match_downloader.data.get_match_video_info(message_body.get("matchId"))
+            if not match or (match.video_ingest or {}).get("status") == VideoStatus.UPLOADED.value:
+                return []
+            if is_known_unavailable(match.video_ingest, match.match_video):
+                return []
+            return [match.match_video] if match.match_video else []
+        if command == "Merge_Video":
+            return [url for url in (message_body.get("video1"), message_body.get("video2")) if url]
+        if command == "Download_Video":
+            return [message_body.get("link")] if message_body.get("link") else []
+        return []
+
+    async def estimate_cost(self, message_body: dict) -> CostEstimate:
+        urls = await self._video_urls(message_body)
+        if not urls:
+            # nothing to download: the message is skipped or deleted almost immediately
+            return CostEstimate(None, 0)
+
+        # resolves streams and keeps probed info json so the download starts transferring right away
+        downloader = self.match_downloader.youtube_downloader
+        probes = await asyncio.gather(*(downloader.prefetch(url, probe=self.probe) for url in urls))
+        estimates = [
+            self.cost_model.estimate(downloader.platform(url), **(probe or {}))
+            for url, probe in zip(urls, probes)
+        ]
+        if len(estimates) == 1:
+            return estimates[0]
+        # merges download every source before concatenating, and write the output next to them
+        filesize = sum(estimate.filesize or 0 for estimate in estimates)
+        return CostEstimate(None, sum(estimate.seconds for estimate in estimates), filesize=2 * filesize or None)
+
+    async def _schedule(self, msg: dict):
+        receipt_handle = msg.get("ReceiptHandle")
+        try:
+            message_body = json.loads(msg.get("Body"))
+        except Exception as e:
+            logger.info(f"Failed to process message: {e}")
+            return
+
+        # SQS delays stop at 15 minutes, longer backoffs hide the retry again until it is due
+        not_before = self._attribute(msg, "not_before")
+        if not_before and int(not_before) > time.time():
+            await self.sqs_client.change_message_visibility(
+                receipt_handle, min(int(not_before) - int(time.time()), MAX_VISIBILITY_TIMEOUT)
+            )
+            return
+
+        try:
+            estimate = await self.estimate_cost(message_body)
+        except Exception as e:
+            logger.info(f"Could not estimate message cost, using the default: {e}")
+            estimate = self.cost_model.estimate("other")
+
+        self._held[receipt_handle] = msg
+        reservation = 0
+        if self.disk and estimate.seconds > 0:
+            reservation = estimate.filesize or self.default_job_bytes
+            await self.disk.reserve(reservation)
+
+        logger.info(f"Scheduled {message_body.get('command')} with {estimate}")
+        await self.scheduler.submit(
+            ScheduledJob(receipt_handle, estimate.seconds, payload=(message_body, estimate, reservation))
+        )
+
+    async def _run_job(self, job: ScheduledJob):
+        message_body, estimate, reservation = job.payload
+        try:
+            await self.process_message(message_body, job.key)
+        except PermanentDownloadError as e:
+            logger.info(f"Dropping {message_body.get('command')} message, its source is unavailable: {e}")
+            await self.sqs_client.delete_message(job.key)
+        except Exception as e:
+            logger.info(f"Failed to process message: {e}")
+            await self._retry_or_dead_letter(job.key, str(e))
+        finally:
+            self._held.pop(job.key, None)
+            if reservation:
+                await self.disk.release(reservation)
+        logger.info(
+            f"Finished {message_body.get('command')} in {time.monotonic() - job.started_at:.0f}s "
+            f"(estimated {estimate.seconds:.0f}s, waited {job.started_at - job.submitted_at:.0f}s)"
+        )
+
+    async def _keep_visible(self):
+        # buffered messages wait behind cheaper ones and must not reappear to other workers meanwhile
+        while True:
+            await asyncio.sleep(VISIBILITY_REFRESH_SECONDS)
+            for receipt_handle in list(self._held):
+                # finished or handed to a retry while earlier extensions were awaited
+                if receipt_handle not in self._held:
+                    continue
+                try:
+                    await self.sqs_client.change_message_visibility(receipt_handle, VISIBILITY_TIMEOUT)
+                except Exception as e:
+                    logger.info(f"Could not extend message visibility: {e}")
+            logger.info(f"Scheduler: {self.scheduler.stats()}")
 
     async def process_message(self, message_body: dict, receipt_handle: str):
         command = message_body.get("command")
@@ -22,27 +336,10 @@ class MessageProcessor:
             match_id = message_body.get("matchId")
             
             if match_id:
-                try:
-                    video_path = await self.match_downloader.download_match_video(match_id)
-                    if video_path:
-                        object_key = os.path.basename(video_path)
-                        upload_url = await self.match_downloader.upload_match_video(str(video_path), object_key)
-                        if upload_url:
-                            await self.match_downloader.data.update_match_video(match_id, upload_url)
-                            logger.info(f"Successfully processed and uploaded match {match_id}. URL: {upload_url}")
-                            self.sqs_client.delete_message(receipt_handle)
-                            Path(video_path).unlink(missing_ok=True)
-                        else:
-                            logger.info(f"Failed to upload video for match {match_id}")
-                            self.sqs_client.delete_message(receipt_handle)
-                    else:
-                        logger.info(f"Failed to download video for match {match_id}")
-                        self.sqs_client.delete_message(receipt_handle)
-                except Exception as e:
-                    logger.info(f"Error processing Match_Upload for {match_id}: {e}")
-                    self.sqs_client.delete_message(receipt_handle)
+                await self.process_match_upload(match_id, receipt_handle)
             else:
                 logger.info("Match_Upload message missing matchId.")
+                await self._dead_letter(receipt_handle, "missing matchId")
 
         elif command=="Merge_Video":
             video1 = message_body.get("video1")
@@ -50,53 +347,111 @@ class MessageProcessor:
             output_name = message_body.get("output_name")
             merged_video, video2_path, video1_path = await self.match_downloader.merge_videos(video1, video2, output_name=output_name)
             if merged_video:
-                object_key = os.path.basename(merged_video)
+                object_key = self.match_downloader.video_object_key(merged_video)
                 upload_url = await self.match_downloader.upload_match_video(str(merged_video), object_key)
+                self.match_downloader.discard_job_files(merged_video)
                 if upload_url:
                     logger.info(f"Successfully merged and upload video")
-                    self.sqs_client.delete_message(receipt_handle)
-                    Path(merged_video).unlink(missing_ok=True)
-                    Path(video2_path).unlink(missing_ok=True)
-                    Path(video1_path).unlink(missing_ok=True)
+                    await self.sqs_client.delete_message(receipt_handle)
                 else:
                     logger.info(f"Failed to merge and upload video")
-                    self.sqs_client.delete_message(receipt_handle)
+                    await self._retry_or_dead_letter(receipt_handle, "upload failed")
+            else:
+                await self._retry_or_dead_letter(receipt_handle, "merge failed")
         elif command=="Download_Video":
             link = message_body.get("link")
             output_name = message_body.get("output_name")
             downloaded_video = await self.match_downloader.download_video(link, output_name=output_name)
             if downloaded_video:
-                object_key = os.path.basename(downloaded_video)
+                object_key = self.match_downloader.video_object_key(downloaded_video)
                 upload_url = await self.match_downloader.upload_match_video(str(downloaded_video), object_key)
+                self.match_downloader.discard_job_files(downloaded_video)
                 if upload_url:
                     logger.info(f"Successfully downloaded and uploaded video")
-                    self.sqs_client.delete_message(receipt_handle)
-                    Path(downloaded_video).unlink(missing_ok=True)
+                    await self.sqs_client.delete_message(receipt_handle)
                 else:
                     logger.info(f"Failed to download video")
-                    self.sqs_client.delete_message(receipt_handle)
+                    await self._retry_or_dead_letter(receipt_handle, "upload failed")
+            else:
+                await self._retry_or_dead_letter(receipt_handle, "download failed")
         else:
-            logger.info("Unknown command")
+            # no worker version handles it, left in the queue it would come back after every visibility timeout
+            logger.info(f"Unknown command {command}")
+            await self._dead_letter(receipt_handle, f"unknown command {command}")
+
+    async def _release(self, receipt_handle: str):
+        """Hands a message back to the queue right away, for another worker to pick up."""
+        self._held.pop(receipt_handle, None)
+        try:
+            await self.sqs_client.change_message_visibility(receipt_handle, 0)
+        except Exception as e:
+            logger.info(f"Could not release message: {e}")
+
+    async def _release_pending(self):
+        pending = await self.scheduler.drain()
+        for job in pending:
+            _, _, reservation = job.payload
+            if reservation:
+                await self.disk.release(reservation)
+            await self._release(job.key)
+        return len(pending)
+
+    async def stop(self):
+        """Stops taking messages and hands buffered ones back; poll_messages then waits for running jobs."""
+        if self._stopping.is_set():
+            return
+        self._stopping.set()
+        released = await self._release_pending()
+        logger.info(f"Draining {self.sqs_client.queue_url}: released {released} buffered messages")
+
+    async def _finish_running(self):
+        # anything scheduled while stop() ran never reached the dispatcher
+        await self._release_pending()
+        if await self.scheduler.wait_idle(self.drain_timeout):
+            logger.info(f"Drained {self.sqs_client.queue_url}")
+            return
+        running = dict(self._held)
+        logger.warning(f"{len(running)} jobs still running after {self.drain_timeout}s, cancelling and releasing them")
+        # cancel first, so the released messages are never worked on twice
+        await self.scheduler.cancel_running()
+        for receipt_handle, msg in running.items():
+            await self._requeue_match(msg)
+            await self._release(receipt_handle)
+
+    async def _requeue_match(self, msg: dict):
+        # a cancelled upload stopped mid-download, put it back to queued for whoever takes the message next
+        try:
+            message_body = json.loads(msg.get("Body"))
+        except Exception:
+            return
+        match_id = message_body.get("matchId")
+        if message_body.get("command") != "Match_Upload" or not match_id:
+            return
+        try:
+            await self.match_downloader.data.set_video_status(match_id, VideoStatus.QUEUED)
+        except Exception as e:
+            logger.info(f"Could not reset match {match_id} to queued: {e}")
 
     async def poll_messages(self):
         logger.info("Starting message polling...")
-        while True:
-            response = self.sqs_client.receive_message()
-            messages = response.get("Messages", [])
-
-            if len(messages)>0:
-                for msg in messages:
-                    body = msg.get("Body")
-                    receipt_handle = msg.get("ReceiptHandle")
-                    try:
-                        import json
-                        message_body = json.loads(body)
-                        await self.process_message(message_body, receipt_handle)
-                    except Exception as e:
-                        logger.info(f"Failed to process message: {e}")
-            else:
-                logger.info("No messages received.")
+        dispatcher = asyncio.create_task(self.scheduler.run(self._run_job))
+        keepalive = asyncio.create_task(self._keep_visible())
+        try:
+            while not self._stopping.is_set():
+                room = await self.scheduler.wait_for_room()
+                if self._stopping.is_set():
+                    break
+                response = await self.sqs_client.receive_message(max_messages=room)
+                messages = response.get("Messages", [])
 
-            logger.info('Sleeping for 15 minutes...')
-            await asyncio.sleep(900)
-            
+                if self._stopping.is_set():
+                    for msg in messages:
+                        await self._release(msg.get("ReceiptHandle"))
+                elif len(messages)>0:
+                    await asyncio.gather(*(self._schedule(msg) for msg in messages))
+                else:
+                    logger.info("No messages received.")
+            await self._finish_running()
+        finally:
+            dispatcher.cancel()
+            keepalive.cancel()
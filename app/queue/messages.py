@@ -1,20 +1,41 @@
 from pydantic import BaseModel, Field
-from datetime import datetime
+from datetime import datetime, timezone
+from typing import Optional
+import hashlib
+import json
+
+def idempotency_key(body: dict):
+    """Identity of a serialized message; the post date changes on every retry, so it is not part of it."""
+    payload = {field: value for field, value in body.items() if field != "postDate"}
+    canonical = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
 
 class Message(BaseModel):
     command: str
+    postDate: Optional[datetime] = None
 
     def set_post_date(self):
-        return datetime.now()
+        self.postDate = datetime.now(timezone.utc)
+        return self.postDate
     
     def to_dict(self):
-        return self.model_dump()
+        return self.model_dump(mode="json")
+
+    def idempotency_key(self):
+        return idempotency_key(self.to_dict())
+
+    def group_id(self):
+        return self.command
 
 
 class MatchUploadMessage(Message):
     command: str = "Match_Upload"
     matchId: str = Field(..., alias="matchId")
 
+    def group_id(self):
+        return f"match-{self.matchId}"
+
 class MergeVideosMessage(Message):
     command: str = "Merge_Video"
     video1: str = Field(..., alias="video1")
@@ -35,3 +56,15 @@ class DownloadVideoRequestMessage(Message):
     command: str = "Download_Video"
     link: str = Field(..., alias="link")
     output_name: str = Field(..., alias="output_name")
+
+
+MESSAGE_TYPES = {
+    "Match_Upload": MatchUploadMessage,
+    "Merge_Video": MergeVideosMessage,
+    "Download_Video": DownloadVideoMessage,
+}
+
+
+def parse_message(body: dict) -> Message:
+    """Rebuilds a received message body; unknown commands come back as a plain Message."""
+    return MESSAGE_TYPES.get(body.get("command"), Message).model_validate(body)
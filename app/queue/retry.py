@@ -0,0 +1,25 @@
+import random
+
+# SQS caps a message's visibility timeout at 12 hours
+MAX_VISIBILITY_TIMEOUT = 12 * 3600
+
+
+class RetryPolicy:
+    """Exponential backoff with jitter for messages that failed for a reason worth retrying.
+
+    A retry is a copy of the message carrying its attempt number and the time it is due,
+    so nothing waits in the worker meanwhile and only real failures count as attempts.
+    """
+
+    def __init__(self, base_delay: int = 60, max_delay: int = 6 * 3600, max_attempts: int = 5):
+        self.base_delay = base_delay
+        self.max_delay = min(max_delay, MAX_VISIBILITY_TIMEOUT)
+        self.max_attempts = max_attempts
+
+    def should_retry(self, attempt: int) -> bool:
+        return attempt < self.max_attempts
+
+    def delay(self, attempt: int) -> int:
+        backoff = min(self.max_delay, self.base_delay * 2 ** max(0, attempt - 1))
+        # equal jitter: at least half the backoff, so messages that failed together spread out without retrying at once
+        return int(backoff / 2 + random.uniform(0, backoff / 2))
@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, List
+from app.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+COMPLETION_BUCKETS = (10, 60, 300, 900, 1800, 3600, 7200, 14400)
+
+
+class ScheduledJob:
+    def __init__(self, key: str, cost: float, payload=None):
+        self.key = key
+        self.cost = cost
+        self.payload = payload
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+
+    def priority(self, now: float, aging_rate: float):
+        # every second spent waiting takes aging_rate seconds off the expected cost, so long jobs still get their turn
+        return self.cost - aging_rate * (now - self.submitted_at)
+
+
+class JobScheduler:
+    """Runs the cheapest buffered job first, aged by how long it has been waiting."""
+
+    def __init__(self, concurrency: int = 1, capacity: int = 10, aging_rate: float = 1.0, name: str = "scheduler"):
+        self.concurrency = concurrency
+        self.capacity = max(capacity, concurrency)
+        self.aging_rate = aging_rate
+        self._pending = []
+        self._running = 0
+        self._tasks = set()
+        # set by drain(): nothing new is dispatched and no room is made for new jobs
+        self.draining = False
+        self._changed = asyncio.Condition()
+        self.wait_seconds = metrics.histogram(f"{name}.wait_seconds", COMPLETION_BUCKETS)
+        self.completion_seconds = metrics.histogram(f"{name}.completion_seconds", COMPLETION_BUCKETS)
+        self.aged_dispatches = metrics.counter(f"{name}.aged_dispatches")
+
+    @property
+    def free_slots(self):
+        return self.capacity - len(self._pending) - self._running
+
+    async def wait_for_room(self):
+        async with self._changed:
+            await self._changed.wait_for(lambda: self.free_slots > 0 or self.draining)
+            return 0 if self.draining else self.free_slots
+
+    async def submit(self, job: ScheduledJob):
+        async with self._changed:
+            self._pending.append(job)
+            self._changed.notify_all()
+
+    def _pick(self):
+        now = time.monotonic()
+        job = min(self._pending, key=lambda j: j.priority(now, self.aging_rate))
+        if job.cost > min(j.cost for j in self._pending):
+            self.aged_dispatches.inc()
+        self._pending.remove(job)
+        return job
+
+    async def run(self, handler: Callable[[ScheduledJob], Awaitable[None]]):
+        try:
+            while True:
+                async with self._changed:
+                    await self._changed.wait_for(
+                        lambda: self._pending and self._running < self.concurrency and not self.draining
+                    )
+                    job = self._pick()
+                    self._running += 1
+                task = asyncio.create_task(self._execute(job, handler))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+        finally:
+            for task in self._tasks:
+                task.cancel()
+
+    async def drain(self) -> List[ScheduledJob]:
+        """Stops dispatching and returns the buffered jobs that never started."""
+        async with self._changed:
+            self.draining = True
+            pending, self._pending = self._pending, []
+            self._changed.notify_all()
+        return pending
+
+    async def wait_idle(self, timeout: float) -> bool:
+        """Waits for running jobs to finish, returns False if some are still running after the timeout."""
+        async with self._changed:
+            try:
+                await asyncio.wait_for(self._changed.wait_for(lambda: self._running == 0), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    async def cancel_running(self):
+        tasks = list(self._tasks)
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _execute(self, job: ScheduledJob, handler):
+        job.started_at = time.monotonic()
+        self.wait_seconds.observe(job.started_at - job.submitted_at)
+        try:
+            await handler(job)
+        except Exception as e:
+            logger.exception(f"Scheduled job {job.key} failed: {e}")
+        finally:
+            self.completion_seconds.observe(time.monotonic() - job.submitted_at)
+            async with self._changed:
+                self._running -= 1
+                self._changed.notify_all()
+
+    def stats(self):
+        completion = self.completion_seconds.snapshot()
+        return {
+            "pending": len(self._pending),
+            "running": self._running,
+            "completed": completion["count"],
+            "mean_completion_seconds": completion["mean"],
+            "mean_wait_seconds": self.wait_seconds.snapshot()["mean"],
+        }
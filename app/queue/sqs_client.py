@@ -1,49 +1,84 @@
-import boto3
+from app.aws import get_boto_client, get_executor
 
 
 class SqsClient:
-    def __init__(self, aws_access_key, aws_secret_key, aws_region, aws_queue_url):
+    def __init__(self, aws_access_key, aws_secret_key, aws_region, aws_queue_url,
+                 max_workers: int = 4, max_pool_connections: int = 10):
         self.access_key = aws_access_key
         self.secret_key = aws_secret_key
         self.region = aws_region
         self.queue_url = aws_queue_url
+        self.is_fifo = aws_queue_url.endswith(".fifo")
+        self.max_pool_connections = max(max_pool_connections, max_workers)
+        self.executor = get_executor('sqs', max_workers)
         self.client = None
 
     def connect(self):
         if not self.client:
-            self.client = boto3.client(
-                'sqs',
-                aws_access_key_id=self.access_key,
-                aws_secret_access_key=self.secret_key,
-                region_name=self.region
+            self.client = get_boto_client(
+                'sqs', self.access_key, self.secret_key, self.region,
+                max_pool_connections=self.max_pool_connections
             )
         return self.client
 
     def get_client(self):
         return self.connect()
 
-    def send_message(self, message):
+    async def send_message(self, message, deduplication_id: str = None, group_id: str = None,
+                           attributes: dict = None, delay_seconds: int = 0):
         client = self.get_client()
-        response = client.send_message(
+        params = {"QueueUrl": self.queue_url, "MessageBody": message}
+        if delay_seconds and not self.is_fifo:
+            # FIFO queues only support a queue-wide delay
+            params["DelaySeconds"] = min(delay_seconds, 900)
+        if attributes:
+            params["MessageAttributes"] = {
+                name: {"DataType": "String", "StringValue": str(value)}
+                for name, value in attributes.items()
+            }
+        if self.is_fifo:
+            params["MessageGroupId"] = group_id or "default"
+            if deduplication_id:
+                params["MessageDeduplicationId"] = deduplication_id
+        response = await self.executor.run(client.send_message, **params)
+        return response
+
+    async def send_message_batch(self, entries):
+        client = self.get_client()
+        response = await self.executor.run(
+            client.send_message_batch,
             QueueUrl=self.queue_url,
-            MessageBody=message
+            Entries=entries
         )
         return response
-    
-    def delete_message(self, receipt_handle):
+
+    async def delete_message(self, receipt_handle):
         client = self.get_client()
-        response = client.delete_message(
+        response = await self.executor.run(
+            client.delete_message,
             QueueUrl=self.queue_url,
             ReceiptHandle=receipt_handle
         )
         return response
-    
-    def receive_message(self):
+
+    async def change_message_visibility(self, receipt_handle, visibility_timeout: int):
+        client = self.get_client()
+        response = await self.executor.run(
+            client.change_message_visibility,
+            QueueUrl=self.queue_url,
+            ReceiptHandle=receipt_handle,
+            VisibilityTimeout=visibility_timeout
+        )
+        return response
+
+    async def receive_message(self, max_messages: int = 1):
         client = self.get_client()
-        response = client.receive_message(
+        response = await self.executor.run(
+            client.receive_message,
             QueueUrl=self.queue_url,
-            MaxNumberOfMessages=1,
+            MaxNumberOfMessages=min(max_messages, 10),
             WaitTimeSeconds=20,
-            VisibilityTimeout=900
+            VisibilityTimeout=900,
+            MessageAttributeNames=["All"]
         )
         return response
@@ -1,56 +1,167 @@
-import boto3
+from boto3.s3.transfer import TransferConfig
 from botocore.exceptions import ClientError
-from starlette.concurrency import run_in_threadpool
+from app.aws import get_boto_client, get_executor
+from app.bandwidth import BandwidthGovernor, TransferClass
+from app.inventory import BucketInventory
+from contextlib import nullcontext
+import asyncio
 import logging
+import os
+import threading
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class S3client:
-    def __init__(self, aws_access_key, aws_secret_key, aws_region, aws_bucket):
+    def __init__(self, aws_access_key, aws_secret_key, aws_region, aws_bucket,
+                 max_workers: int = 8, max_pool_connections: int = 64, transfer_concurrency: int = 8,
+                 transfer_workers: int = 4, governor: BandwidthGovernor = None):
         self.aws_access_key = aws_access_key
         self.aws_secret_key = aws_secret_key
         self.aws_region = aws_region
         self.aws_bucket = aws_bucket
-        self.client = boto3.client('s3', aws_access_key_id=self.aws_access_key, aws_secret_access_key=self.aws_secret_key, region_name=self.aws_region)
+        # every in-flight transfer can hold transfer_concurrency connections of its own
+        self.client = get_boto_client(
+            's3', self.aws_access_key, self.aws_secret_key, self.aws_region,
+            max_pool_connections=max(max_pool_connections, max_workers + transfer_workers * transfer_concurrency)
+        )
+        self.executor = get_executor('s3', max_workers)
+        # file transfers take minutes, on the short-call pool they would hold up metadata calls of the routes
+        self.transfer_executor = get_executor('s3-transfer', transfer_workers)
+        self.transfer_config = TransferConfig(max_concurrency=transfer_concurrency)
+        self.inventory = None
+        self.governor = governor
 
-    async def upload_file(self, file_path: str, object_key: str):
+    def enable_inventory(self, prefix: str = "", cache_path: str = None, refresh_interval: int = 3600):
+        self.inventory = BucketInventory(
+            self.client,
+            self.executor,
+            self.aws_bucket,
+            prefix=prefix,
+            cache_path=cache_path,
+            refresh_interval=refresh_interval
+        )
+        self.inventory.load()
+        return self.inventory
+
+    def get_file_url(self, object_key: str):
+        return f"https://{self.aws_bucket}/{object_key}"
+
+    def _allocate(self, transfer_class: TransferClass):
+        return self.governor.allocate(transfer_class) if self.governor else nullcontext()
+
+    def _transfer_callback(self, progress=None, total: int = None, allocation=None):
+        if not progress and not allocation:
+            return None
+        loop = asyncio.get_running_loop()
+        lock = threading.Lock()
+        state = {"sent": 0}
+
+        # boto3 calls this from its transfer threads, so throttling sleeps the thread and not the loop
+        def callback(bytes_transferred):
+            if progress:
+                with lock:
+                    state["sent"] += bytes_transferred
+                    percent = min(100.0, state["sent"] * 100 / max(total, 1))
+                loop.call_soon_threadsafe(progress, "upload", percent)
+            if allocation:
+                allocation.throttle(bytes_transferred)
+
+        return callback
+
+    async def upload_file(self, file_path: str, object_key: str, metadata: dict = None, progress=None):
         try:
             extra_args = {
                 "ContentType": "video/mp4",
             }
+            if metadata:
+                extra_args["Metadata"] = metadata
 
-            await run_in_threadpool(
-                self.client.upload_file,
-                Filename=file_path,
-                Bucket=self.aws_bucket,
-                Key=object_key,
-                ExtraArgs=extra_args
-            )
+            with self._allocate(TransferClass.UPLOAD) as allocation:
+                await self.transfer_executor.run(
+                    self.client.upload_file,
+                    Filename=file_path,
+                    Bucket=self.aws_bucket,
+                    Key=object_key,
+                    ExtraArgs=extra_args,
+                    Config=self.transfer_config,
+                    Callback=self._transfer_callback(progress, os.path.getsize(file_path), allocation)
+                )
             
-            file_url = f"https://{self.aws_bucket}/{object_key}"
+            if self.inventory:
+                self.inventory.record(object_key, os.path.getsize(file_path))
+            file_url = self.get_file_url(object_key)
             logger.info(f"File uploaded successfully to: {file_url}")
             return file_url
         except Exception as e:
             logger.error(f"Error uploading file: {e}", exc_info=True)
             return None
         
-    async def download_file(self, object_key: str, file_path: str):
+    async def copy_file(self, source_key: str, object_key: str, metadata: dict = None):
+        if metadata is None:
+            # multipart copies do not carry user metadata over, so read it from the source
+            source = await self.head_file(source_key)
+            metadata = source.get("Metadata") if source else None
         try:
-            await run_in_threadpool(
-                self.client.download_file,
+            extra_args = {
+                "ContentType": "video/mp4",
+                "MetadataDirective": "REPLACE",
+            }
+            if metadata:
+                extra_args["Metadata"] = metadata
+
+            await self.transfer_executor.run(
+                self.client.copy,
+                CopySource={"Bucket": self.aws_bucket, "Key": source_key},
                 Bucket=self.aws_bucket,
                 Key=object_key,
-                Filename=file_path,
+                ExtraArgs=extra_args,
+                Config=self.transfer_config
             )
+            if self.inventory and self.inventory.contains(source_key):
+                self.inventory.record(object_key, self.inventory.get(source_key)[0])
+            file_url = self.get_file_url(object_key)
+            logger.info(f"File copied from '{source_key}' to: {file_url}")
+            return file_url
+        except Exception as e:
+            logger.error(f"Error copying file: {e}", exc_info=True)
+            return None
+
+    async def download_file(self, object_key: str, file_path: str):
+        try:
+            with self._allocate(TransferClass.DOWNLOAD) as allocation:
+                await self.transfer_executor.run(
+                    self.client.download_file,
+                    Bucket=self.aws_bucket,
+                    Key=object_key,
+                    Filename=file_path,
+                    Config=self.transfer_config,
+                    Callback=self._transfer_callback(allocation=allocation)
+                )
             return True
         except Exception as e:
             logger.error(f"Error downloading file: {e}", exc_info=True)
             return False
         
+    async def delete_file(self, object_key: str):
+        try:
+            await self.executor.run(self.client.delete_object, Bucket=self.aws_bucket, Key=object_key)
+            return True
+        except Exception as e:
+            logger.error(f"Error deleting file '{object_key}': {e}", exc_info=True)
+            return False
+
+    def _record_head(self, object_key: str, response: dict):
+        if self.inventory and self.inventory.covers(object_key):
+            self.inventory.record(object_key, response.get("ContentLength"), response.get("ETag", "").strip('"'))
+
     async def check_file_exists(self, object_key: str):
+        # only a hit is trusted, keys uploaded by others since the last listing are missing from the inventory
+        if self.inventory and self.inventory.covers(object_key) and self.inventory.contains(object_key):
+            return True
         try:
-            await run_in_threadpool(self.client.head_object, Bucket=self.aws_bucket, Key=object_key)
+            response = await self.executor.run(self.client.head_object, Bucket=self.aws_bucket, Key=object_key)
+            self._record_head(object_key, response)
             logger.info(f"File '{object_key}' found in bucket '{self.aws_bucket}'.")
             return True
         except ClientError as e:
@@ -62,3 +173,39 @@ class S3client:
         except Exception as e:
             logger.error(f"An unexpected error occurred checking if file exists: {e}", exc_info=True)
             return False
+
+    async def head_file(self, object_key: str):
+        try:
+            response = await self.executor.run(self.client.head_object, Bucket=self.aws_bucket, Key=object_key)
+            self._record_head(object_key, response)
+            return response
+        except ClientError as e:
+            if e.response["Error"]["Code"] in ("404", "NoSuchKey"):
+                return None
+            logger.error(f"AWS ClientError reading object metadata: {e}", exc_info=True)
+            return None
+        except Exception as e:
+            logger.error(f"An unexpected error occurred reading object metadata: {e}", exc_info=True)
+            return None
+
+    def generate_presigned_url(self, object_key: str, expires_in: int = 3600, filename: str = None):
+        params = {"Bucket": self.aws_bucket, "Key": object_key}
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        return self.client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires_in)
+
+    async def get_object(self, object_key: str, byte_range: str = None):
+        params = {"Bucket": self.aws_bucket, "Key": object_key}
+        if byte_range:
+            params["Range"] = byte_range
+        return await self.executor.run(self.client.get_object, **params)
+
+    async def iter_object_body(self, body, chunk_size: int = 1024 * 1024):
+        try:
+            while True:
+                chunk = await self.executor.run(body.read, chunk_size)
+                if not chunk:
+                    break
+                yield chunk
+        finally:
+            body.close()
@@ -0,0 +1,103 @@
+import asyncio
+import logging
+import os
+import shutil
+from app.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+RECHECK_INTERVAL = 30
+
+
+def _process_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DiskAdmission:
+    """Admits downloads only while the download volume can hold their expected size.
+
+    Processes sharing the volume can share a ledger directory: each one publishes its
+    reservations there as a file named after its pid and counts those of the others.
+    """
+
+    def __init__(self, path: str, margin_bytes: int = 5 * 1024 ** 3, ledger_dir: str = ""):
+        self.path = path
+        self.margin_bytes = margin_bytes
+        self.reserved = 0
+        self.ledger_dir = ledger_dir
+        self._released = asyncio.Condition()
+        self.waits = metrics.counter("disk_admission.waits")
+        if ledger_dir:
+            os.makedirs(ledger_dir, exist_ok=True)
+            self._ledger_file = os.path.join(ledger_dir, str(os.getpid()))
+            self._publish()
+
+    def _publish(self):
+        if not self.ledger_dir:
+            return
+        tmp_path = f"{self._ledger_file}.tmp"
+        try:
+            with open(tmp_path, "w") as f:
+                f.write(str(self.reserved))
+            os.replace(tmp_path, self._ledger_file)
+        except OSError as e:
+            logger.warning(f"Could not publish disk reservations to {self.ledger_dir}: {e}")
+
+    def _reserved_elsewhere(self):
+        if not self.ledger_dir:
+            return 0
+        total = 0
+        own = str(os.getpid())
+        for name in os.listdir(self.ledger_dir):
+            if not name.isdigit() or name == own:
+                continue
+            entry = os.path.join(self.ledger_dir, name)
+            if not _process_alive(int(name)):
+                # a worker that died released nothing, whatever it wrote already shows in the free space
+                try:
+                    os.remove(entry)
+                except OSError:
+                    pass
+                continue
+            try:
+                with open(entry) as f:
+                    total += int(f.read() or 0)
+            except (OSError, ValueError):
+                continue
+        return total
+
+    def available(self):
+        return shutil.disk_usage(self.path).free - self.reserved - self._reserved_elsewhere() - self.margin_bytes
+
+    async def reserve(self, nbytes: int):
+        waited = False
+        async with self._released:
+            while self.available() < nbytes:
+                if self.reserved == 0 and self._reserved_elsewhere() == 0:
+                    # nothing on this node will free space, waiting could stall the worker forever
+                    logger.warning(f"Admitting {nbytes} bytes with only {self.available()} available on {self.path}")
+                    break
+                if not waited:
+                    waited = True
+                    self.waits.inc()
+                    logger.info(f"Waiting for {nbytes} bytes of disk on {self.path} ({self.reserved} reserved)")
+                try:
+                    # other processes may free space too, so re-check periodically
+                    await asyncio.wait_for(self._released.wait(), timeout=RECHECK_INTERVAL)
+                except asyncio.TimeoutError:
+                    pass
+            self.reserved += nbytes
+            self._publish()
+
+    async def release(self, nbytes: int):
+        async with self._released:
+            self.reserved = max(0, self.reserved - nbytes)
+            self._publish()
+            self._released.notify_all()
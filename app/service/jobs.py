@@ -0,0 +1,352 @@
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from enum import Enum
+from typing import Optional
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo import ASCENDING
+from app.data.leases import LeaseManager
+from app.downloader import PermanentDownloadError
+from app.service.matchdownloader import MatchDownloader
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+JOB_RETENTION_SECONDS = 7 * 24 * 3600
+PROGRESS_PERSIST_INTERVAL = 1.0
+# running jobs heartbeat so followers on other replicas can tell a live job from one orphaned by a restart
+HEARTBEAT_INTERVAL = 30
+STALE_JOB_SECONDS = 180
+# finished downloads are served for this long, then removed from disk and from the staging prefix
+DOWNLOAD_RETENTION_SECONDS = 3600
+DOWNLOAD_STAGING_PREFIX = "jobs"
+
+
+class JobKind(str, Enum):
+    DOWNLOAD = "download"
+    UPLOAD = "upload"
+
+
+class JobStatus(str, Enum):
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+
+
+TERMINAL_JOB_STATUSES = (JobStatus.SUCCEEDED.value, JobStatus.FAILED.value)
+
+
+def job_event(job: dict):
+    return {
+        "job_id": job["_id"],
+        "kind": job.get("kind"),
+        "match_id": job.get("match_id"),
+        "status": job.get("status"),
+        "stage": job.get("stage"),
+        "progress": job.get("progress"),
+        "result": job.get("result"),
+        "error": job.get("error"),
+    }
+
+
+class JobStore:
+    def __init__(self, database: AsyncIOMotorDatabase):
+        self.collection = database.get_collection("jobs")
+
+    async def ensure_indexes(self):
+        await self.collection.create_index("created_at", expireAfterSeconds=JOB_RETENTION_SECONDS)
+        await self.collection.create_index([("match_id", ASCENDING), ("created_at", ASCENDING)])
+        await self.collection.create_index([("owner", ASCENDING), ("status", ASCENDING)])
+        await self.collection.create_index([("status", ASCENDING), ("heartbeat_at", ASCENDING)])
+
+    async def create(self, kind: JobKind, match_id: str, owner: str = None):
+        now = datetime.now(timezone.utc)
+        job = {
+            "_id": uuid.uuid4().hex,
+            "kind": kind.value,
+            "match_id": match_id,
+            "owner": owner,
+            "status": JobStatus.PENDING.value,
+            "stage": None,
+            "progress": None,
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "heartbeat_at": now,
+        }
+        await self.collection.insert_one(job)
+        return job
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        return await self.collection.find_one({"_id": job_id})
+
+    async def update(self, job_id: str, fields: dict):
+        fields = {**fields, "updated_at": datetime.now(timezone.utc)}
+        await self.collection.update_one({"_id": job_id}, {"$set": fields})
+
+    async def heartbeat(self, job_ids):
+        if job_ids:
+            await self.collection.update_many(
+                {"_id": {"$in": list(job_ids)}},
+                {"$set": {"heartbeat_at": datetime.now(timezone.utc)}}
+            )
+
+    async def fail_orphaned(self, owner: str, error: str, job_id: str = None, stale_before: datetime = None):
+        """Fails unfinished jobs whose heartbeat went stale, optionally only those of one owner or a single job."""
+        query = {"status": {"$nin": list(TERMINAL_JOB_STATUSES)}}
+        if owner is not None:
+            query["owner"] = owner
+        if job_id is not None:
+            query["_id"] = job_id
+        if stale_before is not None:
+            query["heartbeat_at"] = {"$lt": stale_before}
+        now = datetime.now(timezone.utc)
+        result = await self.collection.update_many(
+            query,
+            {"$set": {"status": JobStatus.FAILED.value, "error": error, "updated_at": now}}
+        )
+        return result.modified_count
+
+    async def expired_downloads(self, owner: str = None, expired_before: datetime = None):
+        query = {
+            "kind": JobKind.DOWNLOAD.value,
+            "status": JobStatus.SUCCEEDED.value,
+            "result.expires_at": {"$lt": expired_before or datetime.now(timezone.utc)},
+            "result.expired": {"$ne": True},
+        }
+        if owner is not None:
+            query["owner"] = owner
+        cursor = self.collection.find(query)
+        return await cursor.to_list(length=None)
+
+
+class JobManager:
+    def __init__(self, store: JobStore, match_downloader: MatchDownloader, lease_manager: LeaseManager = None,
+                 owner: str = None):
+        self.store = store
+        self.match_downloader = match_downloader
+        self.lease_manager = lease_manager
+        # one per process: API workers on the same host must not take each other's jobs for orphans
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._maintenance = None
+        self._jobs = {}
+        self._tasks = {}
+        self._subscribers = defaultdict(set)
+        self._persist_locks = defaultdict(asyncio.Lock)
+
+    async def start(self):
+        await self._fail_stale_jobs()
+        self._maintenance = asyncio.create_task(self._maintain())
+
+    async def _fail_stale_jobs(self):
+        # live jobs of any process heartbeat, only those whose process went away stop
+        failed = await self.store.fail_orphaned(
+            None, "Job stopped reporting progress, its API instance went away.",
+            stale_before=datetime.now(timezone.utc) - timedelta(seconds=STALE_JOB_SECONDS)
+        )
+        if failed:
+            logger.info(f"Failed {failed} jobs left unfinished by API instances that went away")
+
+    async def stop(self):
+        if self._maintenance:
+            self._maintenance.cancel()
+
+    async def _maintain(self):
+        while True:
+            await asyncio.sleep(HEARTBEAT_INTERVAL)
+            try:
+                await self.store.heartbeat(self._jobs.keys())
+                await self._fail_stale_jobs()
+                await self._expire_downloads()
+            except Exception as e:
+                logger.warning(f"Job maintenance failed: {e}")
+
+    async def _expire_downloads(self):
+        for job in await self.store.expired_downloads(self.owner):
+            result = job.get("result") or {}
+            if result.get("path"):
+                self.match_downloader.release_video(result["path"])
+            if result.get("object_key"):
+                await self.match_downloader.s3_client.delete_file(result["object_key"])
+            await self.store.update(job["_id"], {"result.expired": True, "result.path": None})
+            logger.info(f"Removed the file of download job {job['_id']}")
+
+        # an owner expires its own downloads within a heartbeat; ones left that long after belong to a process
+        # that went away, so only its staging object can be removed, its local file refcounts went with it
+        abandoned_before = datetime.now(timezone.utc) - timedelta(seconds=STALE_JOB_SECONDS)
+        for job in await self.store.expired_downloads(expired_before=abandoned_before):
+            result = job.get("result") or {}
+            if result.get("object_key"):
+                await self.match_downloader.s3_client.delete_file(result["object_key"])
+            await self.store.update(job["_id"], {"result.expired": True})
+            logger.info(f"Removed the staged file of download job {job['_id']} left by {job.get('owner')}")
+
+    async def submit(self, kind: JobKind, match_id: str, force: bool = False):
+        job = await self.store.create(kind, match_id, owner=self.owner)
+        self._jobs[job["_id"]] = job
+        task = asyncio.create_task(self._run(job, force))
+        self._tasks[job["_id"]] = task
+        task.add_done_callback(lambda _: self._forget(job["_id"]))
+        return job
+
+    def _forget(self, job_id: str):
+        self._tasks.pop(job_id, None)
+        self._jobs.pop(job_id, None)
+        self._persist_locks.pop(job_id, None)
+
+    def _publish(self, job: dict):
+        event = job_event(job)
+        for queue in list(self._subscribers[job["_id"]]):
+            queue.put_nowait(event)
+
+    async def _persist(self, job: dict, fields: dict):
+        # tasks start in creation order and the lock is FIFO, so writes for a job never land out of order
+        async with self._persist_locks[job["_id"]]:
+            try:
+                await self.store.update(job["_id"], fields)
+            except Exception as e:
+                logger.warning(f"Could not persist state of job {job['_id']}: {e}")
+
+    async def _set(self, job: dict, **fields):
+        job.update(fields)
+        self._publish(job)
+        # queued as a task behind any progress writes the reporter already scheduled
+        await asyncio.ensure_future(self._persist(job, fields))
+
+    def _reporter(self, job: dict):
+        last_persisted = {"at": 0.0, "stage": None}
+
+        def progress(stage: str, percent: Optional[float]):
+            job["stage"] = stage
+            job["progress"] = round(percent, 1) if percent is not None else None
+            self._publish(job)
+
+            now = time.monotonic()
+            if stage != last_persisted["stage"] or now - last_persisted["at"] >= PROGRESS_PERSIST_INTERVAL:
+                last_persisted.update(at=now, stage=stage)
+                asyncio.ensure_future(self._persist(job, {"stage": job["stage"], "progress": job["progress"]}))
+
+        return progress
+
+    async def _run(self, job: dict, force: bool = False):
+        if job["kind"] != JobKind.UPLOAD.value or not self.lease_manager:
+            await self._execute(job, force, None)
+            return
+        # uploads share the worker's lease so an API upload never races a queued one for the same match
+        async with self.lease_manager.hold(f"match:{job['match_id']}") as lease:
+            if lease is None:
+                await self._set(job, status=JobStatus.FAILED.value,
+                                error="Match video is already being processed by a worker.")
+                return
+            await self._execute(job, force, lease)
+
+    async def _execute(self, job: dict, force: bool, lease):
+        match_id = job["match_id"]
+        progress = self._reporter(job)
+        await self._set(job, status=JobStatus.RUNNING.value)
+
+        try:
+            video_path = await self.match_downloader.download_match_video(match_id, progress=progress, force=force)
+            if not video_path:
+                await self._set(job, status=JobStatus.FAILED.value, error="Match video could not be downloaded.")
+                return
+
+            if job["kind"] == JobKind.DOWNLOAD.value:
+                # staged in the bucket so any replica can serve it, not only the one holding the local file
+                object_key = f"{DOWNLOAD_STAGING_PREFIX}/{job['_id']}/match_{match_id}.mp4"
+                staged = await self.match_downloader.s3_client.upload_file(video_path, object_key, progress=progress)
+                expires_at = datetime.now(timezone.utc) + timedelta(seconds=DOWNLOAD_RETENTION_SECONDS)
+                await self._set(job, status=JobStatus.SUCCEEDED.value, stage="done", progress=100.0,
+                                result={"path": video_path, "object_key": object_key if staged else None,
+                                        "expires_at": expires_at})
+                return
+
+            object_key = self.match_downloader.match_object_key(match_id, video_path)
+            upload_url = await self.match_downloader.upload_match_video(video_path, object_key, progress=progress)
+            if not upload_url:
+                self.match_downloader.release_video(video_path)
+                await self._set(job, status=JobStatus.FAILED.value, error="Failed to upload match video.")
+                return
+
+            if lease and lease.lost:
+                self.match_downloader.release_video(video_path)
+                await self._set(job, status=JobStatus.FAILED.value, error="Lease on the match was lost during upload.")
+                return
+
+            await self.match_downloader.data.update_match_video(match_id, upload_url, object_key)
+            self.match_downloader.release_video(video_path)
+            await self._set(job, status=JobStatus.SUCCEEDED.value, stage="done", progress=100.0,
+                            result={"url": upload_url, "object_key": object_key})
+        except PermanentDownloadError as e:
+            logger.info(f"Job {job['_id']} for match {match_id} failed: {e}")
+            await self._set(job, status=JobStatus.FAILED.value, error=str(e))
+        except Exception as e:
+            logger.exception(f"Job {job['_id']} for match {match_id} failed: {e}")
+            await self._set(job, status=JobStatus.FAILED.value, error=str(e))
+
+    async def get(self, job_id: str) -> Optional[dict]:
+        if job_id in self._jobs:
+            return job_event(self._jobs[job_id])
+        job = await self.store.get(job_id)
+        return job_event(job) if job else None
+
+    @staticmethod
+    def _is_stale(job: dict):
+        beat = job.get("heartbeat_at") or job.get("updated_at")
+        if beat is None:
+            return False
+        age = datetime.now(timezone.utc) - beat.replace(tzinfo=timezone.utc)
+        return age.total_seconds() > STALE_JOB_SECONDS
+
+    async def events(self, job_id: str, poll_interval: float = 2.0, keepalive: float = 15.0):
+        if job_id not in self._jobs:
+            # job belongs to another process: follow it through the store
+            last = None
+            idle = 0.0
+            while True:
+                job = await self.store.get(job_id)
+                if not job:
+                    return
+                if job["status"] not in TERMINAL_JOB_STATUSES and self._is_stale(job):
+                    # the replica running it went away without finishing it
+                    await self.store.fail_orphaned(
+                        None, "Job stopped reporting progress, its API instance went away.", job_id=job_id,
+                        stale_before=datetime.now(timezone.utc) - timedelta(seconds=STALE_JOB_SECONDS)
+                    )
+                    continue
+                event = job_event(job)
+                if event != last:
+                    last = event
+                    idle = 0.0
+                    yield event
+                    if event["status"] in TERMINAL_JOB_STATUSES:
+                        return
+                elif idle >= keepalive:
+                    idle = 0.0
+                    yield None
+                await asyncio.sleep(poll_interval)
+                idle += poll_interval
+
+        queue = asyncio.Queue()
+        self._subscribers[job_id].add(queue)
+        try:
+            event = job_event(self._jobs.get(job_id) or await self.store.get(job_id))
+            yield event
+            while event["status"] not in TERMINAL_JOB_STATUSES:
+                try:
+                    event = await asyncio.wait_for(queue.get(), timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield None
+                    continue
+                yield event
+        finally:
+            self._subscribers[job_id].discard(queue)
+            if not self._subscribers[job_id]:
+                self._subscribers.pop(job_id, None)
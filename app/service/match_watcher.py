@@ -0,0 +1,125 @@
+import asyncio
+import logging
+import time
+from datetime import datetime, timezone
+from motor.motor_asyncio import AsyncIOMotorDatabase
+from pymongo.errors import OperationFailure, PyMongoError
+from app.data.data import Data, is_ingested_video_url, is_known_unavailable
+from app.data.schema import VideoStatus
+from app.queue.messages import MatchUploadMessage
+from app.queue.enqueuer import Enqueuer
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+# ChangeStreamHistoryLost / ChangeStreamFatalError: the stored token fell off the oplog
+LOST_RESUME_TOKEN_CODES = (280, 286)
+
+# the post-batch token keeps moving with the oplog while no change matches the pipeline
+IDLE_TOKEN_SAVE_SECONDS = 60
+
+IN_FLIGHT_STATUSES = (VideoStatus.QUEUED.value, VideoStatus.DOWNLOADING.value)
+
+VIDEO_CHANGE_PIPELINE = [
+    {"$match": {"$or": [
+        {"operationType": {"$in": ["insert", "replace"]}},
+        {"operationType": "update", "updateDescription.updatedFields.match_video": {"$exists": True}},
+        {"operationType": "update", "updateDescription.updatedFields.matchVideo": {"$exists": True}},
+    ]}},
+]
+
+
+class MatchVideoWatcher:
+    def __init__(self, database: AsyncIOMotorDatabase, data: Data, enqueuer: Enqueuer,
+                 name: str = "mergedmatches-video"):
+        self.database = database
+        self.data = data
+        self.enqueuer = enqueuer
+        self.name = name
+        self.tokens = database.get_collection("ingest_resume_tokens")
+
+    async def load_resume_token(self):
+        state = await self.tokens.find_one({"_id": self.name})
+        return state.get("token") if state else None
+
+    async def save_resume_token(self, token):
+        await self.tokens.update_one(
+            {"_id": self.name},
+            {"$set": {"token": token, "updated_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+
+    async def handle_change(self, change: dict):
+        match = change.get("fullDocument")
+        if not match:
+            return False
+
+        match_id = str(match["_id"])
+        video_url = match.get("match_video") or match.get("matchVideo")
+        status = (match.get("video_ingest") or {}).get("status")
+
+        if not video_url:
+            if status is None:
+                await self.data.set_video_status(match_id, VideoStatus.MISSING)
+            return False
+        if is_ingested_video_url(video_url):
+            return False
+        if status in IN_FLIGHT_STATUSES:
+            return False
+        if is_known_unavailable(match.get("video_ingest"), video_url):
+            return False
+
+        message = MatchUploadMessage(matchId=match_id)
+        message.set_post_date()
+        _, duplicate = await self.enqueuer.enqueue(message)
+        if duplicate:
+            return False
+        await self.data.set_video_status(match_id, VideoStatus.QUEUED)
+        logger.info(f"Enqueued match {match_id} from {change['operationType']} change ({video_url})")
+        return True
+
+    async def watch(self):
+        collection = self.database.get_collection("mergedmatches")
+        token = await self.load_resume_token()
+        if token:
+            logger.info(f"Resuming change stream '{self.name}' from stored token")
+        else:
+            logger.info(f"Starting change stream '{self.name}' without a resume token")
+
+        async with collection.watch(
+            VIDEO_CHANGE_PIPELINE,
+            full_document="updateLookup",
+            resume_after=token
+        ) as stream:
+            saved_at = time.monotonic()
+            while stream.alive:
+                change = await stream.try_next()
+                if change is not None:
+                    # a failure here leaves the token before this change, so the restart replays it
+                    await self.handle_change(change)
+                    await self.save_resume_token(stream.resume_token)
+                    saved_at = time.monotonic()
+                elif stream.resume_token and time.monotonic() - saved_at >= IDLE_TOKEN_SAVE_SECONDS:
+                    # keeps a quiet stream's token inside the oplog window
+                    await self.save_resume_token(stream.resume_token)
+                    saved_at = time.monotonic()
+
+    async def run(self, retry_delay: int = 5):
+        while True:
+            try:
+                await self.watch()
+            except OperationFailure as e:
+                if e.code in LOST_RESUME_TOKEN_CODES:
+                    logger.error(
+                        f"Resume token for '{self.name}' is no longer in the oplog, restarting from now. "
+                        f"Run backfill.py to pick up changes made while the watcher was down."
+                    )
+                    await self.tokens.delete_one({"_id": self.name})
+                    continue
+                logger.error(f"Change stream failed: {e}", exc_info=True)
+            except PyMongoError as e:
+                logger.error(f"Change stream interrupted: {e}", exc_info=True)
+            except Exception as e:
+                # e.g. SQS errors from the enqueuer: resume from the last saved token so the change is retried
+                logger.error(f"Failed to handle change, resuming from the last saved token: {e}", exc_info=True)
+            await asyncio.sleep(retry_delay)
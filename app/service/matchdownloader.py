@@ -1,25 +1,71 @@
-from app.data.schema import Match
-from app.downloader import YoutubeDownloader
-from app.data.data import Data
+from app.data.schema import MatchVideoInfo
+from app.downloader import YoutubeDownloader, ProgressCallback, PermanentDownloadError
+from app.data.data import Data, is_known_unavailable
 from app.s3_client import S3client
+from app.checksum import sha256_file
+from app.metrics import metrics
+from app.storage_keys import KeyLayout, key_from_url
+from app.data.data import is_ingested_video_url
+from app.service.single_flight import SingleFlight
+from collections import Counter
+from pathlib import Path
 import re
 import logging
 from moviepy import VideoFileClip, concatenate_videoclips
 import asyncio
+import shutil
 import subprocess
+import tempfile
 import os
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 class MatchDownloader:
-    def __init__(self, youtube_downloader: YoutubeDownloader, data: Data, s3_client: S3client):
+    def __init__(self, youtube_downloader: YoutubeDownloader, data: Data, s3_client: S3client, key_layout: KeyLayout = None,
+                 download_dir: str = "downloads", unavailable_ttl: int = 7 * 24 * 3600,
+                 dedup_min_bytes: int = 64 * 1024 ** 2):
         self.s3_client = s3_client
         self.youtube_downloader = youtube_downloader
         self.data = data
+        self.key_layout = key_layout or KeyLayout()
+        self.download_dir = download_dir
+        self.unavailable_ttl = unavailable_ttl
+        self.dedup_min_bytes = dedup_min_bytes
+        self.downloads = SingleFlight("match_downloads")
+        # callers sharing one coalesced download each hold a reference to the file
+        self._video_refs = Counter()
 
-    async def download_match_video(self, match_id: str):
-        match: Match = await self.data.get_match(match_id)
+    def release_video(self, video_path: str):
+        if not video_path:
+            return
+        self._video_refs[video_path] -= 1
+        if self._video_refs[video_path] > 0:
+            return
+        del self._video_refs[video_path]
+        Path(video_path).unlink(missing_ok=True)
+        try:
+            Path(video_path).parent.rmdir()
+        except OSError:
+            pass
+
+    def match_object_key(self, match_id: str, video_path: str):
+        return self.key_layout.match_key(match_id, os.path.basename(video_path))
+
+    def video_object_key(self, video_path: str):
+        return self.key_layout.video_key(os.path.basename(video_path))
+
+    async def find_ingested_object(self, match_id: str):
+        match: MatchVideoInfo = await self.data.get_match_video_info(match_id)
+        if not match or not is_ingested_video_url(match.match_video):
+            return None
+        object_key = match.match_video_key or key_from_url(match.match_video, self.s3_client.aws_bucket)
+        if object_key and await self.s3_client.check_file_exists(object_key):
+            return object_key
+        return None
+
+    async def download_match_video(self, match_id: str, progress: ProgressCallback = None, force: bool = False):
+        match: MatchVideoInfo = await self.data.get_match_video_info(match_id)
         if not match:
             logger.info(f"No match found for {match_id}")
             return None
@@ -33,6 +79,12 @@ class MatchDownloader:
             logger.info(f"No video URL for match {match_id}")
             return None
 
+        if not force and is_known_unavailable(match.video_ingest, video_url):
+            raise PermanentDownloadError(
+                match.video_ingest.get("unavailable_reason") or "unknown",
+                f"recorded until {match.video_ingest.get('unavailable_until')}"
+            )
+
         try:
             date_only = date_str.split("T")[0].replace("/", "-")
         except Exception:
@@ -41,27 +93,114 @@ class MatchDownloader:
         home_clean = re.sub(r'[^A-Za-z0-9]', '', home_team)
         away_clean = re.sub(r'[^A-Za-z0-9]', '', away_team)
 
-        filename = f"{home_clean}V{away_clean}-{date_only}"
+        # each match downloads into its own directory so equal team/date names never share a file
+        work_dir = os.path.join(self.download_dir, match_id)
+        filename = os.path.join(work_dir, f"{home_clean}V{away_clean}-{date_only}")
         logger.info(f"Downloading video for match {match_id} as {filename}")
 
+        async def download(report):
+            os.makedirs(work_dir, exist_ok=True)
+            return await self.youtube_downloader.download(url=video_url, filename=filename, progress=report)
+
+        keys = [f"match:{match_id}", f"url:{self.youtube_downloader.normalize_url(video_url)}"]
         try:
-            video = await self.youtube_downloader.download(url=video_url, filename=filename)
-            return video
+            video = await self.downloads.run(keys, download, progress=progress)
+        except PermanentDownloadError as e:
+            logger.info(f"Video of match {match_id} is unavailable ({e.reason}), skipping it for {self.unavailable_ttl}s")
+            await self.data.mark_video_unavailable(match_id, video_url, e.reason, self.unavailable_ttl)
+            raise
         except Exception as e:
             logger.info(f"Failed to download video for match {match_id}: {e}")
             return None
+
+        if video and Path(video).stem != os.path.basename(filename):
+            # joined another match's download of the same URL, whose file carries that match's teams and date
+            video = await self._link_as(video, filename)
+        if video:
+            self._video_refs[video] += 1
+        return video
+
+    async def _link_as(self, video: str, filename: str):
+        target = f"{filename}{Path(video).suffix}"
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        if os.path.exists(target):
+            os.remove(target)
+        try:
+            # linked right away, before the other match's caller can release its file
+            os.link(video, target)
+        except OSError:
+            await asyncio.to_thread(shutil.copyfile, video, target)
+        return str(Path(target).absolute())
     
-    async def upload_match_video(self, file_path: str, object_key: str):
-        return await self.s3_client.upload_file(file_path, object_key)
+    async def upload_match_video(self, file_path: str, object_key: str, progress: ProgressCallback = None):
+        size = os.path.getsize(file_path)
+        if size < self.dedup_min_bytes:
+            file_url = await self.s3_client.upload_file(file_path, object_key, progress=progress)
+            if file_url:
+                metrics.counter("upload_dedup.uploaded").inc()
+                metrics.counter("upload_dedup.bytes_uploaded").inc(size)
+            return file_url
+
+        # hashing reads the whole file again, it waits for a transfer thread like the upload it precedes
+        checksum, size = await self.s3_client.transfer_executor.run(sha256_file, file_path)
+        metadata = {"sha256": checksum}
+
+        existing = await self.s3_client.head_file(object_key)
+        if existing and existing.get("Metadata", {}).get("sha256") == checksum:
+            self._record_bytes_saved("skipped", size)
+            logger.info(f"Skipping upload of {object_key}, identical content already in bucket ({size} bytes saved)")
+            await self.data.save_video_checksum(checksum, object_key, size)
+            return self.s3_client.get_file_url(object_key)
+
+        known = await self.data.get_video_by_checksum(checksum)
+        source_key = known.get("object_key") if known else None
+        if source_key and source_key != object_key:
+            source = await self.s3_client.head_file(source_key)
+            if source and source.get("Metadata", {}).get("sha256") == checksum:
+                file_url = await self.s3_client.copy_file(source_key, object_key, metadata=metadata)
+                if file_url:
+                    self._record_bytes_saved("copied", size)
+                    logger.info(f"Copied {source_key} to {object_key} server-side ({size} bytes saved)")
+                    return file_url
+
+        file_url = await self.s3_client.upload_file(file_path, object_key, metadata=metadata, progress=progress)
+        if file_url:
+            metrics.counter("upload_dedup.uploaded").inc()
+            metrics.counter("upload_dedup.bytes_uploaded").inc(size)
+            await self.data.save_video_checksum(checksum, object_key, size)
+        return file_url
+
+    def _record_bytes_saved(self, outcome: str, size: int):
+        metrics.counter(f"upload_dedup.{outcome}").inc()
+        metrics.counter("upload_dedup.bytes_saved").inc(size)
+
+    def _job_dir(self, kind: str):
+        # merges and plain downloads run concurrently, each writes into its own directory
+        os.makedirs(self.download_dir, exist_ok=True)
+        return tempfile.mkdtemp(prefix=f"{kind}-", dir=self.download_dir)
+
+    def discard_job_files(self, path: str):
+        """Removes the work directory a merge or plain download wrote its files into."""
+        if path:
+            shutil.rmtree(os.path.dirname(path), ignore_errors=True)
 
     async def merge_videos(self, video1: str, video2: str, output_name: str = None):
-        video1_path = await self.youtube_downloader.download(video1, filename="vid1")
-        video2_path = await self.youtube_downloader.download(video2, filename="vid2")
-        
-        if output_name is None:
-            output_name = "merged_video.mp4"
+        work_dir = self._job_dir("merge")
+        try:
+            return await self._merge_videos(work_dir, video1, video2, output_name)
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+
+    async def _merge_videos(self, work_dir: str, video1: str, video2: str, output_name: str = None):
+        video1_path = await self.youtube_downloader.download(video1, filename=os.path.join(work_dir, "vid1"))
+        video2_path = await self.youtube_downloader.download(video2, filename=os.path.join(work_dir, "vid2"))
+        if not video1_path or not video2_path:
+            raise RuntimeError("Could not download both videos to merge")
 
-        list_path = "inputs.txt"
+        output_path = os.path.join(work_dir, os.path.basename(output_name or "merged_video.mp4"))
+
+        list_path = os.path.join(work_dir, "inputs.txt")
         with open(list_path, "w") as f:
             f.write(f"file '{os.path.abspath(video1_path)}'\n")
             f.write(f"file '{os.path.abspath(video2_path)}'\n")
@@ -69,7 +208,7 @@ class MatchDownloader:
         try:
             cmd = [
                 "ffmpeg", "-y", "-f", "concat", "-safe", "0", 
-                "-i", list_path, "-c", "copy", output_name
+                "-i", list_path, "-c", "copy", output_path
             ]
             
             process = await asyncio.create_subprocess_exec(
@@ -86,7 +225,7 @@ class MatchDownloader:
             final_clip = concatenate_videoclips([clip1, clip2])
             
             final_clip.write_videofile(
-                output_name, 
+                output_path, 
                 codec="libx264", 
                 audio_codec="aac", 
                 threads=8, 
@@ -101,11 +240,20 @@ class MatchDownloader:
             if os.path.exists(list_path):
                 os.remove(list_path)
 
-        return output_name, video2_path, video1_path
+        return output_path, video2_path, video1_path
 
     async def download_video(self, link: str, output_name: str = None):
         logger.info(f"Downloading video for match {link}")
-        path = await self.youtube_downloader.download(link, filename=output_name)
+        work_dir = self._job_dir("download")
+        try:
+            path = await self.youtube_downloader.download(
+                link, filename=os.path.join(work_dir, os.path.basename(output_name or "video"))
+            )
+        except BaseException:
+            shutil.rmtree(work_dir, ignore_errors=True)
+            raise
+        if not path:
+            shutil.rmtree(work_dir, ignore_errors=True)
         return path
 
         
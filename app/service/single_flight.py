@@ -0,0 +1,78 @@
+import asyncio
+import logging
+from app.metrics import metrics
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    def __init__(self, keys):
+        self.keys = keys
+        self.task = None
+        self.listeners = []
+        self.last_progress = None
+        self.waiters = 0
+
+    def report(self, stage, percent):
+        self.last_progress = (stage, percent)
+        for listener in list(self.listeners):
+            try:
+                listener(stage, percent)
+            except Exception as e:
+                logger.warning(f"Progress listener failed: {e}")
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._flights = {}
+        self.leaders = metrics.counter(f"{name}.leaders")
+        self.followers = metrics.counter(f"{name}.followers")
+
+    def find(self, keys):
+        for key in keys:
+            if key and key in self._flights:
+                return self._flights[key]
+        return None
+
+    async def run(self, keys, fn, progress=None):
+        keys = [key for key in keys if key]
+        flight = self.find(keys)
+
+        if flight is None:
+            flight = Flight(keys)
+            for key in keys:
+                self._flights[key] = flight
+            # the shared work runs in its own task so one caller going away does not cancel it for the rest
+            flight.task = asyncio.create_task(fn(flight.report))
+            flight.task.add_done_callback(lambda _: self._finish(flight))
+            self.leaders.inc()
+        else:
+            logger.info(f"[{self.name}] Joining in-flight work for {keys}")
+            self.followers.inc()
+            if progress and flight.last_progress:
+                progress(*flight.last_progress)
+
+        if progress:
+            flight.listeners.append(progress)
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if flight.waiters == 1:
+                # the last caller went away (e.g. a draining worker), nobody is left to use the result
+                flight.task.cancel()
+                await asyncio.gather(flight.task, return_exceptions=True)
+            raise
+        finally:
+            flight.waiters -= 1
+            if progress in flight.listeners:
+                flight.listeners.remove(progress)
+
+    def _finish(self, flight: Flight):
+        for key in flight.keys:
+            if self._flights.get(key) is flight:
+                del self._flights[key]
+        if not flight.task.cancelled():
+            flight.task.exception()
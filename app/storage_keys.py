@@ -0,0 +1,47 @@
+import hashlib
+from urllib.parse import urlparse, unquote
+
+KEY_SCHEMES = ("flat", "sharded")
+
+
+class KeyLayout:
+    def __init__(self, scheme: str = "sharded", prefix: str = "matches", shard_chars: int = 2):
+        if scheme not in KEY_SCHEMES:
+            raise ValueError(f"Unknown S3 key scheme '{scheme}', expected one of {KEY_SCHEMES}")
+        self.scheme = scheme
+        self.prefix = prefix.strip("/")
+        self.shard_chars = shard_chars
+
+    def _shard(self, value: str):
+        return hashlib.md5(value.encode("utf-8")).hexdigest()[:self.shard_chars]
+
+    def _join(self, *parts):
+        return "/".join(part for part in parts if part)
+
+    def match_prefix(self, match_id: str):
+        return self._join(self.prefix, self._shard(match_id), match_id) + "/"
+
+    def match_key(self, match_id: str, filename: str):
+        if self.scheme == "flat":
+            return filename
+        return self.match_prefix(match_id) + filename
+
+    def video_key(self, filename: str):
+        if self.scheme == "flat":
+            return filename
+        return self._join(self.prefix, self._shard(filename), filename)
+
+
+def key_from_url(url: str, bucket: str):
+    if not url:
+        return None
+    parsed = urlparse(url)
+    host = parsed.netloc
+    path = unquote(parsed.path).lstrip("/")
+
+    if host == bucket or host.startswith(f"{bucket}.s3"):
+        return path or None
+    if host.startswith("s3.") or host.startswith("s3-") or host == "s3.amazonaws.com":
+        if path.startswith(f"{bucket}/"):
+            return path[len(bucket) + 1:] or None
+    return None
@@ -0,0 +1,276 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.config import Settings
+from app.data.data import Data
+from app.data.schema import VideoStatus
+from app.queue.messages import MatchUploadMessage
+from app.queue.sqs_client import SqsClient
+from app.downloader import YoutubeDownloader
+from app.queue.enqueuer import Enqueuer
+from app.queue.lanes import LaneRouter, lane_queue_clients
+from app.rate_limiter import TokenBucket
+from app.s3_client import S3client
+from app.storage_keys import KeyLayout
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+SQS_BATCH_SIZE = 10
+
+
+class Checkpoint:
+    def __init__(self, path: str):
+        self.path = path
+        self.state = {"last_id": None, "enqueued": 0, "duplicates": 0, "skipped": 0, "failed": 0, "pages": 0,
+                      "failed_ids": []}
+
+    def load(self):
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.state.update(json.load(f))
+            logger.info(f"Resuming backfill from checkpoint {self.path}: {self.state}")
+
+    def save(self):
+        self.state["updated_at"] = datetime.now(timezone.utc).isoformat()
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.state, f)
+        os.replace(tmp_path, self.path)
+
+    def reset(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+
+class Backfill:
+    def __init__(self, data: Data, enqueuer: Enqueuer, checkpoint: Checkpoint, concurrency: int,
+                 rate_limiter: TokenBucket, s3_client: S3client = None, key_layout: KeyLayout = None,
+                 retry_unavailable: bool = False):
+        self.data = data
+        self.enqueuer = enqueuer
+        self.checkpoint = checkpoint
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.rate_limiter = rate_limiter
+        self.s3_client = s3_client
+        self.key_layout = key_layout
+        self.retry_unavailable = retry_unavailable
+
+    def _already_uploaded(self, match_id: str):
+        inventory = self.s3_client.inventory if self.s3_client else None
+        if not inventory or not inventory.is_loaded:
+            return False
+        return inventory.has_directory(self.key_layout.match_prefix(match_id))
+
+    async def _send_batch(self, matches):
+        messages = []
+        for match in matches:
+            message = MatchUploadMessage(matchId=match["_id"])
+            message.set_post_date()
+            messages.append(message)
+
+        # the page already carries the video url, so lanes are classified without another lookup
+        router = self.enqueuer.router
+        lanes = [router.lane_for_url(match.get("match_video")) for match in matches] if router else None
+
+        async with self.semaphore:
+            await self.rate_limiter.acquire(len(messages))
+            try:
+                results = await self.enqueuer.enqueue_batch(messages, lanes=lanes)
+            except Exception as e:
+                logger.error(f"Batch enqueue failed: {e}")
+                return [], [], [match["_id"] for match in matches]
+
+        sent, duplicates, failed = [], [], []
+        for match, (message_id, duplicate) in zip(matches, results):
+            if duplicate:
+                duplicates.append(match["_id"])
+            elif message_id:
+                sent.append(match["_id"])
+            else:
+                failed.append(match["_id"])
+        return sent, duplicates, failed
+
+    async def run_page(self, page, advance: bool = True):
+        if not page:
+            return
+        state = self.checkpoint.state
+        candidates = []
+        for match in page:
+            if not match.get("match_video") or self._already_uploaded(match["_id"]):
+                state["skipped"] += 1
+            else:
+                candidates.append(match)
+
+        batches = [candidates[i:i + SQS_BATCH_SIZE] for i in range(0, len(candidates), SQS_BATCH_SIZE)]
+        results = await asyncio.gather(*(self._send_batch(batch) for batch in batches))
+
+        sent = [match_id for batch_sent, _, _ in results for match_id in batch_sent]
+        duplicates = [match_id for _, batch_duplicates, _ in results for match_id in batch_duplicates]
+        failed = [match_id for _, _, batch_failed in results for match_id in batch_failed]
+        await self.data.set_video_status_many(sent, VideoStatus.QUEUED)
+
+        state["enqueued"] += len(sent)
+        state["duplicates"] += len(duplicates)
+        state["failed"] += len(failed)
+        # the cursor moves on regardless, failed sends are replayed by the next run
+        state["failed_ids"] = state.get("failed_ids", []) + failed
+        state["pages"] += 1
+        if advance:
+            state["last_id"] = page[-1]["_id"]
+        self.checkpoint.save()
+
+    async def replay_failed(self):
+        failed_ids = self.checkpoint.state.get("failed_ids") or []
+        if not failed_ids:
+            return
+        self.checkpoint.state["failed_ids"] = []
+        matches = await self.data.get_matches_by_ids(failed_ids)
+        page = [{"_id": match.id, "match_video": match.match_video} for match in matches.values()]
+        logger.info(f"Replaying {len(page)} matches whose enqueue failed in an earlier run")
+        await self.run_page(page, advance=False)
+
+    async def run(self, page_size: int, limit: int = None):
+        started = time.monotonic()
+        processed = 0
+        if limit is not None and limit <= 0:
+            return self.checkpoint.state
+        await self.replay_failed()
+        async for page in self.data.iter_backlog_pages(
+            self.checkpoint.state["last_id"], page_size, include_unavailable=self.retry_unavailable
+        ):
+            if limit is not None:
+                page = page[:limit - processed]
+            await self.run_page(page)
+            processed += len(page)
+            rate = processed / max(time.monotonic() - started, 1e-6)
+            logger.info(f"Backfill progress: {self.checkpoint.state} ({rate:.1f} matches/s)")
+            if limit is not None and processed >= limit:
+                break
+        else:
+            # pass complete: the next run starts again from the newest match instead of finding nothing below last_id
+            logger.info("Backfill reached the oldest backlog match, clearing the cursor")
+            self.checkpoint.state["last_id"] = None
+            self.checkpoint.save()
+        return self.checkpoint.state
+
+
+async def run(args):
+    settings = Settings()
+
+    sqs_client = SqsClient(
+        aws_access_key=settings.aws_access_key,
+        aws_region=settings.aws_region,
+        aws_secret_key=settings.aws_secret_key,
+        aws_queue_url=settings.sqs_queue_url,
+        max_workers=max(settings.sqs_max_workers, args.concurrency),
+        max_pool_connections=max(settings.sqs_max_pool_connections, args.concurrency)
+    )
+
+    mongodb_client = AsyncIOMotorClient(settings.database_connection_string)
+    mongodb = mongodb_client[settings.database_name]
+    data_service = Data(database=mongodb, backlog_stuck_after=settings.backlog_stuck_after_seconds)
+    await data_service.ensure_indexes()
+
+    checkpoint = Checkpoint(args.checkpoint)
+    if args.reset:
+        checkpoint.reset()
+    checkpoint.load()
+
+    if args.dry_run:
+        backlog = await data_service.matches_count(include_unavailable=args.retry_unavailable)
+        remaining = backlog
+        if checkpoint.state["last_id"] is not None:
+            remaining = await data_service.matches_count(
+                include_unavailable=args.retry_unavailable,
+                before_id=checkpoint.state["last_id"]
+            )
+            remaining += len(checkpoint.state.get("failed_ids") or [])
+        # what this run would send: a resumed run only covers the rest, --limit stops it earlier
+        to_send = remaining if args.limit is None else min(remaining, max(args.limit, 0))
+        batches = -(-to_send // SQS_BATCH_SIZE)
+        print(f"Backlog matches: {backlog}")
+        print(f"Remaining from checkpoint: {remaining}")
+        print(f"Estimated SendMessageBatch calls: {batches}")
+        if args.rate:
+            print(f"Estimated duration at {args.rate} msg/s: {to_send / args.rate / 60:.1f} min")
+        mongodb_client.close()
+        return
+
+    s3_client = None
+    key_layout = None
+    if args.skip_existing:
+        s3_client = S3client(
+            aws_access_key=settings.aws_access_key,
+            aws_secret_key=settings.aws_secret_key,
+            aws_region=settings.aws_region,
+            aws_bucket=settings.aws_bucket,
+            max_workers=settings.s3_max_workers,
+            max_pool_connections=settings.s3_max_pool_connections,
+            transfer_concurrency=settings.s3_transfer_concurrency,
+            transfer_workers=settings.s3_transfer_workers
+        )
+        key_layout = KeyLayout(
+            scheme=settings.s3_key_scheme,
+            prefix=settings.s3_key_prefix,
+            shard_chars=settings.s3_key_shard_chars
+        )
+        inventory = s3_client.enable_inventory(
+            prefix=settings.s3_inventory_prefix,
+            cache_path=settings.s3_inventory_cache_path,
+            refresh_interval=settings.s3_inventory_refresh_seconds
+        )
+        if inventory.is_stale:
+            await inventory.refresh()
+
+    router = LaneRouter(
+        data=data_service,
+        youtube_downloader=YoutubeDownloader(),
+        default_client=sqs_client,
+        clients=lane_queue_clients(settings, max_workers=max(settings.sqs_max_workers, args.concurrency))
+    )
+    enqueuer = Enqueuer(
+        sqs_client=sqs_client,
+        database=mongodb,
+        dedup_window=settings.enqueue_dedup_window_seconds,
+        router=router
+    )
+    await enqueuer.ensure_indexes()
+
+    backfill = Backfill(
+        data=data_service,
+        enqueuer=enqueuer,
+        checkpoint=checkpoint,
+        concurrency=args.concurrency,
+        rate_limiter=TokenBucket(args.rate, capacity=max(args.rate, SQS_BATCH_SIZE)),
+        s3_client=s3_client,
+        key_layout=key_layout,
+        retry_unavailable=args.retry_unavailable
+    )
+    state = await backfill.run(args.page_size, args.limit)
+    print(state)
+
+    mongodb_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Enqueue every match in the video backlog for upload.")
+    parser.add_argument("--page-size", type=int, default=500, help="Matches read from Mongo per page.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent SendMessageBatch calls.")
+    parser.add_argument("--rate", type=float, default=50, help="Maximum messages per second, 0 for unlimited.")
+    parser.add_argument("--limit", type=int, default=None, help="Stop after this many matches.")
+    parser.add_argument("--checkpoint", default="backfill_checkpoint.json", help="Checkpoint file used to resume.")
+    parser.add_argument("--reset", action="store_true", help="Ignore and delete an existing checkpoint.")
+    parser.add_argument("--skip-existing", action="store_true",
+                        help="Skip matches that already have objects under their S3 key prefix.")
+    parser.add_argument("--retry-unavailable", action="store_true",
+                        help="Also enqueue matches whose video was recorded as permanently unavailable.")
+    parser.add_argument("--dry-run", action="store_true", help="Print estimated counts without enqueueing.")
+    args = parser.parse_args()
+
+    asyncio.run(run(args))
@@ -0,0 +1,94 @@
+import argparse
+import os
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime
+
+from bson import ObjectId
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.data.schema import Match, MatchVideoInfo, MATCH_VIDEO_INFO_PROJECTION
+
+
+def build_player(i: int):
+    return {
+        "playerId": ObjectId(),
+        "name": f"Player {i}",
+        "shirtNumber": i,
+        "position": "MF",
+        "isCaptain": i == 1,
+        "minutesPlayed": 90,
+    }
+
+
+def build_document():
+    return {
+        "_id": ObjectId(),
+        "homeTeam": ObjectId(),
+        "awayTeam": ObjectId(),
+        "seasonId": ObjectId(),
+        "competitionId": ObjectId(),
+        "homeTeamString": "Home United",
+        "awayTeamString": "Away Rovers",
+        "homeGoals": 2,
+        "awayGoals": 1,
+        "homeTeamLineUp": [build_player(i) for i in range(11)],
+        "awayTeamLineUp": [build_player(i) for i in range(11)],
+        "homeTeamSubs": [build_player(i) for i in range(7)],
+        "awayTeamSubs": [build_player(i) for i in range(7)],
+        "homeSubstitutions": [{"in": ObjectId(), "out": ObjectId(), "minute": 60 + i} for i in range(5)],
+        "awaySubstitutions": [{"in": ObjectId(), "out": ObjectId(), "minute": 60 + i} for i in range(5)],
+        "homeTeamTaggerId": ObjectId(),
+        "awayTeamTaggerId": ObjectId(),
+        "homeTeamTagDate": datetime.utcnow(),
+        "awayTeamTagDate": datetime.utcnow(),
+        "matchStartTime": "15:00",
+        "stadium": "Main Stadium",
+        "date": "2024-05-12T15:00:00",
+        "match_video": "https://www.youtube.com/watch?v=dQw4w9WgXcQ",
+        "hasVideo": True,
+    }
+
+
+def project(document):
+    return {key: value for key, value in document.items() if key in MATCH_VIDEO_INFO_PROJECTION}
+
+
+def measure_peak_allocation(fn, iterations: int):
+    tracemalloc.start()
+    for _ in range(iterations):
+        fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def run(iterations: int):
+    document = build_document()
+    projected = project(document)
+
+    cases = {
+        "full Match": lambda: Match(**document),
+        "projected MatchVideoInfo": lambda: MatchVideoInfo(**projected),
+    }
+
+    print(f"{'case':<28}{'us/lookup':>12}{'peak alloc (B)':>18}")
+    results = {}
+    for name, fn in cases.items():
+        fn()
+        seconds = min(timeit.repeat(fn, number=iterations, repeat=5)) / iterations
+        peak = measure_peak_allocation(fn, 100)
+        results[name] = seconds
+        print(f"{name:<28}{seconds * 1e6:>12.2f}{peak:>18}")
+
+    print(f"document keys: full={len(document)} projected={len(projected)}")
+    print(f"speedup: {results['full Match'] / results['projected MatchVideoInfo']:.1f}x")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare full Match validation with the slim projected read model.")
+    parser.add_argument("--iterations", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.iterations)
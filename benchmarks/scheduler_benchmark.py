@@ -0,0 +1,85 @@
+import argparse
+import asyncio
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.queue.scheduler import JobScheduler, ScheduledJob
+
+
+def build_workload(jobs: int, long_share: float, seed: int):
+    rng = random.Random(seed)
+    workload = []
+    arrival = 0.0
+    for i in range(jobs):
+        if rng.random() < long_share:
+            # tor youtube matches
+            cost = rng.uniform(3600, 7200)
+        else:
+            # direct veo/pixellot downloads
+            cost = rng.uniform(120, 600)
+        workload.append((arrival, cost))
+        arrival += rng.expovariate(1 / 600)
+    return workload
+
+
+async def simulate(workload, concurrency: int, capacity: int, aging_rate: float, scale: float, name: str):
+    # one simulated second lasts `scale` real seconds, aging is expressed per real second accordingly
+    scheduler = JobScheduler(concurrency=concurrency, capacity=capacity, aging_rate=aging_rate / scale, name=name)
+    completions = []
+
+    async def handler(job: ScheduledJob):
+        await asyncio.sleep(job.cost * scale)
+        completions.append((asyncio.get_running_loop().time() - job.payload) / scale)
+
+    dispatcher = asyncio.create_task(scheduler.run(handler))
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    for i, (arrival, cost) in enumerate(workload):
+        await asyncio.sleep(max(0.0, started + arrival * scale - loop.time()))
+        job = ScheduledJob(str(i), cost, payload=loop.time())
+        await scheduler.wait_for_room()
+        await scheduler.submit(job)
+
+    while len(completions) < len(workload):
+        await asyncio.sleep(scale * 10)
+    dispatcher.cancel()
+
+    completions.sort()
+    return {
+        "mean": sum(completions) / len(completions),
+        "p50": completions[len(completions) // 2],
+        "p95": completions[int(len(completions) * 0.95)],
+        "max": completions[-1],
+    }
+
+
+async def run(args):
+    workload = build_workload(args.jobs, args.long_share, args.seed)
+    policies = {
+        # a huge aging rate makes the oldest job win every time
+        "fifo": 1e9,
+        "sjf + aging": args.aging_rate,
+        "sjf, no aging": 0.0,
+    }
+
+    print(f"{'policy':<16}{'mean (s)':>12}{'p50 (s)':>12}{'p95 (s)':>12}{'max (s)':>12}")
+    for name, aging_rate in policies.items():
+        result = await simulate(workload, args.concurrency, args.capacity, aging_rate, args.scale,
+                                name=f"benchmark.{name}")
+        print(f"{name:<16}{result['mean']:>12.0f}{result['p50']:>12.0f}{result['p95']:>12.0f}{result['max']:>12.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Simulate mean job completion time of the worker scheduler under mixed load.")
+    parser.add_argument("--jobs", type=int, default=60)
+    parser.add_argument("--long-share", type=float, default=0.15, help="Fraction of multi-hour jobs.")
+    parser.add_argument("--concurrency", type=int, default=2)
+    parser.add_argument("--capacity", type=int, default=10, help="Messages buffered on the worker.")
+    parser.add_argument("--aging-rate", type=float, default=1.0)
+    parser.add_argument("--scale", type=float, default=0.0001, help="Real seconds per simulated second.")
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    asyncio.run(run(args))
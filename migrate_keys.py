@@ -0,0 +1,96 @@
+import argparse
+import asyncio
+import os
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.config import Settings
+from app.data.data import Data
+from app.s3_client import S3client
+from app.storage_keys import KeyLayout, key_from_url
+
+
+async def migrate_match(match, data_service, s3_client, key_layout, semaphore, stats, dry_run):
+    match_id = str(match["_id"])
+    old_key = match.get("match_video_key") or key_from_url(match.get("match_video"), s3_client.aws_bucket)
+    if not old_key:
+        stats["skipped"] += 1
+        return
+
+    new_key = key_layout.match_key(match_id, os.path.basename(old_key))
+    if new_key == old_key:
+        stats["already_migrated"] += 1
+        return
+
+    if dry_run:
+        print(f"{match_id}: {old_key} -> {new_key}")
+        stats["migrated"] += 1
+        return
+
+    async with semaphore:
+        file_url = await s3_client.copy_file(old_key, new_key)
+    if not file_url:
+        stats["failed"] += 1
+        return
+
+    await data_service.update_match_video(match_id, file_url, new_key)
+    stats["migrated"] += 1
+
+
+async def run(concurrency: int, dry_run: bool):
+    settings = Settings()
+
+    s3_client = S3client(
+        aws_access_key=settings.aws_access_key,
+        aws_secret_key=settings.aws_secret_key,
+        aws_region=settings.aws_region,
+        aws_bucket=settings.aws_bucket,
+        max_workers=concurrency,
+        max_pool_connections=settings.s3_max_pool_connections,
+        transfer_concurrency=settings.s3_transfer_concurrency,
+        # every migration is a copy, so copies get the concurrency
+        transfer_workers=concurrency
+    )
+    key_layout = KeyLayout(
+        scheme=settings.s3_key_scheme,
+        prefix=settings.s3_key_prefix,
+        shard_chars=settings.s3_key_shard_chars
+    )
+
+    mongodb_client = AsyncIOMotorClient(settings.database_connection_string)
+    mongodb = mongodb_client[settings.database_name]
+    data_service = Data(database=mongodb)
+
+    semaphore = asyncio.Semaphore(concurrency)
+    stats = {"migrated": 0, "already_migrated": 0, "skipped": 0, "failed": 0}
+
+    def collect(done):
+        # asyncio.wait leaves exceptions on the tasks, unread they would only show up as a warning at exit
+        for task in done:
+            if task.exception() is not None:
+                print(f"Migration failed: {task.exception()!r}")
+                stats["failed"] += 1
+
+    # copies are bounded by the semaphore, the pending set only keeps the window of tasks in memory
+    pending = set()
+    async for match in data_service.iter_ingested_matches():
+        pending.add(asyncio.create_task(
+            migrate_match(match, data_service, s3_client, key_layout, semaphore, stats, dry_run)
+        ))
+        if len(pending) >= concurrency * 4:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            collect(done)
+
+    if pending:
+        done, _ = await asyncio.wait(pending)
+        collect(done)
+
+    print(stats)
+    mongodb_client.close()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Copy existing match videos to the configured S3 key layout.")
+    parser.add_argument("--concurrency", type=int, default=16, help="Parallel server-side copies.")
+    parser.add_argument("--dry-run", action="store_true", help="Print the key mapping without copying.")
+    args = parser.parse_args()
+
+    asyncio.run(run(args.concurrency, args.dry_run))
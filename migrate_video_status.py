@@ -0,0 +1,22 @@
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.config import Settings
+from app.data.data import Data
+
+
+async def run():
+    settings = Settings()
+
+    mongodb_client = AsyncIOMotorClient(settings.database_connection_string)
+    mongodb = mongodb_client[settings.database_name]
+    data_service = Data(database=mongodb)
+
+    await data_service.ensure_indexes()
+    counts = await data_service.backfill_video_status()
+    print(counts)
+
+    mongodb_client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
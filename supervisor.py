@@ -0,0 +1,119 @@
+# Runs WORKER_PROCESSES copies of worker.py on one node and restarts the ones that crash.
+#
+#   WORKER_PROCESSES=4 python supervisor.py
+#
+# SIGTERM or SIGINT drains every worker: they stop polling, hand buffered messages back to the
+# queue and get WORKER_DRAIN_TIMEOUT_SECONDS to finish running jobs before they are killed.
+# The node bandwidth budget is split evenly between the workers, each works in its own
+# DOWNLOAD_DIR/worker-<index> and disk reservations are shared through a ledger directory.
+import logging
+import os
+import signal
+import subprocess
+import sys
+import time
+from app.config import Settings
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+# a worker that dies sooner than this after starting is restarted with a growing delay
+STABLE_SECONDS = 60
+MAX_RESTART_DELAY = 60
+# on top of the drain timeout, for the workers to close their clients
+KILL_GRACE_SECONDS = 30
+
+
+class WorkerProcess:
+    def __init__(self, index: int):
+        self.index = index
+        self.process = None
+        self.started_at = 0.0
+        self.failures = 0
+        self.restart_at = 0.0
+
+
+class Supervisor:
+    def __init__(self, settings: Settings):
+        self.settings = settings
+        self.workers = [WorkerProcess(index) for index in range(max(1, settings.worker_processes))]
+        self.stopping = False
+
+    def _env(self, worker: WorkerProcess):
+        env = dict(os.environ)
+        env["WORKER_INDEX"] = str(worker.index)
+        # workers must not share files: downloads and merges resume or clobber by name, the inventory cache is rewritten in place
+        work_dir = os.path.join(self.settings.download_dir, f"worker-{worker.index}")
+        env["DOWNLOAD_DIR"] = work_dir
+        env["S3_INVENTORY_CACHE_PATH"] = os.path.join(work_dir, os.path.basename(self.settings.s3_inventory_cache_path))
+        # but they share the volume, so disk reservations are published where all of them count them
+        env["DISK_LEDGER_DIR"] = os.path.join(self.settings.download_dir, ".disk-reservations")
+        # every process runs its own governor, so each gets its share of the node budget
+        count = len(self.workers)
+        if self.settings.bandwidth_ingress_bps:
+            env["BANDWIDTH_INGRESS_BPS"] = str(self.settings.bandwidth_ingress_bps // count)
+        if self.settings.bandwidth_egress_bps:
+            env["BANDWIDTH_EGRESS_BPS"] = str(self.settings.bandwidth_egress_bps // count)
+        return env
+
+    def _start(self, worker: WorkerProcess):
+        worker.process = subprocess.Popen([sys.executable, WORKER_SCRIPT], env=self._env(worker))
+        worker.started_at = time.monotonic()
+        logger.info(f"Started worker {worker.index} (pid {worker.process.pid})")
+
+    def _check(self, worker: WorkerProcess):
+        now = time.monotonic()
+        if worker.process is None:
+            if now >= worker.restart_at:
+                self._start(worker)
+            return
+        code = worker.process.poll()
+        if code is None:
+            return
+
+        uptime = now - worker.started_at
+        worker.failures = worker.failures + 1 if uptime < STABLE_SECONDS else 1
+        delay = min(MAX_RESTART_DELAY, 2 ** (worker.failures - 1))
+        logger.warning(f"Worker {worker.index} exited with {code} after {uptime:.0f}s, restarting in {delay}s")
+        worker.process = None
+        worker.restart_at = now + delay
+
+    def _request_stop(self, signum, frame):
+        if self.stopping:
+            return
+        self.stopping = True
+        logger.info(f"Received signal {signum}, draining {len(self.workers)} workers")
+
+    def _drain(self):
+        running = [worker for worker in self.workers if worker.process and worker.process.poll() is None]
+        for worker in running:
+            worker.process.send_signal(signal.SIGTERM)
+
+        deadline = time.monotonic() + self.settings.worker_drain_timeout_seconds + KILL_GRACE_SECONDS
+        for worker in running:
+            try:
+                worker.process.wait(timeout=max(0.0, deadline - time.monotonic()))
+                logger.info(f"Worker {worker.index} drained")
+            except subprocess.TimeoutExpired:
+                logger.warning(f"Worker {worker.index} did not drain in time, killing it")
+                worker.process.kill()
+                worker.process.wait()
+
+    def run(self):
+        signal.signal(signal.SIGTERM, self._request_stop)
+        signal.signal(signal.SIGINT, self._request_stop)
+        for worker in self.workers:
+            self._start(worker)
+
+        while not self.stopping:
+            for worker in self.workers:
+                self._check(worker)
+            time.sleep(1)
+
+        self._drain()
+        logger.info("All workers stopped")
+
+
+if __name__ == "__main__":
+    Supervisor(Settings()).run()
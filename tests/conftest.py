@@ -0,0 +1,11 @@
+import asyncio
+import inspect
+
+
+def pytest_pyfunc_call(pyfuncitem):
+    """Runs coroutine tests on a fresh event loop, so the suite does not need pytest-asyncio."""
+    if not inspect.iscoroutinefunction(pyfuncitem.obj):
+        return None
+    arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+    asyncio.run(pyfuncitem.obj(**arguments))
+    return True
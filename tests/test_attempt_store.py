@@ -0,0 +1,52 @@
+import pytest
+from app.attempt_store import AttemptStore, StrategyStats, order_strategies
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = AttemptStore(str(tmp_path / "attempts.sqlite"))
+    yield store
+    store.close()
+
+
+def record(store, strategy, successes, failures, host="veo.co", seconds=60):
+    for _ in range(successes):
+        store.record("veo", host, strategy, "best", False, True, seconds, 1000)
+    for _ in range(failures):
+        store.record("veo", host, strategy, "best", False, False, 5)
+
+
+def test_stats_are_kept_per_host(store):
+    record(store, "native", 2, 1)
+    record(store, "native", 0, 4, host="other.example.com")
+
+    stats = store.stats("veo.co")["native"]
+    assert (stats.attempts, stats.successes) == (3, 2)
+    assert stats.success_seconds == 60 and stats.failure_seconds == 5
+    assert stats.success_bytes == 1000
+
+
+def test_failing_strategy_is_demoted_behind_working_ones(store):
+    record(store, "native", 0, 6)
+    record(store, "ffmpeg", 3, 0)
+
+    order, trace = order_strategies(["native", "ffmpeg", "aria2c"], store.stats("veo.co"))
+
+    assert order == ["ffmpeg", "aria2c", "native"]
+    assert trace[0].startswith("native: demoted")
+
+
+def test_few_samples_keep_the_preferred_order():
+    stats = {"native": StrategyStats(attempts=2, successes=0, failure_seconds=5)}
+    order, _ = order_strategies(["native", "ffmpeg"], stats)
+    assert order == ["native", "ffmpeg"]
+
+
+def test_demoted_strategies_are_ordered_by_expected_time():
+    stats = {
+        "slow_fail": StrategyStats(attempts=10, successes=1, success_seconds=60, failure_seconds=600),
+        "fast_fail": StrategyStats(attempts=10, successes=1, success_seconds=60, failure_seconds=5),
+        "never": StrategyStats(attempts=10, successes=0, failure_seconds=1),
+    }
+    order, _ = order_strategies(["never", "slow_fail", "fast_fail"], stats)
+    assert order == ["fast_fail", "slow_fail", "never"]
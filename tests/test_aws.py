@@ -0,0 +1,50 @@
+import threading
+import pytest
+from app import aws
+from app.aws import IoExecutor, get_executor
+from app.queue.sqs_client import SqsClient
+from app.s3_client import S3client
+
+
+@pytest.fixture(autouse=True)
+def fresh_pools(monkeypatch):
+    monkeypatch.setattr(aws, "_executors", {})
+    monkeypatch.setattr(aws, "_clients", {})
+
+
+def test_executors_are_shared_by_name():
+    assert get_executor("s3", 4) is get_executor("s3", 4)
+    assert get_executor("s3", 4) is not get_executor("sqs", 4)
+
+
+def test_executor_size_mismatch_is_rejected():
+    get_executor("sqs", 4)
+    with pytest.raises(ValueError):
+        get_executor("sqs", 8)
+
+
+async def test_calls_run_on_the_named_pool_and_are_timed():
+    executor = IoExecutor("test_io", 2)
+    try:
+        assert (await executor.run(lambda: threading.current_thread().name)).startswith("test_io-io")
+        assert executor.queue_wait.snapshot()["count"] == 1
+        assert executor.call_time.snapshot()["count"] == 1
+    finally:
+        executor.shutdown()
+
+
+def test_s3_pool_covers_short_calls_and_transfers():
+    client = S3client("key", "secret", "eu-west-1", "bucket", max_workers=8, max_pool_connections=10,
+                      transfer_concurrency=8, transfer_workers=4)
+    assert client.client.meta.config.max_pool_connections == 8 + 4 * 8
+    assert client.executor is not client.transfer_executor
+
+
+def test_sqs_clients_share_one_boto_client():
+    first = SqsClient("key", "secret", "eu-west-1", "https://sqs.eu-west-1.amazonaws.com/1/jobs.fifo",
+                      max_workers=4, max_pool_connections=2)
+    second = SqsClient("key", "secret", "eu-west-1", "https://sqs.eu-west-1.amazonaws.com/1/slow",
+                       max_workers=4, max_pool_connections=2)
+    assert first.connect() is second.connect()
+    assert first.connect().meta.config.max_pool_connections == 4
+    assert first.is_fifo and not second.is_fifo
@@ -0,0 +1,86 @@
+from bson import ObjectId
+import mongomock_motor
+import pytest
+from app.data.data import Data
+from app.data.schema import VideoStatus
+from app.rate_limiter import TokenBucket
+from backfill import Backfill, Checkpoint
+
+
+class FakeEnqueuer:
+    router = None
+
+    def __init__(self, failing=()):
+        self.failing = set(failing)
+        self.sent = []
+
+    async def enqueue_batch(self, messages, lanes=None):
+        results = []
+        for message in messages:
+            if message.matchId in self.failing:
+                results.append((None, False))
+            else:
+                self.sent.append(message.matchId)
+                results.append((f"message-{message.matchId}", False))
+        return results
+
+
+@pytest.fixture
+def match_ids():
+    return [str(ObjectId()) for _ in range(5)]
+
+
+async def make_backfill(tmp_path, match_ids, enqueuer):
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    await database["mergedmatches"].insert_many([
+        {"_id": ObjectId(match_id), "match_video": f"https://youtu.be/{match_id}",
+         "video_ingest": {"status": VideoStatus.PENDING.value}}
+        for match_id in match_ids
+    ])
+    checkpoint = Checkpoint(str(tmp_path / "backfill.json"))
+    return Backfill(Data(database), enqueuer, checkpoint, concurrency=2, rate_limiter=TokenBucket(0))
+
+
+async def test_complete_pass_clears_the_cursor(tmp_path, match_ids):
+    enqueuer = FakeEnqueuer()
+    backfill = await make_backfill(tmp_path, match_ids, enqueuer)
+
+    state = await backfill.run(page_size=2)
+
+    assert sorted(enqueuer.sent) == sorted(match_ids)
+    assert state["enqueued"] == 5 and state["pages"] == 3
+    assert state["last_id"] is None
+
+
+async def test_limit_keeps_the_cursor_for_the_next_run(tmp_path, match_ids):
+    enqueuer = FakeEnqueuer()
+    backfill = await make_backfill(tmp_path, match_ids, enqueuer)
+
+    state = await backfill.run(page_size=2, limit=3)
+
+    assert len(enqueuer.sent) == 3
+    assert state["last_id"] == sorted(match_ids)[-3]
+
+
+async def test_non_positive_limit_sends_nothing(tmp_path, match_ids):
+    enqueuer = FakeEnqueuer()
+    backfill = await make_backfill(tmp_path, match_ids, enqueuer)
+
+    await backfill.run(page_size=2, limit=0)
+
+    assert enqueuer.sent == []
+
+
+async def test_failed_sends_are_replayed_by_the_next_run(tmp_path, match_ids):
+    enqueuer = FakeEnqueuer(failing=match_ids[:2])
+    backfill = await make_backfill(tmp_path, match_ids, enqueuer)
+    state = await backfill.run(page_size=10)
+    assert sorted(state["failed_ids"]) == sorted(match_ids[:2])
+
+    enqueuer.failing.clear()
+    enqueuer.sent.clear()
+    # only the replay has anything left to send, the rest were marked queued
+    state = await backfill.run(page_size=10)
+
+    assert sorted(enqueuer.sent) == sorted(match_ids[:2])
+    assert state["failed_ids"] == []
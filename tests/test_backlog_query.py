@@ -0,0 +1,56 @@
+from datetime import datetime, timedelta, timezone
+import mongomock_motor
+from app.data.data import backlog_query
+from app.data.schema import VideoStatus
+
+NOW = datetime.now(timezone.utc)
+HOUR = timedelta(hours=1)
+
+
+def ingest(status, **fields):
+    return {"status": status.value, **fields}
+
+
+MATCHES = [
+    {"_id": "pending", "match_video": "https://youtu.be/a", "video_ingest": ingest(VideoStatus.PENDING)},
+    {"_id": "failed", "match_video": "https://youtu.be/f", "video_ingest": ingest(VideoStatus.FAILED)},
+    {"_id": "uploaded", "match_video": "https://youtu.be/b", "video_ingest": ingest(VideoStatus.UPLOADED)},
+    {"_id": "no_status", "match_video": "https://youtu.be/c"},
+    {"_id": "no_status_no_video", "match_video": ""},
+    {"_id": "no_status_ingested", "match_video": "https://media.naemoapp.com/matches/ab/x.mp4"},
+    {"_id": "unavailable", "match_video": "https://youtu.be/d",
+     "video_ingest": ingest(VideoStatus.UNAVAILABLE, unavailable_until=NOW + 24 * HOUR)},
+    {"_id": "unavailable_expired", "match_video": "https://youtu.be/e",
+     "video_ingest": ingest(VideoStatus.UNAVAILABLE, unavailable_until=NOW - 24 * HOUR)},
+    {"_id": "queued", "match_video": "https://youtu.be/g", "video_ingest": ingest(VideoStatus.QUEUED, queued_at=NOW - HOUR)},
+    {"_id": "queued_lost", "match_video": "https://youtu.be/h",
+     "video_ingest": ingest(VideoStatus.QUEUED, queued_at=NOW - 48 * HOUR)},
+    {"_id": "downloading", "match_video": "https://youtu.be/i",
+     "video_ingest": ingest(VideoStatus.DOWNLOADING, started_at=NOW - HOUR)},
+    {"_id": "downloading_lost", "match_video": "https://youtu.be/j",
+     "video_ingest": ingest(VideoStatus.DOWNLOADING, started_at=NOW - 48 * HOUR)},
+]
+
+
+
+
+async def matching(query):
+    collection = mongomock_motor.AsyncMongoMockClient()["test"]["mergedmatches"]
+    await collection.insert_many([dict(match) for match in MATCHES])
+    return sorted([match["_id"] async for match in collection.find(query)])
+
+
+async def test_backlog_includes_pending_unmigrated_and_lost_matches():
+    assert await matching(backlog_query()) == [
+        "downloading_lost", "failed", "no_status", "pending", "queued_lost", "unavailable_expired"
+    ]
+
+
+async def test_backlog_with_unavailable_includes_live_negative_results():
+    assert "unavailable" in await matching(backlog_query(include_unavailable=True))
+
+
+async def test_stuck_cutoff_is_configurable():
+    assert "queued" in await matching(backlog_query(stuck_after=600))
+    ids = await matching(backlog_query(stuck_after=0))
+    assert "queued_lost" not in ids and "downloading_lost" not in ids
@@ -0,0 +1,72 @@
+import pytest
+from app.bandwidth import MIN_SHARE, BandwidthGovernor, TransferClass
+
+BUDGET = 100 * 1024 * 1024
+
+
+def test_unlimited_pool_leaves_transfers_unthrottled():
+    governor = BandwidthGovernor()
+    with governor.allocate(TransferClass.DOWNLOAD) as download, governor.allocate(TransferClass.UPLOAD) as upload:
+        assert download.rate == upload.rate == 0
+
+
+def test_adaptive_transfers_split_by_weight_and_rebalance():
+    governor = BandwidthGovernor(ingress_bps=BUDGET, shared_link=True, weights={TransferClass.UPLOAD: 3.0})
+    with governor.allocate(TransferClass.DOWNLOAD) as download:
+        assert download.rate == BUDGET
+        with governor.allocate(TransferClass.UPLOAD) as upload:
+            assert (download.rate, upload.rate) == (BUDGET / 4, BUDGET * 3 / 4)
+        assert download.rate == BUDGET
+
+
+def test_fixed_transfers_never_commit_more_than_the_budget():
+    governor = BandwidthGovernor(ingress_bps=BUDGET, fixed_slots=4)
+    with governor.allocate(TransferClass.DOWNLOAD, fixed=True) as first:
+        with governor.allocate(TransferClass.DOWNLOAD, fixed=True) as second:
+            with governor.allocate(TransferClass.DOWNLOAD, fixed=True) as third:
+                rates = [first.rate, second.rate, third.rate]
+    # no slot takes it all: the second and third start with as much as the first
+    assert rates == [BUDGET / 4] * 3
+    assert sum(rates) <= BUDGET
+
+
+def test_fixed_rate_is_kept_while_adaptive_ones_share_the_rest():
+    governor = BandwidthGovernor(ingress_bps=BUDGET, shared_link=True, fixed_slots=2)
+    with governor.allocate(TransferClass.DOWNLOAD, fixed=True) as download:
+        with governor.allocate(TransferClass.UPLOAD) as upload:
+            assert download.rate == BUDGET / 2
+            assert upload.rate == BUDGET / 2
+
+
+def test_fully_committed_pool_still_limits_new_transfers():
+    governor = BandwidthGovernor(ingress_bps=BUDGET)
+    with governor.allocate(TransferClass.DOWNLOAD, fixed=True):
+        with governor.allocate(TransferClass.DOWNLOAD, fixed=True) as late:
+            assert late.rate == pytest.approx(BUDGET * MIN_SHARE)
+
+
+def test_released_share_goes_to_the_next_allocation():
+    governor = BandwidthGovernor(ingress_bps=BUDGET, fixed_slots=2)
+    with governor.allocate(TransferClass.DOWNLOAD, fixed=True):
+        pass
+    with governor.allocate(TransferClass.DOWNLOAD, fixed=True) as retry:
+        assert retry.rate == BUDGET / 2
+
+
+def test_capped_transfers_commit_only_what_they_can_use():
+    governor = BandwidthGovernor(ingress_bps=BUDGET)
+    with governor.allocate(TransferClass.DOWNLOAD, fixed=True, max_rate=8 * 1024 * 1024) as tor:
+        with governor.allocate(TransferClass.DOWNLOAD, fixed=True) as direct:
+            assert tor.rate == 8 * 1024 * 1024
+            assert direct.rate == BUDGET / 2
+
+
+def test_throttle_sleeps_past_the_burst(monkeypatch):
+    slept = []
+    monkeypatch.setattr("app.bandwidth.time.sleep", slept.append)
+    governor = BandwidthGovernor(egress_bps=1000)
+    with governor.allocate(TransferClass.UPLOAD) as upload:
+        upload.throttle(250)
+        upload.throttle(1000)
+    assert len(slept) == 1
+    assert slept[0] == pytest.approx(0.75, abs=0.05)
@@ -0,0 +1,36 @@
+import pytest
+from app.downloader import classify_failure
+
+
+@pytest.mark.parametrize("line, reason", [
+    ("ERROR: [youtube] abc: Private video. Sign in if you've been granted access", "private"),
+    ("ERROR: [youtube] abc: Join this channel to get access to members-only content", "members_only"),
+    ("ERROR: [youtube] abc: Sign in to confirm your age", "age_restricted"),
+    ("ERROR: [youtube] abc: The uploader has blocked it in your country", "geo_blocked"),
+    ("ERROR: [youtube] abc: Video unavailable. This video has been removed by the uploader", "removed"),
+    ("ERROR: Unable to download webpage: HTTP Error 404: Not Found", "removed"),
+])
+def test_permanent_failures(line, reason):
+    assert classify_failure(f"[youtube] abc: Downloading webpage\n{line}\n") == (reason, line)
+
+
+@pytest.mark.parametrize("output", [
+    "",
+    "[download] 45.0% of 1.2GiB\n",
+    "ERROR: unable to download video data: HTTP Error 503: Service Unavailable\n",
+    "ERROR: [youtube] abc: Sign in to confirm you're not a bot\n",
+    "ERROR: [youtube] abc: Video unavailable\nERROR: Read timed out\n",
+])
+def test_transient_or_unknown_failures_stay_retryable(output):
+    assert classify_failure(output) is None
+
+
+def test_only_error_lines_are_classified():
+    assert classify_failure("[info] title: This video is private property of the club\n") is None
+
+
+def test_geo_block_through_tor_depends_on_the_exit():
+    output = "ERROR: [youtube] abc: This video is not available in your country\n"
+    assert classify_failure(output)[0] == "geo_blocked"
+    assert classify_failure(output, via_tor=True) is None
+    assert classify_failure("ERROR: [youtube] abc: Private video\n", via_tor=True)[0] == "private"
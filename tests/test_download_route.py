@@ -0,0 +1,78 @@
+import io
+import pytest
+from botocore.exceptions import ClientError
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api.routes import router
+from app.dependencies import get_job_manager, get_match_downloader, get_s3_client
+
+VIDEO = b"0123456789" * 100
+OBJECT_KEY = "matches/ab/m1/final.mp4"
+
+
+class FakeMatchDownloader:
+    def __init__(self, object_key):
+        self.object_key = object_key
+
+    async def find_ingested_object(self, match_id):
+        return self.object_key
+
+
+class FakeS3:
+    def generate_presigned_url(self, object_key, expires_in=3600, filename=None):
+        return f"https://bucket.s3.amazonaws.com/{object_key}?filename={filename}"
+
+    async def get_object(self, object_key, byte_range=None):
+        if not byte_range:
+            return {"Body": io.BytesIO(VIDEO), "ContentLength": len(VIDEO), "ContentType": "video/mp4"}
+        start, end = (int(value) for value in byte_range.removeprefix("bytes=").split("-"))
+        if start >= len(VIDEO):
+            raise ClientError({"Error": {"Code": "InvalidRange"}}, "GetObject")
+        body = VIDEO[start:end + 1]
+        return {"Body": io.BytesIO(body), "ContentLength": len(body),
+                "ContentRange": f"bytes {start}-{end}/{len(VIDEO)}", "ETag": '"abc"'}
+
+    async def iter_object_body(self, body, chunk_size=1024 * 1024):
+        yield body.read()
+
+
+class FakeJobManager:
+    async def submit(self, kind, match_id, force=False):
+        return {"_id": "job-1", "status": "queued"}
+
+
+def make_client(object_key=OBJECT_KEY):
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    app.dependency_overrides[get_match_downloader] = lambda: FakeMatchDownloader(object_key)
+    app.dependency_overrides[get_s3_client] = FakeS3
+    app.dependency_overrides[get_job_manager] = FakeJobManager
+    return TestClient(app)
+
+
+def test_ingested_video_redirects_to_a_presigned_url():
+    response = make_client().get("/api/matches/m1/download", follow_redirects=False)
+    assert response.status_code == 307
+    assert response.headers["location"] == f"https://bucket.s3.amazonaws.com/{OBJECT_KEY}?filename=match_m1.mp4"
+
+
+def test_proxy_streams_the_whole_object():
+    response = make_client().get("/api/matches/m1/download?mode=proxy")
+    assert response.status_code == 200
+    assert response.content == VIDEO
+    assert response.headers["accept-ranges"] == "bytes"
+
+
+@pytest.mark.parametrize("byte_range, status", [("bytes=10-19", 206), ("bytes=5000-5001", 416)])
+def test_proxy_forwards_ranges(byte_range, status):
+    response = make_client().get("/api/matches/m1/download?mode=proxy", headers={"Range": byte_range})
+    assert response.status_code == status
+    if status == 206:
+        assert response.content == VIDEO[10:20]
+        assert response.headers["content-range"] == f"bytes 10-19/{len(VIDEO)}"
+
+
+def test_video_not_ingested_yet_starts_a_job():
+    response = make_client(object_key=None).get("/api/matches/m1/download")
+    assert response.status_code == 202
+    assert response.json()["status_url"] == "/api/jobs/job-1"
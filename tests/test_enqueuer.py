@@ -0,0 +1,90 @@
+import json
+from datetime import datetime, timedelta, timezone
+import mongomock_motor
+import pytest
+from app.queue import enqueuer as enqueuer_module
+from app.queue.enqueuer import PENDING, Enqueuer
+from app.queue.messages import MatchUploadMessage
+
+
+class FakeSqs:
+    def __init__(self, queue_url="https://sqs.eu-west-1.amazonaws.com/1/jobs.fifo"):
+        self.is_fifo = queue_url.endswith(".fifo")
+        self.sent = []
+        self.fail = False
+
+    async def send_message(self, body, **params):
+        if self.fail:
+            raise ConnectionError("sqs unavailable")
+        self.sent.append((json.loads(body), params))
+        return {"MessageId": f"message-{len(self.sent)}"}
+
+    async def send_message_batch(self, entries):
+        return {"Failed": [{"Id": entry["Id"]} for entry in entries]}
+
+
+@pytest.fixture
+def sqs():
+    return FakeSqs()
+
+
+@pytest.fixture
+def enqueuer(sqs):
+    return Enqueuer(sqs, mongomock_motor.AsyncMongoMockClient()["test"], dedup_window=3600)
+
+
+def test_key_ignores_the_post_date():
+    first = MatchUploadMessage(matchId="a")
+    second = MatchUploadMessage(matchId="a")
+    first.set_post_date()
+    assert first.idempotency_key() == second.idempotency_key()
+    assert first.idempotency_key() != MatchUploadMessage(matchId="b").idempotency_key()
+
+
+async def test_duplicate_within_window_returns_the_first_message(enqueuer, sqs):
+    first = await enqueuer.enqueue(MatchUploadMessage(matchId="a"))
+    second = await enqueuer.enqueue(MatchUploadMessage(matchId="a"))
+
+    assert first == ("message-1", False)
+    assert second == ("message-1", True)
+    body, params = sqs.sent[0]
+    assert body["postDate"] is not None
+    assert params == {"deduplication_id": MatchUploadMessage(matchId="a").idempotency_key(), "group_id": "match-a"}
+
+
+async def test_unconfirmed_claim_is_reported_as_pending(enqueuer, monkeypatch):
+    monkeypatch.setattr(enqueuer_module, "PENDING_CLAIM_WAIT", 0)
+    message = MatchUploadMessage(matchId="a")
+    await enqueuer.claims.insert_one(enqueuer._claim(message.idempotency_key(), datetime.now(timezone.utc)))
+
+    assert await enqueuer.enqueue(message) == (PENDING, True)
+
+
+async def test_expired_claim_is_sent_again(enqueuer, sqs):
+    message = MatchUploadMessage(matchId="a")
+    await enqueuer.claims.insert_one(
+        enqueuer._claim(message.idempotency_key(), datetime.now(timezone.utc) - timedelta(hours=2))
+    )
+
+    assert await enqueuer.enqueue(message) == ("message-1", False)
+
+
+async def test_failed_send_and_release_drop_the_claim(enqueuer, sqs):
+    sqs.fail = True
+    with pytest.raises(ConnectionError):
+        await enqueuer.enqueue(MatchUploadMessage(matchId="a"))
+    assert await enqueuer.claims.count_documents({}) == 0
+
+    sqs.fail = False
+    await enqueuer.enqueue(MatchUploadMessage(matchId="a"))
+    await enqueuer.release(MatchUploadMessage(matchId="a"))
+    assert await enqueuer.enqueue(MatchUploadMessage(matchId="a")) == ("message-2", False)
+
+
+async def test_batch_reports_duplicates_and_frees_failed_claims(enqueuer):
+    await enqueuer.enqueue(MatchUploadMessage(matchId="a"))
+
+    results = await enqueuer.enqueue_batch([MatchUploadMessage(matchId="a"), MatchUploadMessage(matchId="b")])
+
+    assert results == [("message-1", True), (None, False)]
+    assert [claim["_id"] async for claim in enqueuer.claims.find()] == [MatchUploadMessage(matchId="a").idempotency_key()]
@@ -0,0 +1,53 @@
+import mongomock_motor
+import pytest
+from app.fragment_tuning import FragmentTuner, parse_transfer
+
+MIB = 1024 ** 2
+
+
+def completed(mib, seconds):
+    return f"[download] 100% of  {mib:.2f}MiB in 00:{seconds // 60:02d}:{seconds % 60:02d} at 1.00MiB/s\n"
+
+
+def test_parse_transfer_sums_every_stream():
+    output = completed(600, 120) + "[download]  50.0% of 10MiB\n" + completed(20, 10)
+    assert parse_transfer(output) == (620 * MIB, 130)
+
+
+async def test_concurrency_climbs_while_each_step_pays():
+    tuner = FragmentTuner(max_concurrency=8)
+    await tuner.observe("veo.co", 4, completed(400, 100))
+    assert tuner.concurrency("veo.co", 4) == 5
+
+    await tuner.observe("veo.co", 5, completed(500, 100))
+    assert tuner.concurrency("veo.co", 4) == 6
+
+    # barely faster than at 5: settle back
+    await tuner.observe("veo.co", 6, completed(510, 100))
+    assert tuner.concurrency("veo.co", 4) == 5
+
+
+@pytest.mark.parametrize("output, expected", [
+    ("ERROR: HTTP Error 429: Too Many Requests\n", 4),
+    ("[download] Got error: fragment 3 not found\n" * 10, 7),
+])
+async def test_throttling_and_fragment_errors_back_off(output, expected):
+    tuner = FragmentTuner()
+    await tuner.observe("cdn.example.com", 8, output)
+    assert tuner.concurrency("cdn.example.com", 8) == expected
+
+
+async def test_tor_hosts_stay_under_their_own_ceiling():
+    tuner = FragmentTuner(max_tor_concurrency=2)
+    await tuner.observe("youtube", 2, completed(100, 100), tor=True)
+    assert tuner.concurrency("youtube", 2) == 2
+
+
+async def test_tuning_survives_a_restart():
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    await FragmentTuner(database).observe("veo.co", 4, completed(400, 100))
+
+    restarted = FragmentTuner(database)
+    await restarted.load()
+    assert restarted.concurrency("veo.co", 1) == 5
+    assert restarted._hosts["veo.co"].rates == {4: 4 * MIB}
@@ -0,0 +1,76 @@
+import asyncio
+import os
+import threading
+from app.aws import IoExecutor
+from app.inventory import BucketInventory
+
+
+class FakePaginator:
+    def __init__(self, pages, gate=None):
+        self.pages = pages
+        self.gate = gate
+
+    def paginate(self, **params):
+        for page in self.pages:
+            if self.gate:
+                self.gate.wait()
+            yield page
+
+
+class FakeS3:
+    def __init__(self, keys, gate=None):
+        self.paginator = FakePaginator([{"Contents": [{"Key": key, "Size": 1, "ETag": '"e"'} for key in keys]}], gate)
+
+    def get_paginator(self, name):
+        return self.paginator
+
+
+def inventory(keys, tmp_path=None, gate=None):
+    return BucketInventory(
+        FakeS3(keys, gate),
+        IoExecutor("test-inventory", 1),
+        "bucket",
+        prefix="matches/",
+        cache_path=str(tmp_path / "inventory.json.gz") if tmp_path else None
+    )
+
+
+async def test_changes_recorded_during_a_refresh_are_kept():
+    gate = threading.Event()
+    listed = inventory(["matches/ab/old.mp4", "matches/cd/gone.mp4"], gate=gate)
+    refresh = asyncio.create_task(listed.refresh())
+    await asyncio.sleep(0.01)
+    # uploaded and deleted while the listing was running
+    listed.record("matches/ef/new.mp4", 10)
+    listed.discard("matches/cd/gone.mp4")
+    gate.set()
+    await refresh
+
+    assert listed.contains("matches/ab/old.mp4") and listed.contains("matches/ef/new.mp4")
+    assert not listed.contains("matches/cd/gone.mp4")
+    assert listed.has_directory("matches/ef")
+
+
+async def test_cache_round_trip(tmp_path):
+    saved = inventory(["matches/ab/a.mp4"], tmp_path)
+    await saved.refresh()
+
+    loaded = inventory([], tmp_path)
+    assert loaded.load() and loaded.covers("matches/xx/y.mp4")
+    assert loaded.get("matches/ab/a.mp4") == (1, "e")
+    assert os.listdir(tmp_path) == ["inventory.json.gz"]
+
+
+async def test_refresh_saves_while_the_loop_keeps_recording(tmp_path):
+    saved = inventory([f"matches/{i % 256:02x}/{i}.mp4" for i in range(50000)], tmp_path)
+    refresh = asyncio.create_task(saved.refresh())
+    recorded = 0
+    while not refresh.done():
+        saved.record(f"matches/zz/{recorded}.mp4", 1)
+        recorded += 1
+        await asyncio.sleep(0)
+    await refresh
+
+    assert os.listdir(tmp_path) == ["inventory.json.gz"]
+    loaded = inventory([], tmp_path)
+    assert loaded.load() and len(loaded) >= 50000
@@ -0,0 +1,87 @@
+from datetime import datetime, timedelta, timezone
+import mongomock_motor
+import pytest
+from app.service.jobs import STALE_JOB_SECONDS, JobKind, JobManager, JobStatus, JobStore
+
+
+@pytest.fixture
+def store():
+    return JobStore(mongomock_motor.AsyncMongoMockClient()["test"])
+
+
+def ago(seconds):
+    return datetime.now(timezone.utc) - timedelta(seconds=seconds)
+
+
+class FakeS3:
+    def __init__(self):
+        self.deleted = []
+
+    async def delete_file(self, object_key):
+        self.deleted.append(object_key)
+        return True
+
+
+class FakeDownloader:
+    def __init__(self):
+        self.s3_client = FakeS3()
+        self.released = []
+
+    def release_video(self, path):
+        self.released.append(path)
+
+
+async def test_owner_filter_leaves_other_owners_alone(store):
+    running = await store.create(JobKind.UPLOAD, "m1", owner="api-1")
+    done = await store.create(JobKind.UPLOAD, "m2", owner="api-1")
+    await store.update(done["_id"], {"status": JobStatus.SUCCEEDED.value})
+    elsewhere = await store.create(JobKind.UPLOAD, "m3", owner="api-2")
+
+    assert await store.fail_orphaned("api-1", "restarted") == 1
+    statuses = [(await store.get(job["_id"]))["status"] for job in (running, done, elsewhere)]
+    assert statuses == [JobStatus.FAILED.value, JobStatus.SUCCEEDED.value, JobStatus.PENDING.value]
+
+
+async def test_single_job_fails_only_once_its_heartbeat_is_stale(store):
+    job = await store.create(JobKind.DOWNLOAD, "m1", owner="api-2")
+
+    assert await store.fail_orphaned(None, "stale", job_id=job["_id"], stale_before=ago(60)) == 0
+    assert await store.fail_orphaned(None, "stale", job_id=job["_id"], stale_before=ago(-60)) == 1
+    assert (await store.get(job["_id"]))["error"] == "stale"
+
+
+async def test_starting_a_sibling_keeps_live_jobs(store):
+    # two API workers on one host: the second one starting must not fail the first one's job
+    first = JobManager(store, FakeDownloader())
+    second = JobManager(store, FakeDownloader())
+    assert first.owner != second.owner
+    live = await store.create(JobKind.UPLOAD, "m1", owner=first.owner)
+    abandoned = await store.create(JobKind.UPLOAD, "m2", owner="gone")
+    await store.collection.update_one({"_id": abandoned["_id"]}, {"$set": {"heartbeat_at": ago(STALE_JOB_SECONDS + 1)}})
+
+    await second.start()
+    await second.stop()
+
+    assert (await store.get(live["_id"]))["status"] == JobStatus.PENDING.value
+    assert (await store.get(abandoned["_id"]))["status"] == JobStatus.FAILED.value
+
+
+async def test_downloads_expire_by_their_owner_or_once_abandoned(store):
+    downloader = FakeDownloader()
+    manager = JobManager(store, downloader)
+    result = {"path": "/downloads/a.mp4", "object_key": "jobs/a/a.mp4", "expires_at": ago(1)}
+    own = await store.create(JobKind.DOWNLOAD, "m1", owner=manager.owner)
+    await store.update(own["_id"], {"status": JobStatus.SUCCEEDED.value, "result": result})
+    # another process's download, still within the time its owner has to expire it
+    recent = await store.create(JobKind.DOWNLOAD, "m2", owner="api-2")
+    await store.update(recent["_id"], {"status": JobStatus.SUCCEEDED.value, "result": {**result, "object_key": "jobs/b"}})
+    abandoned = await store.create(JobKind.DOWNLOAD, "m3", owner="gone")
+    await store.update(abandoned["_id"], {"status": JobStatus.SUCCEEDED.value, "result": {
+        "path": "/downloads/c.mp4", "object_key": "jobs/c", "expires_at": ago(STALE_JOB_SECONDS + 1)
+    }})
+
+    await manager._expire_downloads()
+
+    assert downloader.released == ["/downloads/a.mp4"]
+    assert sorted(downloader.s3_client.deleted) == ["jobs/a/a.mp4", "jobs/c"]
+    assert await store.expired_downloads() == [await store.get(recent["_id"])]
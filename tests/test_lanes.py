@@ -0,0 +1,99 @@
+import json
+import pytest
+from bson import ObjectId
+from app import aws
+from app.config import Settings
+from app.downloader import YoutubeDownloader
+from app.queue.enqueuer import Enqueuer
+from app.queue.lanes import Lane, LaneRouter, lane_queue_clients
+from app.queue.messages import DownloadVideoMessage, MatchUploadMessage, MergeVideosMessage
+from app.data.schema import MatchVideoInfo
+import mongomock_motor
+
+
+class FakeData:
+    def __init__(self, videos):
+        self.videos = videos
+
+    async def get_match_video_info(self, matchId):
+        video = self.videos.get(matchId)
+        return MatchVideoInfo(_id=matchId, match_video=video) if video is not None else None
+
+
+class FakeClient:
+    def __init__(self, name):
+        self.name = name
+        self.is_fifo = False
+        self.sent = []
+
+    async def send_message(self, body, **params):
+        self.sent.append(json.loads(body))
+        return {"MessageId": f"{self.name}-{len(self.sent)}"}
+
+
+def make_router(videos=None, lanes=(Lane.FAST, Lane.SLOW, Lane.TRANSCODE)):
+    clients = {lane: FakeClient(lane.value) for lane in lanes}
+    return LaneRouter(FakeData(videos or {}), YoutubeDownloader(cookies_path=None, facebook_cookies_path=None),
+                      FakeClient("default"), clients)
+
+
+@pytest.mark.parametrize("url, lane", [
+    ("https://www.youtube.com/watch?v=abc", Lane.SLOW),
+    ("https://youtu.be/abc", Lane.SLOW),
+    ("https://app.veo.co/matches/abc/", Lane.FAST),
+    ("https://www.facebook.com/watch/?v=1", Lane.FAST),
+    ("https://cdn.example.com/match.mp4", Lane.FAST),
+    (None, Lane.FAST),
+])
+def test_lane_for_url(url, lane):
+    assert make_router().lane_for_url(url) == lane
+
+
+YOUTUBE_MATCH = str(ObjectId())
+VEO_MATCH = str(ObjectId())
+VIDEOS = {YOUTUBE_MATCH: "https://youtu.be/abc", VEO_MATCH: "https://app.veo.co/matches/abc/"}
+
+
+async def test_lane_for_each_command():
+    router = make_router(VIDEOS)
+
+    assert await router.lane_for(MatchUploadMessage(matchId=YOUTUBE_MATCH)) == Lane.SLOW
+    assert await router.lane_for(MatchUploadMessage(matchId=VEO_MATCH)) == Lane.FAST
+    assert await router.lane_for(MatchUploadMessage(matchId=str(ObjectId()))) == Lane.FAST
+    assert await router.lane_for(MergeVideosMessage(video1="a", video2="b", output_name="c")) == Lane.TRANSCODE
+    assert await router.lane_for(DownloadVideoMessage(link="https://youtu.be/x", output_name="x")) == Lane.SLOW
+
+
+def test_lanes_without_a_queue_use_the_default_client():
+    router = make_router(lanes=(Lane.SLOW,))
+    assert router.client_for(Lane.SLOW).name == "slow"
+    assert router.client_for(Lane.FAST) is router.default_client
+    assert router.client_for(None) is router.default_client
+
+
+def test_lane_queue_clients_only_for_configured_lanes(monkeypatch):
+    monkeypatch.setattr(aws, "_executors", {})
+    settings = Settings.model_construct(
+        aws_access_key="key", aws_secret_key="secret", aws_region="eu-west-1",
+        sqs_max_workers=2, sqs_max_pool_connections=2,
+        sqs_lane_queue_urls={"slow": "https://sqs.eu-west-1.amazonaws.com/1/slow.fifo"},
+    )
+    clients = lane_queue_clients(settings)
+    assert list(clients) == [Lane.SLOW]
+
+
+async def test_enqueue_sends_each_job_to_its_lane_queue():
+    router = make_router(VIDEOS)
+    enqueuer = Enqueuer(router.default_client, mongomock_motor.AsyncMongoMockClient()["test"], router=router)
+
+    for message in [
+        MatchUploadMessage(matchId=YOUTUBE_MATCH),
+        MatchUploadMessage(matchId=VEO_MATCH),
+        MergeVideosMessage(video1="a", video2="b", output_name="c"),
+    ]:
+        await enqueuer.enqueue(message)
+
+    assert [body["matchId"] for body in router.clients[Lane.SLOW].sent] == [YOUTUBE_MATCH]
+    assert [body["matchId"] for body in router.clients[Lane.FAST].sent] == [VEO_MATCH]
+    assert [body["command"] for body in router.clients[Lane.TRANSCODE].sent] == ["Merge_Video"]
+    assert router.default_client.sent == []
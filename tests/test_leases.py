@@ -0,0 +1,45 @@
+from datetime import datetime, timedelta, timezone
+import mongomock_motor
+from app.data.leases import LeaseManager
+
+
+def _managers(*owners, ttl=300):
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    return [LeaseManager(database, owner=owner, ttl=ttl) for owner in owners]
+
+
+async def test_live_lease_is_refused_to_every_caller():
+    worker, other = _managers("worker", "other")
+
+    first = await worker.acquire("match:1")
+
+    assert first is not None and first.generation == 1
+    assert await worker.acquire("match:1") is None
+    assert await other.acquire("match:1") is None
+
+
+async def test_expired_lease_is_taken_over_and_old_holder_loses_it():
+    worker, other = _managers("worker", "other")
+    stale = await worker.acquire("match:1")
+    await worker.collection.update_one(
+        {"_id": "match:1"}, {"$set": {"expires_at": datetime.now(timezone.utc) - timedelta(seconds=1)}}
+    )
+
+    fresh = await other.acquire("match:1")
+    renewed = await worker.renew(stale)
+    # releasing the stale lease must not free the new holder's
+    await worker.release(stale)
+
+    assert fresh.generation == 2 and fresh.token != stale.token
+    assert renewed is False and stale.lost
+    assert (await other.collection.find_one({"_id": "match:1"}))["token"] == fresh.token
+
+
+async def test_hold_releases_the_lease():
+    (manager,) = _managers("worker")
+    async with manager.hold("match:1") as lease:
+        assert lease is not None
+        async with manager.hold("match:1") as nested:
+            assert nested is None
+
+    assert await manager.acquire("match:1") is not None
@@ -0,0 +1,36 @@
+import asyncio
+import logging
+import time
+from app.loop_monitor import LoopMonitor
+
+
+def block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+async def test_blocking_call_is_reported_with_its_stack(caplog):
+    monitor = LoopMonitor(interval=0.01, threshold=0.1, name="test_loop_stall")
+    monitor.start()
+    try:
+        await asyncio.sleep(0.05)
+        with caplog.at_level(logging.WARNING, logger="app.loop_monitor"):
+            block_the_loop(0.4)
+            await asyncio.sleep(0.05)
+    finally:
+        monitor.stop()
+
+    assert monitor.stalls.value == 1
+    assert "block_the_loop" in caplog.text
+    assert monitor.stall_seconds.snapshot()["max"] >= 0.3
+
+
+async def test_idle_loop_records_lag_without_stalls():
+    monitor = LoopMonitor(interval=0.01, threshold=0.5, name="test_loop_idle")
+    monitor.start()
+    try:
+        await asyncio.sleep(0.1)
+    finally:
+        monitor.stop()
+
+    assert monitor.lag.snapshot()["count"] > 0
+    assert monitor.stalls.value == 0
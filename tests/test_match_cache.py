@@ -0,0 +1,65 @@
+import asyncio
+from bson import ObjectId
+import mongomock_motor
+from app.data.data import Data
+from app.data.match_cache import MatchCache
+from app.data.schema import VideoStatus
+
+
+async def test_concurrent_misses_share_one_load():
+    cache = MatchCache(name="test_cache_coalesce")
+    loads = []
+
+    async def load():
+        loads.append(1)
+        await asyncio.sleep(0.01)
+        return "match"
+
+    assert await asyncio.gather(*(cache.get_or_load("m1", load) for _ in range(3))) == ["match"] * 3
+    assert await cache.get_or_load("m1", load) == "match"
+    assert len(loads) == 1
+
+
+async def test_entries_expire_and_the_oldest_are_evicted():
+    cache = MatchCache(max_size=2, ttl=0.01, name="test_cache_expiry")
+
+    async def load(value):
+        return value
+
+    for key in ("a", "b", "c"):
+        await cache.get_or_load(key, lambda key=key: load(key))
+    assert list(cache._entries) == ["b", "c"]
+
+    await asyncio.sleep(0.02)
+    assert await cache.get_or_load("b", lambda: load("fresh")) == "fresh"
+
+
+async def test_write_during_a_load_keeps_the_stale_result_out():
+    cache = MatchCache(name="test_cache_race")
+    release = asyncio.Event()
+
+    async def slow_load():
+        await release.wait()
+        return "before write"
+
+    load = asyncio.create_task(cache.get_or_load("m1", slow_load))
+    await asyncio.sleep(0)
+    cache.invalidate("m1")
+    release.set()
+
+    assert await load == "before write"
+    assert "m1" not in cache._entries
+
+
+async def test_status_write_invalidates_cached_video_info():
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    match_id = ObjectId()
+    await database["mergedmatches"].insert_one({"_id": match_id, "match_video": "https://youtu.be/a"})
+    data = Data(database)
+    data.enable_match_cache(ttl=60)
+
+    assert (await data.get_match_video_info(str(match_id))).video_ingest is None
+    await data.set_video_status(str(match_id), VideoStatus.DOWNLOADING)
+
+    info = await data.get_match_video_info(str(match_id))
+    assert info.video_ingest["status"] == VideoStatus.DOWNLOADING.value
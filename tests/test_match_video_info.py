@@ -0,0 +1,47 @@
+from bson import ObjectId
+import mongomock_motor
+from app.data.data import Data
+from app.data.schema import MATCH_VIDEO_INFO_PROJECTION, MatchVideoInfo
+
+CAMEL_ID, SNAKE_ID = ObjectId(), ObjectId()
+
+
+async def make_data():
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    await database["mergedmatches"].insert_many([
+        {"_id": CAMEL_ID, "homeTeamString": "Home", "awayTeamString": "Away", "matchVideo": "https://youtu.be/a",
+         "events": [{"minute": minute} for minute in range(90)]},
+        {"_id": SNAKE_ID, "home_team_string": "Home", "match_video": "https://youtu.be/b",
+         "match_video_key": "matches/ab/b/final.mp4", "video_ingest": {"status": "pending"}},
+    ])
+    return Data(database)
+
+
+async def test_video_info_reads_either_spelling():
+    data = await make_data()
+    camel = await data.get_match_video_info(str(CAMEL_ID))
+    snake = await data.get_match_video_info(str(SNAKE_ID))
+
+    assert camel == MatchVideoInfo(_id=str(CAMEL_ID), home_team_string="Home", away_team_string="Away",
+                                   match_video="https://youtu.be/a")
+    assert snake.match_video_key == "matches/ab/b/final.mp4"
+    assert snake.video_ingest == {"status": "pending"}
+
+
+async def test_projection_leaves_the_rest_of_the_document_behind():
+    data = await make_data()
+    raw = await data.database["mergedmatches"].find_one({"_id": CAMEL_ID}, MATCH_VIDEO_INFO_PROJECTION)
+    assert "events" not in raw
+
+
+async def test_missing_match_is_none():
+    data = await make_data()
+    assert await data.get_match_video_info(str(ObjectId())) is None
+
+
+async def test_matches_by_ids_reads_in_batches():
+    data = await make_data()
+    matches = await data.get_matches_by_ids([str(CAMEL_ID), str(SNAKE_ID), str(ObjectId())], batch_size=1)
+    assert {match_id: match.match_video for match_id, match in matches.items()} == {
+        str(CAMEL_ID): "https://youtu.be/a", str(SNAKE_ID): "https://youtu.be/b"
+    }
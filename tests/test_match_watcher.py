@@ -0,0 +1,78 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+import mongomock_motor
+import pytest
+from pymongo.errors import OperationFailure
+from app.data.data import Data
+from app.data.schema import VideoStatus
+from app.service.match_watcher import MatchVideoWatcher
+
+
+class FakeEnqueuer:
+    def __init__(self, duplicate=False):
+        self.duplicate = duplicate
+        self.enqueued = []
+
+    async def enqueue(self, message):
+        self.enqueued.append(message.matchId)
+        return "message-1", self.duplicate
+
+
+async def watch_insert(match, enqueuer=None):
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    await database["mergedmatches"].insert_one(match)
+    enqueuer = enqueuer or FakeEnqueuer()
+    watcher = MatchVideoWatcher(database, Data(database), enqueuer)
+    enqueued = await watcher.handle_change({"operationType": "insert", "fullDocument": match})
+    stored = await database["mergedmatches"].find_one({"_id": match["_id"]})
+    return enqueued, enqueuer, (stored.get("video_ingest") or {}).get("status")
+
+
+async def test_new_video_is_enqueued_and_marked_queued():
+    enqueued, enqueuer, status = await watch_insert({"_id": ObjectId(), "matchVideo": "https://youtu.be/a"})
+    assert enqueued and len(enqueuer.enqueued) == 1
+    assert status == VideoStatus.QUEUED.value
+
+
+async def test_duplicate_enqueue_leaves_the_status_alone():
+    enqueued, _, status = await watch_insert(
+        {"_id": ObjectId(), "match_video": "https://youtu.be/a"}, FakeEnqueuer(duplicate=True)
+    )
+    assert not enqueued and status is None
+
+
+async def test_match_without_video_is_marked_missing():
+    enqueued, enqueuer, status = await watch_insert({"_id": ObjectId(), "match_video": ""})
+    assert not enqueued and enqueuer.enqueued == []
+    assert status == VideoStatus.MISSING.value
+
+
+@pytest.mark.parametrize("fields", [
+    {"match_video": "https://media.naemoapp.com/matches/ab/x.mp4"},
+    {"match_video": "https://youtu.be/a", "video_ingest": {"status": VideoStatus.DOWNLOADING.value}},
+    {"match_video": "https://youtu.be/a", "video_ingest": {
+        "status": VideoStatus.UNAVAILABLE.value, "unavailable_url": "https://youtu.be/a",
+        "unavailable_until": datetime.now(timezone.utc) + timedelta(days=1)}},
+])
+async def test_ingested_in_flight_and_unavailable_matches_are_skipped(fields):
+    enqueued, enqueuer, _ = await watch_insert({"_id": ObjectId(), **fields})
+    assert not enqueued and enqueuer.enqueued == []
+
+
+async def test_lost_resume_token_restarts_from_now():
+    database = mongomock_motor.AsyncMongoMockClient()["test"]
+    watcher = MatchVideoWatcher(database, Data(database), FakeEnqueuer())
+    await watcher.save_resume_token({"_data": "old"})
+    attempts = []
+
+    async def watch():
+        attempts.append(await watcher.load_resume_token())
+        if len(attempts) == 1:
+            raise OperationFailure("history lost", code=286)
+        raise asyncio.CancelledError
+
+    watcher.watch = watch
+    with pytest.raises(asyncio.CancelledError):
+        await watcher.run(retry_delay=0)
+    assert attempts == [{"_data": "old"}, None]
@@ -0,0 +1,92 @@
+import json
+from app.queue.message_queue_processor import MessageProcessor
+from app.queue.retry import RetryPolicy
+
+
+class FakeQueue:
+    queue_url = "https://sqs.example.com/1/uploads.fifo"
+    is_fifo = True
+
+    def __init__(self, fail_delete: bool = False):
+        self.sent = []
+        self.deleted = []
+        self.fail_delete = fail_delete
+
+    async def send_message(self, message, **params):
+        self.sent.append((json.loads(message), params))
+        return {"MessageId": f"sent-{len(self.sent)}"}
+
+    async def delete_message(self, receipt_handle):
+        if self.fail_delete:
+            raise ConnectionError("delete failed")
+        self.deleted.append(receipt_handle)
+
+
+def held(processor, receipt_handle, body, attempt=None):
+    msg = {"MessageId": "m-1", "ReceiptHandle": receipt_handle, "Body": json.dumps(body)}
+    if attempt:
+        msg["MessageAttributes"] = {"attempt": {"DataType": "Number", "StringValue": str(attempt)}}
+    processor._held[receipt_handle] = msg
+
+
+async def test_upload_retry_stays_in_the_match_group():
+    queue = FakeQueue()
+    processor = MessageProcessor(queue, None, retry_policy=RetryPolicy(max_attempts=3))
+    held(processor, "r-1", {"command": "Match_Upload", "matchId": "65f0c0ffee", "postDate": None})
+
+    assert await processor._retry_or_dead_letter("r-1", "download failed") is True
+
+    body, params = queue.sent[0]
+    assert body["matchId"] == "65f0c0ffee"
+    assert params["group_id"] == "match-65f0c0ffee"
+    assert params["deduplication_id"] == "m-1-retry-1"
+    assert params["attributes"]["attempt"] == 2
+    assert queue.deleted == ["r-1"]
+
+
+async def test_other_commands_keep_the_command_group():
+    queue = FakeQueue()
+    processor = MessageProcessor(queue, None, retry_policy=RetryPolicy(max_attempts=3))
+    held(processor, "r-1", {"command": "Download_Video", "link": "https://youtu.be/x", "output_name": "x"})
+
+    await processor._retry_or_dead_letter("r-1", "download failed")
+
+    assert queue.sent[0][1]["group_id"] == "Download_Video"
+
+
+async def test_failure_after_the_retry_was_sent_is_ignored():
+    # the retry went out but deleting the original raised, the job's error path calls again
+    queue = FakeQueue(fail_delete=True)
+    processor = MessageProcessor(queue, None, retry_policy=RetryPolicy(max_attempts=3))
+    held(processor, "r-1", {"command": "Match_Upload", "matchId": "65f0c0ffee"})
+
+    try:
+        await processor._retry_or_dead_letter("r-1", "upload failed")
+    except ConnectionError:
+        pass
+    assert await processor._retry_or_dead_letter("r-1", "delete failed") is True
+
+    assert len(queue.sent) == 1
+
+
+async def test_unknown_command_is_dead_lettered():
+    queue, dead_letters = FakeQueue(), FakeQueue()
+    processor = MessageProcessor(queue, None, dead_letter_client=dead_letters)
+    held(processor, "r-1", {"command": "Transcode"})
+
+    await processor.process_message({"command": "Transcode"}, "r-1")
+
+    assert dead_letters.sent[0][0] == {"command": "Transcode"}
+    assert queue.deleted == ["r-1"] and not processor._held
+
+
+async def test_out_of_attempts_goes_to_the_dead_letter_queue():
+    queue, dead_letters = FakeQueue(), FakeQueue()
+    processor = MessageProcessor(queue, None, retry_policy=RetryPolicy(max_attempts=2), dead_letter_client=dead_letters)
+    held(processor, "r-1", {"command": "Match_Upload", "matchId": "65f0c0ffee"}, attempt=2)
+
+    assert await processor._retry_or_dead_letter("r-1", "download failed") is False
+
+    assert not queue.sent
+    assert dead_letters.sent[0][1]["attributes"]["attempts"] == 2
+    assert queue.deleted == ["r-1"]
@@ -0,0 +1,109 @@
+import asyncio
+import json
+from types import SimpleNamespace
+import pytest
+from app.downloader import YoutubeDownloader
+from app.queue.message_queue_processor import MessageProcessor
+from app.queue.scheduler import JobScheduler
+from app.service.disk_admission import DiskAdmission
+
+GB = 1024 ** 3
+
+
+@pytest.fixture
+def free_space(monkeypatch):
+    space = SimpleNamespace(free=10 * GB)
+    monkeypatch.setattr("app.service.disk_admission.shutil.disk_usage", lambda path: space)
+    return space
+
+
+class FakeDownloader:
+    def __init__(self, filesize):
+        self.filesize = filesize
+        self.prefetched = []
+
+    def platform(self, url):
+        return "veo"
+
+    async def prefetch(self, url, probe=True):
+        self.prefetched.append(url)
+        return {"duration": 5400, "filesize": self.filesize}
+
+
+class FakeData:
+    async def get_match_video_info(self, match_id, fresh=False):
+        return SimpleNamespace(match_video=f"https://app.veo.co/matches/{match_id}/", video_ingest={})
+
+
+def make_processor(tmp_path, filesize):
+    downloader = FakeDownloader(filesize)
+    match_downloader = SimpleNamespace(data=FakeData(), youtube_downloader=downloader)
+    disk = DiskAdmission(str(tmp_path), margin_bytes=GB)
+    return MessageProcessor(SimpleNamespace(), match_downloader, scheduler=JobScheduler(name="test_prefetch"), disk=disk)
+
+
+async def test_buffered_job_is_probed_and_reserves_its_size(tmp_path, free_space):
+    processor = make_processor(tmp_path, filesize=2 * GB)
+
+    await processor._schedule({"ReceiptHandle": "r-1", "Body": json.dumps({"command": "Match_Upload", "matchId": "m1"})})
+
+    job = processor.scheduler._pending[0]
+    _, estimate, reservation = job.payload
+    assert processor.match_downloader.youtube_downloader.prefetched == ["https://app.veo.co/matches/m1/"]
+    assert estimate.filesize == reservation == 2 * GB
+    assert processor.disk.available() == 7 * GB
+
+
+async def test_reservation_waits_for_a_release(tmp_path, free_space):
+    disk = DiskAdmission(str(tmp_path), margin_bytes=GB)
+    await disk.reserve(6 * GB)
+
+    waiting = asyncio.create_task(disk.reserve(6 * GB))
+    await asyncio.sleep(0.01)
+    assert not waiting.done()
+
+    await disk.release(6 * GB)
+    await asyncio.wait_for(waiting, 1)
+    assert disk.reserved == 6 * GB
+
+
+async def test_oversized_job_is_admitted_when_nothing_else_holds_space(tmp_path, free_space):
+    disk = DiskAdmission(str(tmp_path), margin_bytes=GB)
+    await asyncio.wait_for(disk.reserve(20 * GB), 1)
+    assert disk.reserved == 20 * GB
+
+
+async def test_pixellot_stream_is_resolved_once(monkeypatch):
+    downloader = YoutubeDownloader(cookies_path=None, facebook_cookies_path=None)
+    calls = []
+
+    def extract(url):
+        calls.append(url)
+        return "https://cdn.pixellot.tv/stream.m3u8"
+
+    monkeypatch.setattr(downloader, "_extract_pixellot_m3u8", extract)
+    url = "https://vod.pixellot.tv/match/1"
+
+    assert await downloader.prefetch(url, probe=False) is None
+    assert await downloader.resolve(url) == "https://cdn.pixellot.tv/stream.m3u8"
+    assert calls == [url]
+
+
+async def test_probed_info_json_is_kept_until_its_ttl(tmp_path, monkeypatch):
+    downloader = YoutubeDownloader(cookies_path=None, facebook_cookies_path=None,
+                                   prefetch_dir=str(tmp_path), prefetch_ttl=0.05)
+    info = {"duration": 5400, "requested_formats": [{"filesize": 700}, {"filesize_approx": 300}]}
+
+    async def run_command(cmd, timeout, progress=None):
+        return json.dumps(info), "", 0
+
+    monkeypatch.setattr(downloader, "_run_command", run_command)
+    url = "https://app.veo.co/matches/abc/"
+
+    assert await downloader.probe(url) == {"duration": 5400, "filesize": 1000}
+    info_path = downloader._recall(("info", url))
+    assert json.loads(open(info_path).read()) == info
+
+    await asyncio.sleep(0.1)
+    assert downloader._recall(("info", url)) is None
+    assert list(tmp_path.iterdir()) == []
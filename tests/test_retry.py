@@ -0,0 +1,24 @@
+import pytest
+from app.queue.retry import MAX_VISIBILITY_TIMEOUT, RetryPolicy
+
+
+@pytest.mark.parametrize("attempt", range(1, 12))
+def test_delay_stays_between_half_and_full_backoff(attempt):
+    policy = RetryPolicy(base_delay=60, max_delay=3600)
+    backoff = min(3600, 60 * 2 ** (attempt - 1))
+    for _ in range(50):
+        assert backoff / 2 <= policy.delay(attempt) <= backoff
+
+
+def test_delay_never_exceeds_max_delay():
+    policy = RetryPolicy(base_delay=60, max_delay=600)
+    assert max(policy.delay(30) for _ in range(100)) <= 600
+
+
+def test_max_delay_is_capped_at_visibility_limit():
+    assert RetryPolicy(max_delay=48 * 3600).max_delay == MAX_VISIBILITY_TIMEOUT
+
+
+def test_retries_until_max_attempts():
+    policy = RetryPolicy(max_attempts=3)
+    assert [policy.should_retry(attempt) for attempt in (1, 2, 3)] == [True, True, False]
@@ -0,0 +1,42 @@
+from app.queue.scheduler import JobScheduler, ScheduledJob
+
+
+def _scheduler(jobs, aging_rate=1.0):
+    scheduler = JobScheduler(concurrency=1, capacity=len(jobs), aging_rate=aging_rate, name="test_scheduler")
+    scheduler._pending = list(jobs)
+    return scheduler
+
+
+def _job(key, cost, waited=0.0):
+    job = ScheduledJob(key, cost)
+    job.submitted_at -= waited
+    return job
+
+
+def test_picks_cheapest_job_first():
+    scheduler = _scheduler([_job("slow", 600), _job("fast", 30), _job("medium", 120)])
+    assert [scheduler._pick().key for _ in range(3)] == ["fast", "medium", "slow"]
+
+
+def test_long_waiting_job_overtakes_cheaper_ones():
+    # 600s of expected work that waited 1000s ranks below a fresh 30s job
+    scheduler = _scheduler([_job("fast", 30), _job("aged", 600, waited=1000)])
+    aged = scheduler.aged_dispatches.value
+    assert scheduler._pick().key == "aged"
+    assert scheduler.aged_dispatches.value == aged + 1
+
+
+def test_no_aging_keeps_shortest_first():
+    scheduler = _scheduler([_job("fast", 30), _job("aged", 600, waited=1000)], aging_rate=0)
+    assert scheduler._pick().key == "fast"
+
+
+async def test_drain_returns_jobs_that_never_started():
+    scheduler = JobScheduler(concurrency=1, capacity=4, name="test_scheduler_drain")
+    await scheduler.submit(_job("a", 10))
+    await scheduler.submit(_job("b", 20))
+
+    pending = await scheduler.drain()
+
+    assert sorted(job.key for job in pending) == ["a", "b"]
+    assert scheduler.draining and scheduler.free_slots == 4
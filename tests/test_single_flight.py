@@ -0,0 +1,95 @@
+import asyncio
+import os
+import pytest
+from app.data.schema import MatchVideoInfo
+from app.service.matchdownloader import MatchDownloader
+from app.service.single_flight import SingleFlight
+
+
+async def test_concurrent_callers_share_one_run():
+    flights = SingleFlight("test_flight_shared")
+    calls = []
+
+    async def work(report):
+        calls.append(report)
+        await asyncio.sleep(0.01)
+        return "video.mp4"
+
+    assert await asyncio.gather(*(flights.run(["match-1"], work) for _ in range(3))) == ["video.mp4"] * 3
+    assert len(calls) == 1
+
+
+async def test_failure_reaches_every_waiter_and_is_forgotten():
+    flights = SingleFlight("test_flight_failure")
+
+    async def work(report):
+        await asyncio.sleep(0.01)
+        raise RuntimeError("download failed")
+
+    results = await asyncio.gather(
+        *(flights.run(["match-1", "url:https://example.com/v"], work) for _ in range(3)),
+        return_exceptions=True
+    )
+    assert [type(result) for result in results] == [RuntimeError] * 3
+    assert flights.find(["match-1"]) is None
+
+
+async def test_last_waiter_cancelling_cancels_the_work():
+    flights = SingleFlight("test_flight_cancel")
+    waiter = asyncio.create_task(flights.run(["match-1"], lambda report: asyncio.Event().wait()))
+    await asyncio.sleep(0)
+    flight = flights.find(["match-1"])
+
+    waiter.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await waiter
+    assert flight.task.cancelled()
+
+
+class FakeYoutube:
+    def __init__(self):
+        self.downloads = []
+
+    def normalize_url(self, url):
+        return url
+
+    async def download(self, url, filename, progress=None):
+        self.downloads.append(filename)
+        await asyncio.sleep(0.01)
+        with open(f"{filename}.mp4", "wb") as f:
+            f.write(b"video")
+        return f"{filename}.mp4"
+
+
+class FakeData:
+    def __init__(self, matches):
+        self.matches = matches
+
+    async def get_match_video_info(self, match_id):
+        return self.matches[match_id]
+
+
+def match(match_id, home, away):
+    return MatchVideoInfo(_id=match_id, date="2026-05-01T15:00:00", home_team_string=home,
+                          away_team_string=away, match_video="https://youtu.be/shared")
+
+
+async def test_matches_sharing_a_url_download_once_under_their_own_names(tmp_path):
+    youtube = FakeYoutube()
+    downloader = MatchDownloader(youtube, FakeData({
+        "65f0000000000000000000a1": match("65f0000000000000000000a1", "Home FC", "Away FC"),
+        "65f0000000000000000000b2": match("65f0000000000000000000b2", "Reserve FC", "Other FC"),
+    }), s3_client=None, download_dir=str(tmp_path))
+
+    first, second = await asyncio.gather(
+        downloader.download_match_video("65f0000000000000000000a1"),
+        downloader.download_match_video("65f0000000000000000000b2"),
+    )
+
+    assert len(youtube.downloads) == 1
+    assert os.path.basename(first) == "HomeFCVAwayFC-2026-05-01.mp4"
+    assert os.path.basename(second) == "ReserveFCVOtherFC-2026-05-01.mp4"
+    assert downloader.match_object_key("65f0000000000000000000b2", second).endswith("ReserveFCVOtherFC-2026-05-01.mp4")
+
+    downloader.release_video(first)
+    assert not os.path.exists(first) and open(second, "rb").read() == b"video"
@@ -0,0 +1,83 @@
+import asyncio
+from collections import Counter
+import pytest
+from app.storage_keys import KeyLayout, key_from_url
+from migrate_keys import migrate_match
+
+
+def test_sharded_keys_group_a_match_under_its_prefix():
+    layout = KeyLayout(prefix="/matches/", shard_chars=2)
+    prefix = layout.match_prefix("65f0c0ffee")
+
+    assert prefix.startswith("matches/") and prefix.endswith("/65f0c0ffee/")
+    assert len(prefix.split("/")[1]) == 2
+    assert layout.match_key("65f0c0ffee", "final.mp4") == prefix + "final.mp4"
+    # the shard is stable, so existing objects can be found again
+    assert KeyLayout().match_prefix("65f0c0ffee") == prefix
+
+
+def test_flat_scheme_keeps_bare_filenames():
+    layout = KeyLayout(scheme="flat")
+    assert layout.match_key("65f0c0ffee", "final.mp4") == "final.mp4"
+    assert layout.video_key("clip.mp4") == "clip.mp4"
+
+
+def test_unknown_scheme_is_rejected():
+    with pytest.raises(ValueError):
+        KeyLayout(scheme="dated")
+
+
+@pytest.mark.parametrize("url, key", [
+    ("https://media-bucket.s3.eu-west-1.amazonaws.com/matches/ab/1/final.mp4", "matches/ab/1/final.mp4"),
+    ("https://s3.eu-west-1.amazonaws.com/media-bucket/final%20cut.mp4", "final cut.mp4"),
+    ("https://media-bucket/final.mp4", "final.mp4"),
+    ("https://youtu.be/abc", None),
+    ("https://s3.eu-west-1.amazonaws.com/other-bucket/final.mp4", None),
+    ("", None),
+])
+def test_key_from_url(url, key):
+    assert key_from_url(url, "media-bucket") == key
+
+
+class FakeS3:
+    aws_bucket = "media-bucket"
+
+    def __init__(self):
+        self.copies = []
+
+    async def copy_file(self, source_key, object_key):
+        self.copies.append((source_key, object_key))
+        return f"https://media-bucket.s3.eu-west-1.amazonaws.com/{object_key}"
+
+
+class FakeData:
+    def __init__(self):
+        self.updates = {}
+
+    async def update_match_video(self, match_id, url, key):
+        self.updates[match_id] = key
+
+
+async def migrate(match, dry_run=False):
+    s3, data, stats = FakeS3(), FakeData(), Counter()
+    await migrate_match(match, data, s3, KeyLayout(), asyncio.Semaphore(1), stats, dry_run)
+    return s3, data, stats
+
+
+async def test_flat_object_is_copied_to_the_sharded_key():
+    s3, data, stats = await migrate(
+        {"_id": "65f0c0ffee", "match_video": "https://media-bucket.s3.eu-west-1.amazonaws.com/final.mp4"}
+    )
+    new_key = KeyLayout().match_key("65f0c0ffee", "final.mp4")
+    assert s3.copies == [("final.mp4", new_key)]
+    assert data.updates == {"65f0c0ffee": new_key}
+    assert stats["migrated"] == 1
+
+
+async def test_migrated_and_dry_run_matches_are_not_copied():
+    migrated = {"_id": "65f0c0ffee", "match_video_key": KeyLayout().match_key("65f0c0ffee", "final.mp4")}
+    s3, _, stats = await migrate(migrated)
+    assert s3.copies == [] and stats["already_migrated"] == 1
+
+    s3, data, stats = await migrate({"_id": "65f0c0ffee", "match_video_key": "final.mp4"}, dry_run=True)
+    assert s3.copies == [] and data.updates == {} and stats["migrated"] == 1
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import os
+from types import SimpleNamespace
+from app.queue.message_queue_processor import MessageProcessor
+from app.queue.scheduler import JobScheduler, ScheduledJob
+from app.service.disk_admission import DiskAdmission
+from supervisor import Supervisor
+
+
+def settings(**overrides):
+    defaults = dict(
+        worker_processes=2, download_dir="/data/downloads", s3_inventory_cache_path="s3_inventory.json.gz",
+        bandwidth_ingress_bps=100, bandwidth_egress_bps=0, worker_drain_timeout_seconds=600
+    )
+    return SimpleNamespace(**{**defaults, **overrides})
+
+
+def test_workers_get_their_own_directories_and_budget_share():
+    supervisor = Supervisor(settings())
+    first, second = (supervisor._env(worker) for worker in supervisor.workers)
+
+    assert first["DOWNLOAD_DIR"] == "/data/downloads/worker-0"
+    assert second["S3_INVENTORY_CACHE_PATH"] == "/data/downloads/worker-1/s3_inventory.json.gz"
+    assert first["DISK_LEDGER_DIR"] == second["DISK_LEDGER_DIR"] == "/data/downloads/.disk-reservations"
+    assert first["BANDWIDTH_INGRESS_BPS"] == "50"
+
+
+async def test_reservations_are_counted_across_processes(tmp_path, monkeypatch):
+    monkeypatch.setattr("app.service.disk_admission.shutil.disk_usage", lambda path: SimpleNamespace(free=10000))
+    ledger = tmp_path / "ledger"
+    disk = DiskAdmission(str(tmp_path), margin_bytes=0, ledger_dir=str(ledger))
+    # a live sibling (our parent) and one that died without releasing
+    (ledger / str(os.getppid())).write_text("1000")
+    (ledger / "999999999").write_text("5000")
+
+    assert disk.available() == 9000
+    assert not (ledger / "999999999").exists()
+
+    await disk.reserve(300)
+    assert (ledger / str(os.getpid())).read_text() == "300"
+    await disk.release(300)
+    assert (ledger / str(os.getpid())).read_text() == "0"
+
+
+class FakeData:
+    def __init__(self):
+        self.statuses = {}
+
+    async def set_video_status(self, match_id, status, error=None):
+        self.statuses[match_id] = status
+
+
+class FakeQueue:
+    queue_url = "https://sqs.example.com/1/uploads"
+
+    def __init__(self):
+        self.visibility = {}
+
+    async def change_message_visibility(self, receipt_handle, timeout):
+        self.visibility[receipt_handle] = timeout
+
+
+async def test_drain_timeout_requeues_cancelled_uploads():
+    data, queue = FakeData(), FakeQueue()
+    processor = MessageProcessor(
+        queue, SimpleNamespace(data=data), scheduler=JobScheduler(name="test_drain"), drain_timeout=0.01
+    )
+    started = asyncio.Event()
+
+    async def stuck(job):
+        started.set()
+        await asyncio.Event().wait()
+
+    dispatcher = asyncio.create_task(processor.scheduler.run(stuck))
+    body = {"command": "Match_Upload", "matchId": "65f0c0ffee"}
+    processor._held["r-1"] = {"ReceiptHandle": "r-1", "Body": json.dumps(body)}
+    await processor.scheduler.submit(ScheduledJob("r-1", 10, payload=(body, None, 0)))
+    await started.wait()
+
+    await processor._finish_running()
+    dispatcher.cancel()
+
+    assert data.statuses == {"65f0c0ffee": "queued"}
+    assert queue.visibility == {"r-1": 0}
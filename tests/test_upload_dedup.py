@@ -0,0 +1,113 @@
+import asyncio
+import hashlib
+import pytest
+from app.checksum import sha256_file
+from app.service.matchdownloader import MatchDownloader
+
+CONTENT = b"match video" * 1000
+CHECKSUM = hashlib.sha256(CONTENT).hexdigest()
+
+
+class FakeExecutor:
+    async def run(self, fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+
+class FakeS3:
+    def __init__(self, objects=None):
+        self.objects = objects or {}
+        self.uploads = []
+        self.copies = []
+        self.transfer_executor = FakeExecutor()
+
+    def get_file_url(self, object_key):
+        return f"https://media.example.com/{object_key}"
+
+    async def head_file(self, object_key):
+        metadata = self.objects.get(object_key)
+        return {"Metadata": metadata} if metadata is not None else None
+
+    async def upload_file(self, file_path, object_key, metadata=None, progress=None):
+        self.uploads.append((object_key, metadata))
+        self.objects[object_key] = metadata or {}
+        return self.get_file_url(object_key)
+
+    async def copy_file(self, source_key, object_key, metadata=None):
+        self.copies.append((source_key, object_key))
+        self.objects[object_key] = metadata
+        return self.get_file_url(object_key)
+
+
+class FakeData:
+    def __init__(self, checksums=None):
+        self.checksums = checksums or {}
+
+    async def get_video_by_checksum(self, checksum):
+        return self.checksums.get(checksum)
+
+    async def save_video_checksum(self, checksum, object_key, size):
+        self.checksums[checksum] = {"_id": checksum, "object_key": object_key, "size": size}
+
+
+@pytest.fixture
+def video(tmp_path):
+    path = tmp_path / "match.mp4"
+    path.write_bytes(CONTENT)
+    return str(path)
+
+
+def make_downloader(s3, data, dedup_min_bytes=0):
+    return MatchDownloader(None, data, s3, dedup_min_bytes=dedup_min_bytes)
+
+
+def test_checksum_streams_the_whole_file(video):
+    assert sha256_file(video, chunk_size=1000) == (CHECKSUM, len(CONTENT))
+
+
+async def test_new_content_is_uploaded_with_its_checksum(video):
+    s3, data = FakeS3(), FakeData()
+
+    url = await make_downloader(s3, data).upload_match_video(video, "matches/m1/match.mp4")
+
+    assert url == "https://media.example.com/matches/m1/match.mp4"
+    assert s3.uploads == [("matches/m1/match.mp4", {"sha256": CHECKSUM})]
+    assert data.checksums[CHECKSUM]["object_key"] == "matches/m1/match.mp4"
+
+
+async def test_identical_object_under_the_key_is_not_uploaded_again(video):
+    s3 = FakeS3({"matches/m1/match.mp4": {"sha256": CHECKSUM}})
+
+    url = await make_downloader(s3, FakeData()).upload_match_video(video, "matches/m1/match.mp4")
+
+    assert url == "https://media.example.com/matches/m1/match.mp4"
+    assert s3.uploads == [] and s3.copies == []
+
+
+async def test_known_content_elsewhere_is_copied_server_side(video):
+    s3 = FakeS3({"matches/m0/match.mp4": {"sha256": CHECKSUM}})
+    data = FakeData({CHECKSUM: {"_id": CHECKSUM, "object_key": "matches/m0/match.mp4"}})
+
+    await make_downloader(s3, data).upload_match_video(video, "matches/m1/match.mp4")
+
+    assert s3.copies == [("matches/m0/match.mp4", "matches/m1/match.mp4")]
+    assert s3.uploads == []
+
+
+async def test_stale_checksum_record_falls_back_to_upload(video):
+    s3 = FakeS3({"matches/m0/match.mp4": {"sha256": "something else"}})
+    data = FakeData({CHECKSUM: {"_id": CHECKSUM, "object_key": "matches/m0/match.mp4"}})
+
+    await make_downloader(s3, data).upload_match_video(video, "matches/m1/match.mp4")
+
+    assert s3.copies == []
+    assert [key for key, _ in s3.uploads] == ["matches/m1/match.mp4"]
+
+
+async def test_small_files_skip_hashing(video):
+    s3 = FakeS3({"matches/m1/match.mp4": {"sha256": CHECKSUM}})
+
+    await make_downloader(s3, FakeData(), dedup_min_bytes=len(CONTENT) + 1).upload_match_video(
+        video, "matches/m1/match.mp4"
+    )
+
+    assert s3.uploads == [("matches/m1/match.mp4", None)]
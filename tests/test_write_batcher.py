@@ -0,0 +1,61 @@
+import asyncio
+from pymongo.errors import BulkWriteError
+from app.data.write_batcher import MatchWriteBatcher
+
+
+class FakeCollection:
+    def __init__(self, fail_indexes=()):
+        self.fail_indexes = set(fail_indexes)
+        self.batches = []
+
+    def with_options(self, write_concern=None):
+        self.write_concern = write_concern
+        return self
+
+    async def bulk_write(self, operations, ordered=True):
+        self.batches.append(operations)
+        if self.fail_indexes:
+            raise BulkWriteError({"writeErrors": [{"index": index, "errmsg": "bad update"} for index in self.fail_indexes]})
+
+
+async def test_writes_within_the_delay_share_one_bulk_write():
+    collection = FakeCollection()
+    batcher = MatchWriteBatcher(collection, max_batch_size=100, max_delay=0.01)
+
+    results = await asyncio.gather(*(batcher.update_one({"_id": i}, {"$set": {"n": i}}) for i in range(5)))
+
+    assert results == [True] * 5
+    assert [len(batch) for batch in collection.batches] == [5]
+    assert collection.write_concern.document == {"w": "majority", "j": True}
+
+
+async def test_full_batch_flushes_without_waiting():
+    collection = FakeCollection()
+    batcher = MatchWriteBatcher(collection, max_batch_size=2, max_delay=60)
+
+    await asyncio.wait_for(asyncio.gather(*(batcher.update_one({"_id": i}, {"$set": {}}) for i in range(4))), 1)
+
+    assert [len(batch) for batch in collection.batches] == [2, 2]
+
+
+async def test_only_the_failed_write_raises():
+    batcher = MatchWriteBatcher(FakeCollection(fail_indexes=[1]), max_delay=0.01)
+
+    results = await asyncio.gather(
+        *(batcher.update_one({"_id": i}, {"$set": {}}) for i in range(3)), return_exceptions=True
+    )
+
+    assert results[0] is True and results[2] is True
+    assert isinstance(results[1], RuntimeError)
+
+
+async def test_close_flushes_pending_writes():
+    collection = FakeCollection()
+    batcher = MatchWriteBatcher(collection, max_delay=60)
+    write = asyncio.create_task(batcher.update_one({"_id": 1}, {"$set": {}}))
+    await asyncio.sleep(0)
+
+    await batcher.close()
+
+    assert await write is True
+    assert len(collection.batches) == 1
@@ -0,0 +1,53 @@
+# Enqueues matches as soon as an external match_video lands in mergedmatches.
+#
+# Change streams need a replica set. For local testing a single node is enough:
+#   mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+#   mongosh --eval 'rs.initiate()'
+#   DATABASE_CONNECTION_STRING="mongodb://localhost:27017/?replicaSet=rs0" python watcher.py
+import asyncio
+from motor.motor_asyncio import AsyncIOMotorClient
+from app.config import Settings
+from app.data.data import Data
+from app.queue.sqs_client import SqsClient
+from app.downloader import YoutubeDownloader
+from app.queue.enqueuer import Enqueuer
+from app.queue.lanes import LaneRouter, lane_queue_clients
+from app.service.match_watcher import MatchVideoWatcher
+
+
+async def main():
+    settings = Settings()
+
+    sqs_client = SqsClient(
+        aws_access_key=settings.aws_access_key,
+        aws_region=settings.aws_region,
+        aws_secret_key=settings.aws_secret_key,
+        aws_queue_url=settings.sqs_queue_url,
+        max_workers=settings.sqs_max_workers,
+        max_pool_connections=settings.sqs_max_pool_connections
+    )
+
+    mongodb_client = AsyncIOMotorClient(settings.database_connection_string)
+    mongodb = mongodb_client[settings.database_name]
+    data_service = Data(database=mongodb)
+    await data_service.ensure_indexes()
+
+    router = LaneRouter(
+        data=data_service,
+        youtube_downloader=YoutubeDownloader(),
+        default_client=sqs_client,
+        clients=lane_queue_clients(settings)
+    )
+    enqueuer = Enqueuer(
+        sqs_client=sqs_client,
+        database=mongodb,
+        dedup_window=settings.enqueue_dedup_window_seconds,
+        router=router
+    )
+    await enqueuer.ensure_indexes()
+
+    watcher = MatchVideoWatcher(database=mongodb, data=data_service, enqueuer=enqueuer)
+    await watcher.run()
+
+if __name__ == "__main__":
+    asyncio.run(main())
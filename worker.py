@@ -1,43 +1,223 @@
 import asyncio
+import os
+import signal
 from app.queue.message_queue_processor import MessageProcessor
 from app.s3_client import S3client
+from app.bandwidth import BandwidthGovernor, TransferClass
+from app.fragment_tuning import FragmentTuner
+from app.attempt_store import AttemptStore
+from app.loop_monitor import LoopMonitor
 from app.data.data import Data
 from app.downloader import YoutubeDownloader
 from app.queue.sqs_client import SqsClient
 from motor.motor_asyncio import AsyncIOMotorClient
 from app.config import Settings
+from app.data.leases import LeaseManager
+from app.queue.cost_model import ThroughputModel
+from app.queue.scheduler import JobScheduler
+from app.queue.retry import RetryPolicy
+from app.queue.enqueuer import Enqueuer
+from app.queue.lanes import Lane, lane_queue_clients
+from app.service.disk_admission import DiskAdmission
+from app.storage_keys import KeyLayout
+import logging
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
 async def main():
     settings = Settings()
 
+    loop_monitor = None
+    if settings.loop_monitor_enabled:
+        # worker metrics are not served over http, so the lag summary goes to the log
+        loop_monitor = LoopMonitor(
+            interval=settings.loop_monitor_interval_seconds,
+            threshold=settings.loop_monitor_threshold_seconds,
+            report_interval=300
+        )
+        loop_monitor.start()
+
+    governor = BandwidthGovernor(
+        ingress_bps=settings.bandwidth_ingress_bps,
+        egress_bps=settings.bandwidth_egress_bps,
+        shared_link=settings.bandwidth_shared_link,
+        weights={
+            TransferClass.DOWNLOAD: settings.bandwidth_download_weight,
+            TransferClass.UPLOAD: settings.bandwidth_upload_weight,
+        },
+        # every running job can hold one yt-dlp download
+        fixed_slots=sum(settings.worker_lanes.values()) or settings.worker_concurrency
+    )
+
     s3_client = S3client(
         aws_access_key=settings.aws_access_key,
         aws_secret_key=settings.aws_secret_key,
         aws_region=settings.aws_region,
-        aws_bucket=settings.aws_bucket
+        aws_bucket=settings.aws_bucket,
+        max_workers=settings.s3_max_workers,
+        max_pool_connections=settings.s3_max_pool_connections,
+        transfer_concurrency=settings.s3_transfer_concurrency,
+        transfer_workers=settings.s3_transfer_workers,
+        governor=governor
     )
 
+    # every subscribed lane keeps a thread busy in a long poll
+    sqs_workers = settings.sqs_max_workers + len(settings.worker_lanes)
     sqs_client = SqsClient(
         aws_access_key=settings.aws_access_key,
         aws_region=settings.aws_region,
         aws_secret_key=settings.aws_secret_key,
-        aws_queue_url=settings.sqs_queue_url
+        aws_queue_url=settings.sqs_queue_url,
+        max_workers=sqs_workers,
+        max_pool_connections=settings.sqs_max_pool_connections
+    )
+
+    dead_letter_client = None
+    if settings.sqs_dead_letter_queue_url:
+        dead_letter_client = SqsClient(
+            aws_access_key=settings.aws_access_key,
+            aws_region=settings.aws_region,
+            aws_secret_key=settings.aws_secret_key,
+            aws_queue_url=settings.sqs_dead_letter_queue_url,
+            max_workers=sqs_workers,
+            max_pool_connections=settings.sqs_max_pool_connections
+        )
+    retry_policy = RetryPolicy(
+        base_delay=settings.retry_base_delay_seconds,
+        max_delay=settings.retry_max_delay_seconds,
+        max_attempts=settings.retry_max_attempts
     )
 
+    # supervised workers keep the inventory cache in their download directory
+    os.makedirs(settings.download_dir, exist_ok=True)
+    inventory_task = None
+    if settings.s3_inventory_enabled:
+        inventory = s3_client.enable_inventory(
+            prefix=settings.s3_inventory_prefix,
+            cache_path=settings.s3_inventory_cache_path,
+            refresh_interval=settings.s3_inventory_refresh_seconds
+        )
+        inventory_task = asyncio.create_task(inventory.run_refresh_loop())
+
     mongodb_client = AsyncIOMotorClient(settings.database_connection_string)
     mongodb = mongodb_client[settings.database_name]
     data_service = Data(database=mongodb)
-    youtube_downloader = YoutubeDownloader()
+    await data_service.ensure_indexes()
+    data_service.enable_match_cache(max_size=settings.match_cache_size, ttl=settings.match_cache_ttl)
+    if settings.mongo_write_batching:
+        data_service.enable_write_batching(
+            max_batch_size=settings.mongo_write_batch_size,
+            max_delay=settings.mongo_write_batch_delay
+        )
+    fragment_tuner = FragmentTuner(
+        database=mongodb,
+        ttl=settings.fragment_tuning_ttl_seconds,
+        max_concurrency=settings.fragment_max_concurrency,
+        max_tor_concurrency=settings.fragment_max_tor_concurrency
+    )
+    await fragment_tuner.ensure_indexes()
+    await fragment_tuner.load()
+
+    attempt_store = AttemptStore(settings.attempt_store_path, retention_days=settings.attempt_retention_days)
+
+    youtube_downloader = YoutubeDownloader(
+        prefetch_dir=os.path.join(settings.download_dir, ".prefetch"),
+        prefetch_ttl=settings.prefetch_ttl_seconds,
+        governor=governor,
+        tuner=fragment_tuner,
+        attempt_store=attempt_store
+    )
+    disk = DiskAdmission(
+        settings.download_dir,
+        margin_bytes=settings.disk_reserve_margin_bytes,
+        ledger_dir=settings.disk_ledger_dir
+    )
 
     from app.service.matchdownloader import MatchDownloader
     match_downloader = MatchDownloader(
         youtube_downloader=youtube_downloader,
         data=data_service,
-        s3_client=s3_client
+        s3_client=s3_client,
+        key_layout=KeyLayout(
+            scheme=settings.s3_key_scheme,
+            prefix=settings.s3_key_prefix,
+            shard_chars=settings.s3_key_shard_chars
+        ),
+        download_dir=settings.download_dir,
+        unavailable_ttl=settings.unavailable_ttl_seconds,
+        dedup_min_bytes=settings.upload_dedup_min_bytes
     )
 
-    processor = MessageProcessor(sqs_client=sqs_client, match_downloader=match_downloader)
-    await processor.poll_messages()
+    lease_manager = LeaseManager(
+        database=mongodb,
+        ttl=settings.lease_ttl_seconds,
+        heartbeat_interval=settings.lease_heartbeat_seconds
+    )
+    await lease_manager.ensure_indexes()
+
+    # only to release the dedup claims of dead-lettered messages, the worker never enqueues
+    enqueuer = Enqueuer(
+        sqs_client=sqs_client,
+        database=mongodb,
+        dedup_window=settings.enqueue_dedup_window_seconds
+    )
+
+    cost_model = ThroughputModel(database=mongodb)
+    await cost_model.load()
+    # one poller and scheduler per subscribed queue; lanes that share a queue add up their concurrency
+    lane_clients = lane_queue_clients(settings, max_workers=sqs_workers)
+    subscriptions = {}
+    for lane_name, concurrency in settings.worker_lanes.items():
+        client = lane_clients.get(Lane(lane_name), sqs_client)
+        names, total = subscriptions.get(client, ([], 0))
+        subscriptions[client] = (names + [lane_name], total + concurrency)
+    if not subscriptions:
+        subscriptions[sqs_client] = (["default"], settings.worker_concurrency)
+
+    processors = []
+    for client, (names, concurrency) in subscriptions.items():
+        logger.info(f"Consuming lanes {names} from {client.queue_url} with concurrency {concurrency}")
+        scheduler = JobScheduler(
+            concurrency=concurrency,
+            capacity=max(settings.scheduler_buffer_size, concurrency),
+            aging_rate=settings.scheduler_aging_rate,
+            name=f"scheduler.{'+'.join(names)}"
+        )
+        processors.append(MessageProcessor(
+            sqs_client=client,
+            match_downloader=match_downloader,
+            lease_manager=lease_manager,
+            scheduler=scheduler,
+            cost_model=cost_model,
+            probe=settings.scheduler_probe,
+            disk=disk,
+            default_job_bytes=settings.disk_default_job_bytes,
+            retry_policy=retry_policy,
+            dead_letter_client=dead_letter_client,
+            drain_timeout=settings.worker_drain_timeout_seconds,
+            enqueuer=enqueuer
+        ))
+
+    # SIGTERM (deploys, the supervisor) drains: stop polling, hand buffered messages back, let running jobs finish
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(
+            sig,
+            lambda: [asyncio.ensure_future(processor.stop()) for processor in processors]
+        )
+
+    try:
+        await asyncio.gather(*(processor.poll_messages() for processor in processors))
+        logger.info("Worker drained, exiting")
+    finally:
+        if inventory_task:
+            inventory_task.cancel()
+            await asyncio.gather(inventory_task, return_exceptions=True)
+        if loop_monitor:
+            loop_monitor.stop()
+        await data_service.close()
+        attempt_store.close()
 
 if __name__ == "__main__":
     asyncio.run(main())